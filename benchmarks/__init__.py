@@ -0,0 +1,10 @@
+"""
+離線效能測試 - 以記錄的 Yahoo/證交所/公開資訊觀測站回應重播，量測分析熱點路徑
+
+使用方式:
+- python -m benchmarks.fixtures generate --stocks 2000   產生可重現的合成資料
+- python -m benchmarks.fixtures record --stocks 2000     由正式端點記錄回應 (需要網路)
+- python -m benchmarks.run                               執行效能測試並與基準比較
+- python -m benchmarks.stub_server serve --port 8765      啟動本機替身伺服器 (搭配 STUB_BASE_URL 使用)
+- python -m benchmarks.stub_server load --stocks 500      以替身伺服器執行各抓取路徑並輸出請求統計
+"""
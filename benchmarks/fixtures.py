@@ -0,0 +1,441 @@
+"""
+效能測試資料模組 - 記錄與重播 Yahoo Finance、證交所 MI_INDEX/ISIN 與公開資訊觀測站的回應
+
+資料目錄 (預設 benchmarks/fixtures/default/):
+- manifest.json        來源 (recorded/synthetic)、股票數、建立時間
+- yahoo_history.pkl.gz 各代號的日K資料 {Yahoo 代號: DataFrame(Open, High, Low, Close, Volume)}
+- yahoo_info.json      各代號的 yf.Ticker(...).info
+- mi_index.json        MI_INDEX 回應
+- isin.html            ISIN C_public.jsp 回應 (big5)
+- mops_eps.html        ajax_t05st09_1 回應
+- mops_dividend.html   ajax_t05st34 回應
+"""
+print("[bench_fixtures] ✅ 已載入最新版")
+
+import os
+import re
+import sys
+import gzip
+import json
+import pickle
+import socket
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+
+from modules.data.price_history import period_to_days, to_yahoo_symbol
+from modules.data.price_archive import last_settled_time
+from modules.data.market_snapshot import MI_INDEX_PATH
+from modules.data.endpoints import DEFAULT_BASE_URLS
+
+# 資料目錄
+FIXTURES_ROOT = os.path.join(os.path.dirname(__file__), 'fixtures')
+DEFAULT_FIXTURES = os.path.join(FIXTURES_ROOT, 'default')
+
+# 重播的端點：(網址片段, 資料檔, Content-Type, 編碼)
+HTTP_FIXTURES = [
+    ('exchangeReport/MI_INDEX', 'mi_index.json', 'application/json; charset=utf-8', 'utf-8'),
+    ('isin/C_public.jsp', 'isin.html', 'text/html; charset=big5', 'big5'),
+    ('mops/web/ajax_t05st09', 'mops_eps.html', 'text/html; charset=utf-8', 'utf-8'),
+    ('mops/web/ajax_t05st34', 'mops_dividend.html', 'text/html; charset=utf-8', 'utf-8'),
+    ('finance.yahoo.com/quote/', None, 'text/html; charset=utf-8', 'utf-8'),  # 連線測試，只需 200
+]
+# 記錄時一律連到正式端點 (不受替身伺服器設定影響)
+MI_INDEX_URL = DEFAULT_BASE_URLS['twse'] + MI_INDEX_PATH
+ISIN_URL = DEFAULT_BASE_URLS['isin'] + "/isin/C_public.jsp?strMode=2"
+MOPS_EPS_URL = DEFAULT_BASE_URLS['mops'] + "/mops/web/ajax_t05st09_1"
+MOPS_DIVIDEND_URL = DEFAULT_BASE_URLS['mops'] + "/mops/web/ajax_t05st34"
+
+# 市場指數 (情緒分析使用)
+INDEX_SYMBOLS = ["^TWII", "^N225", "^HSI", "^GSPC", "^IXIC"]
+
+# 合成資料的產業別
+INDUSTRIES = ["半導體業", "電子零組件業", "金融保險業", "航運業", "鋼鐵工業", "塑膠工業", "食品工業", "光電業"]
+
+# MI_INDEX 個股行情表欄位
+MI_INDEX_FIELDS = ["證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額", "開盤價", "最高價",
+                   "最低價", "收盤價", "漲跌(+/-)", "漲跌價差", "最後揭示買價", "最後揭示買量",
+                   "最後揭示賣價", "最後揭示賣量", "本益比"]
+
+
+class FixtureSet:
+    """
+    一組記錄的回應
+
+    - http_response：依網址片段取得 HTTP 端點的回應主體
+    - download / ticker_info：重播 yf.download 與 yf.Ticker(...).info
+    - limit：只重播前 N 檔股票 (依 MI_INDEX 順序)，用於不同規模的效能測試
+    """
+
+    def __init__(self, root=DEFAULT_FIXTURES, limit=None):
+        """
+        載入資料目錄
+
+        參數:
+        - root: 資料目錄
+        - limit: 只重播前 limit 檔股票，None 表示全部
+        """
+        self.root = root
+        with open(os.path.join(root, 'manifest.json'), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        with gzip.open(os.path.join(root, 'yahoo_history.pkl.gz'), 'rb') as f:
+            self.history = pickle.load(f)
+        with open(os.path.join(root, 'yahoo_info.json'), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+
+        self.stock_ids = list(self.manifest["stock_ids"])
+        if limit is not None:
+            self.stock_ids = self.stock_ids[:limit]
+        self._allowed = set(self.stock_ids)
+        self._bodies = {}
+
+    def _load_body(self, filename):
+        """讀取 HTTP 回應主體 (依 limit 截斷股票清單)"""
+        if filename not in self._bodies:
+            with open(os.path.join(self.root, filename), 'rb') as f:
+                body = f.read()
+            if filename == 'mi_index.json':
+                data = json.loads(body)
+                for table in data.get("tables", []):
+                    if "證券代號" in (table.get("fields") or []):
+                        table["data"] = [row for row in table["data"] if row[0] in self._allowed]
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            elif filename == 'isin.html':
+                body = self._limit_isin(body)
+            self._bodies[filename] = body
+        return self._bodies[filename]
+
+    def _limit_isin(self, body):
+        """只保留前 limit 檔股票的 ISIN 資料列 (標題與分類列保留)"""
+        text = body.decode('big5', errors='replace')
+
+        def keep(match):
+            cell = re.search(r'<td[^>]*>\s*([^<]*)', match.group(0), re.I)
+            code = cell.group(1).split('　')[0].strip() if cell else ''
+            return match.group(0) if not code.isdigit() or code in self._allowed else ''
+
+        text = re.sub(r'<tr[^>]*>.*?</tr>', keep, text, flags=re.I | re.S)
+        return text.encode('big5', errors='replace')
+
+    def http_response(self, url):
+        """
+        取得網址對應的回應
+
+        參數:
+        - url: 請求網址
+
+        返回:
+        - (狀態碼, Content-Type, 編碼, 回應主體 bytes)，沒有記錄的網址返回 404
+        """
+        for fragment, filename, content_type, encoding in HTTP_FIXTURES:
+            if fragment in url:
+                body = self._load_body(filename) if filename else b'<html></html>'
+                return 200, content_type, encoding, body
+        return 404, 'text/plain', 'utf-8', b'not recorded'
+
+    def frame(self, symbol, period=None, start=None, end=None):
+        """
+        取得單一代號的日K資料 (依 period 或 start/end 截取)
+
+        參數:
+        - symbol: Yahoo 代號
+        - period: yfinance period 字串
+        - start: 起始日期
+        - end: 結束日期 (不含)
+
+        返回:
+        - DataFrame，沒有資料時返回 None
+        """
+        stock_id = symbol.split('.')[0]
+        if not symbol.startswith('^') and stock_id not in self._allowed:
+            return None
+        df = self.history.get(symbol)
+        if df is None or df.empty:
+            return None
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+            if end is not None:
+                df = df[df.index < pd.Timestamp(end)]
+        elif period:
+            df = df[df.index > df.index[-1] - pd.Timedelta(days=period_to_days(period))]
+        return df
+
+    def download(self, tickers, period=None, start=None, end=None, **kwargs):
+        """重播 yf.download (以 group_by='ticker' 的多層欄位格式返回)"""
+        if isinstance(tickers, str):
+            tickers = tickers.split()
+        frames = {}
+        for symbol in tickers:
+            df = self.frame(symbol, period=period, start=start, end=end)
+            if df is not None and not df.empty:
+                frames[symbol] = df
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1)
+
+    def ticker_info(self, symbol):
+        """重播 yf.Ticker(...).info"""
+        stock_id = symbol.split('.')[0]
+        if not symbol.startswith('^') and stock_id not in self._allowed:
+            return {}
+        return dict(self.info.get(symbol) or {})
+
+
+class _ReplayTicker:
+    """替代 yf.Ticker，只提供程式使用到的 info 與 history"""
+
+    def __init__(self, fixtures, symbol):
+        self._fixtures = fixtures
+        self.ticker = symbol
+
+    @property
+    def info(self):
+        return self._fixtures.ticker_info(self.ticker)
+
+    def history(self, period="1mo", start=None, end=None, **kwargs):
+        df = self._fixtures.frame(self.ticker, period=period, start=start, end=end)
+        return df.copy() if df is not None else pd.DataFrame()
+
+
+def build_response(url, status, content_type, encoding, body):
+    """
+    建立 requests.Response 物件
+
+    參數:
+    - url: 請求網址
+    - status: 狀態碼
+    - content_type: Content-Type
+    - encoding: 文字編碼
+    - body: 回應主體
+
+    返回:
+    - requests.Response 物件
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.reason = "OK" if status == 200 else "Not Found"
+    response._content = body
+    response.headers['Content-Type'] = content_type
+    response.encoding = encoding
+    response.url = url
+    return response
+
+
+@contextmanager
+def replay(fixtures):
+    """
+    在區塊內以記錄的回應取代網路請求 (yf.download、yf.Ticker、requests 與 MOPS 的連線測試)，
+    沒有記錄的網址返回 404，不會連到正式端點
+
+    參數:
+    - fixtures: FixtureSet 實例
+    """
+    def request(session, method, url, **kwargs):
+        return build_response(url, *fixtures.http_response(url))
+
+    def connect_ex(sock, address):
+        return 0
+
+    with mock.patch.object(requests.Session, 'request', request), \
+            mock.patch.object(socket.socket, 'connect_ex', connect_ex), \
+            mock.patch.object(yf, 'download', fixtures.download), \
+            mock.patch.object(yf, 'Ticker', lambda symbol, *a, **k: _ReplayTicker(fixtures, symbol)):
+        yield fixtures
+
+
+def _format_number(value, decimals=2):
+    """依證交所格式輸出數字 (千分位逗號)"""
+    return f"{value:,.{decimals}f}" if decimals else f"{int(value):,}"
+
+
+def _write_fixtures(root, source, stock_ids, history, info, bodies):
+    """寫入資料目錄"""
+    os.makedirs(root, exist_ok=True)
+    with gzip.open(os.path.join(root, 'yahoo_history.pkl.gz'), 'wb') as f:
+        pickle.dump(history, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(root, 'yahoo_info.json'), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, separators=(',', ':'))
+    for filename, body in bodies.items():
+        with open(os.path.join(root, filename), 'wb') as f:
+            f.write(body)
+    manifest = {
+        "source": source,
+        "created_at": datetime.now().isoformat(),
+        "stocks": len(stock_ids),
+        "stock_ids": stock_ids,
+    }
+    with open(os.path.join(root, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"[bench_fixtures] ✅ 已寫入 {len(stock_ids)} 檔股票的{source}資料: {root}")
+
+
+def generate_fixtures(root=DEFAULT_FIXTURES, stocks=2000, bars=250, seed=20240101):
+    """
+    產生可重現的合成資料 (格式與記錄的回應相同)
+
+    參數:
+    - root: 資料目錄
+    - stocks: 股票數
+    - bars: 每檔股票的日K數
+    - seed: 亂數種子
+    """
+    rng = np.random.default_rng(seed)
+    settled = last_settled_time()
+    dates = pd.bdate_range(end=settled.date(), periods=bars)
+    stock_ids = [str(1101 + i) for i in range(stocks)]
+
+    history, info = {}, {}
+    for symbol in [to_yahoo_symbol(sid) for sid in stock_ids] + INDEX_SYMBOLS:
+        base = 20000.0 if symbol.startswith('^') else float(rng.uniform(10, 600))
+        close = base * np.exp(np.cumsum(rng.normal(0.0003, 0.02, bars)))
+        spread = close * rng.uniform(0.002, 0.03, bars)
+        open_ = close + rng.normal(0, 0.3, bars) * spread
+        history[symbol] = pd.DataFrame({
+            "Open": open_,
+            "High": np.maximum(open_, close) + spread * rng.random(bars),
+            "Low": np.minimum(open_, close) - spread * rng.random(bars),
+            "Close": close,
+            "Volume": rng.integers(1_000, 5_000_000, bars).astype(float),
+        }, index=dates)
+
+    rows, isin_rows, eps_rows, dividend_rows = [], [], [], []
+    for i, sid in enumerate(stock_ids):
+        df = history[to_yahoo_symbol(sid)]
+        last, prev = df.iloc[-1], df.iloc[-2]
+        name = f"測試{i:04d}"
+        industry = INDUSTRIES[i % len(INDUSTRIES)]
+        eps = round(float(rng.normal(3, 4)), 2)
+        dividend = round(max(0.0, float(rng.normal(2, 1.5))), 2)
+        pe = round(float(last["Close"]) / eps, 2) if eps > 0 else 0.0
+        info[to_yahoo_symbol(sid)] = {
+            "shortName": name, "longName": name, "industry": industry, "sector": industry,
+            "trailingPE": pe or None, "trailingEPS": eps, "dividendYield": dividend / float(last["Close"]),
+            "marketCap": int(last["Close"] * rng.integers(10**7, 10**10)), "currency": "TWD",
+        }
+        change = float(last["Close"] - prev["Close"])
+        rows.append([
+            sid, name, _format_number(last["Volume"], 0), _format_number(rng.integers(10, 9000), 0),
+            _format_number(last["Volume"] * last["Close"], 0), _format_number(last["Open"]),
+            _format_number(last["High"]), _format_number(last["Low"]), _format_number(last["Close"]),
+            "+" if change >= 0 else "-", _format_number(abs(change)), _format_number(last["Close"]), "10",
+            _format_number(last["Close"]), "10", _format_number(pe),
+        ])
+        isin_rows.append(f"<tr><td>{sid}　{name}</td><td>TW000{sid}00{i % 10}</td><td>2000/01/01</td>"
+                         f"<td>上市</td><td>{industry}</td><td>ESVUFR</td><td></td></tr>")
+        eps_rows.append(f"<tr><td>{sid}</td><td>{name}</td><td>{eps}</td></tr>")
+        dividend_rows.append(f"<tr><td>{sid}</td><td>{name}</td><td>{dividend}</td></tr>")
+
+    for symbol in INDEX_SYMBOLS:
+        info[symbol] = {"shortName": symbol, "currency": "USD"}
+
+    mi_index = {
+        "stat": "OK",
+        "date": settled.strftime("%Y%m%d"),
+        "tables": [
+            {"title": "價格指數", "fields": ["指數", "收盤指數"], "data": [["發行量加權股價指數", "20,000.00"]]},
+            {"title": "每日收盤行情(全部)", "fields": MI_INDEX_FIELDS, "data": rows},
+        ],
+    }
+    isin = ("<html><body><table>\n"
+            "<tr><td>有價證券代號及名稱</td><td>國際證券辨識號碼(ISIN Code)</td><td>上市日</td>"
+            "<td>市場別</td><td>產業別</td><td>CFICode</td><td>備註</td></tr>\n"
+            "<tr><td>股票</td><td></td><td></td><td></td><td></td><td></td><td></td></tr>\n"
+            + "\n".join(isin_rows) + "\n</table></body></html>")
+
+    def mops_page(column, table_rows):
+        return ("<html><body><table><tr><td>本資料由各公司提供</td></tr></table>\n"
+                f"<table><tr><th>公司代號</th><th>公司名稱</th><th>{column}</th></tr>\n"
+                + "\n".join(table_rows) + "\n</table></body></html>").encode('utf-8')
+
+    bodies = {
+        'mi_index.json': json.dumps(mi_index, ensure_ascii=False).encode('utf-8'),
+        'isin.html': isin.encode('big5', errors='replace'),
+        'mops_eps.html': mops_page("基本每股盈餘（元）", eps_rows),
+        'mops_dividend.html': mops_page("現金股利", dividend_rows),
+    }
+    _write_fixtures(root, "synthetic", stock_ids, history, info, bodies)
+
+
+def record_fixtures(root=DEFAULT_FIXTURES, stocks=2000, period="1y", info_limit=100):
+    """
+    由正式端點記錄回應 (需要網路；依速率限制下載，2000 檔約需數分鐘)
+
+    參數:
+    - root: 資料目錄
+    - stocks: 記錄的股票數 (依 MI_INDEX 成交金額排序)
+    - period: 日K期間
+    - info_limit: 記錄 yf.Ticker(...).info 的股票數 (其餘重播時返回空字典)
+    """
+    from modules.data.connection_manager import create_robust_session
+    from modules.data.market_snapshot import find_quote_table, parse_quote_table
+    from modules.data.price_history import download_price_batch, get_ticker_info
+
+    session = create_robust_session()
+    bodies = {'mi_index.json': session.get(MI_INDEX_URL, timeout=30).content,
+              'isin.html': session.get(ISIN_URL, timeout=30).content}
+    for filename, url, form in (
+            ('mops_eps.html', MOPS_EPS_URL, {"encodeURIComponent": "1", "step": "1", "firstin": "1", "off": "1",
+                                             "TYPEK": "sii", "year": str(datetime.now().year - 1911),
+                                             "season": str(max(1, (datetime.now().month - 1) // 3))}),
+            ('mops_dividend.html', MOPS_DIVIDEND_URL, {"encodeURIComponent": "1", "step": "1", "firstin": "1",
+                                                       "off": "1", "TYPEK": "sii"})):
+        try:
+            bodies[filename] = session.post(url, data=form, timeout=30).content
+        except requests.exceptions.RequestException as e:
+            print(f"[bench_fixtures] ⚠️ 記錄 {filename} 失敗: {e}")
+            bodies[filename] = b'<html></html>'
+
+    quotes = parse_quote_table(find_quote_table(json.loads(bodies['mi_index.json'])))
+    ranked = quotes["turnover"].dropna().sort_values(ascending=False).index.astype(str)
+    stock_ids = [sid for sid in ranked if len(sid) == 4 and sid.isdigit()][:stocks]
+
+    frames = download_price_batch(stock_ids + INDEX_SYMBOLS, period=period)
+    history = {to_yahoo_symbol(sid): frame for sid, frame in frames.items()}
+    info = {}
+    for sid in stock_ids[:info_limit]:
+        try:
+            info[to_yahoo_symbol(sid)] = get_ticker_info(sid)
+        except Exception as e:
+            print(f"[bench_fixtures] ⚠️ 記錄 {sid} 基本資訊失敗: {e}")
+    _write_fixtures(root, "recorded", stock_ids, history, info, bodies)
+
+
+def ensure_fixtures(root=DEFAULT_FIXTURES, stocks=2000):
+    """
+    確認資料目錄存在且股票數足夠，否則產生合成資料
+
+    參數:
+    - root: 資料目錄
+    - stocks: 需要的股票數
+    """
+    manifest_file = os.path.join(root, 'manifest.json')
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            if json.load(f).get("stocks", 0) >= stocks:
+                return
+    generate_fixtures(root, stocks=stocks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="產生或記錄效能測試資料")
+    parser.add_argument("action", choices=["generate", "record"])
+    parser.add_argument("--root", default=DEFAULT_FIXTURES, help="資料目錄")
+    parser.add_argument("--stocks", type=int, default=2000, help="股票數")
+    parser.add_argument("--bars", type=int, default=250, help="合成資料的日K數")
+    parser.add_argument("--info-limit", type=int, default=100, help="記錄基本資訊的股票數")
+    args = parser.parse_args(argv)
+
+    if args.action == "generate":
+        generate_fixtures(args.root, stocks=args.stocks, bars=args.bars)
+    else:
+        record_fixtures(args.root, stocks=args.stocks, info_limit=args.info_limit)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
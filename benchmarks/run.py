@@ -0,0 +1,388 @@
+"""
+效能測試執行模組 - 以重播的回應量測分析熱點路徑在不同股票數下的耗時、吞吐量與記憶體用量，
+結果寫入 benchmarks/results/ 並與基準結果比較
+
+每個 (測試項目, 股票數) 在獨立的子行程執行，快取目錄指向暫存目錄，峰值 RSS 互不影響；
+速率限制在測試時放寬，量測的是解析與計算本身而非等待令牌的時間
+"""
+print("[bench] ✅ 已載入最新版")
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource，不記錄峰值 RSS
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+BASELINE_FILE = os.path.join(RESULTS_DIR, 'baseline.json')
+
+# 預設的股票數與重複次數
+BENCH_SIZES = [40, 100, 1000, 2000]
+BENCH_REPEATS = int(os.getenv("BENCH_REPEATS", "3"))
+
+# analyze_stock_value 逐檔量測延遲的最多股票數
+BENCH_STOCK_VALUE_SAMPLE = int(os.getenv("BENCH_STOCK_VALUE_SAMPLE", "40"))
+
+# 每個子行程的時間上限 (秒)
+BENCH_TIMEOUT = int(os.getenv("BENCH_TIMEOUT", "900"))
+
+# p50 比基準慢超過此比例 (且超過最小差距) 視為退步
+BENCH_REGRESSION_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.2"))
+BENCH_REGRESSION_MIN_SECONDS = float(os.getenv("BENCH_REGRESSION_MIN_SECONDS", "0.05"))
+
+# 子行程的環境設定：不跨行程共用令牌桶、不使用 HTTP 快取、放寬速率限制、不寫追蹤剖析
+CHILD_ENV = {
+    "RATE_LIMITER_SHARED": "false",
+    "HTTP_CACHE_ENABLED": "false",
+    "TRACING_ENABLED": "false",
+    "RATE_LIMIT_YAHOO_FINANCE": "100000",
+    "RATE_BURST_YAHOO_FINANCE": "100000",
+    "RATE_LIMIT_TWSE": "100000",
+    "RATE_BURST_TWSE": "100000",
+    "RATE_LIMIT_MOPS": "100000",
+    "RATE_BURST_MOPS": "100000",
+}
+
+
+def isolate_state(state_dir):
+    """
+    將各模組的快取與共用實例指向暫存目錄 (不讀寫專案的 cache/)
+
+    參數:
+    - state_dir: 暫存目錄
+    """
+    from modules.data import market_snapshot, stock_master, price_archive, price_history, rate_limiter
+    from modules.data import connection_manager
+    from modules.data import scraper, finance_yahoo  # noqa: F401 (載入後一併替換 CACHE_DIR)
+    from modules.analysis import indicator_state, sentiment, recommender  # noqa: F401
+    from modules import multi_analysis  # noqa: F401
+
+    for name, module in list(sys.modules.items()):
+        if not name.startswith('modules'):
+            continue
+        for attr in ('CACHE_DIR', 'LOG_DIR'):
+            if hasattr(module, attr):
+                setattr(module, attr, state_dir)
+
+    # 不沿用正式執行時累積的連線失敗統計
+    connection_manager.reset_connection_stats()
+
+    path = lambda name: os.path.join(state_dir, name)
+    market_snapshot.MarketSnapshot._instance = market_snapshot.MarketSnapshot(path('market_snapshot.json'))
+    stock_master.StockMaster._instance = stock_master.StockMaster(path('stock_master.pkl'))
+    price_archive.PriceArchive._instance = price_archive.PriceArchive(path('prices'))
+    price_history.PriceHistoryStore._instance = price_history.PriceHistoryStore()
+    indicator_state.IndicatorStateBook._instance = indicator_state.IndicatorStateBook(path('indicator_state.json'))
+    sentiment.MarketRegime._instance = sentiment.MarketRegime(path('market_regime.json'))
+    rate_limiter.RateLimiter._instance = rate_limiter.RateLimiter(path('rate_limiter_state.json'), shared=False)
+
+
+def _timed(func, *args, **kwargs):
+    """執行一次並返回耗時 (秒)"""
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def bench_generate_ta_signals(stock_ids, repeats, state_dir):
+    from modules.analysis.technical import generate_ta_signals
+    return [_timed(generate_ta_signals, stock_ids) for _ in range(repeats)], {}
+
+
+def bench_analyze_technical_indicators(stock_ids, repeats, state_dir):
+    from modules.analysis.technical import analyze_technical_indicators
+    return [_timed(analyze_technical_indicators, stock_ids) for _ in range(repeats)], {}
+
+
+def bench_multi_strategy(stock_ids, repeats, state_dir):
+    from modules.analysis.recommender import get_multi_strategy_recommendations
+    cache_file = os.path.join(state_dir, 'multi_strategy_evening_full_cache.json')
+    samples = []
+    for _ in range(repeats):
+        # 每次都重新分析 (不使用 30 分鐘的推薦結果快取)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        samples.append(_timed(get_multi_strategy_recommendations, 'evening', full_scan=True))
+    return samples, {}
+
+
+def bench_analyze_stock_value(stock_ids, repeats, state_dir):
+    from modules.multi_analysis import analyze_stock_value
+    sample = stock_ids[:BENCH_STOCK_VALUE_SAMPLE]
+    samples = [_timed(analyze_stock_value, code) for code in sample]
+    return samples, {"unit": "calls/s", "sampled": len(sample)}
+
+
+def bench_analyze_stock_values(stock_ids, repeats, state_dir):
+    from modules.multi_analysis import analyze_stock_values
+    return [_timed(analyze_stock_values, stock_ids, deadline=BENCH_TIMEOUT) for _ in range(repeats)], {}
+
+
+def _cache_stores(state_dir):
+    """建立指向暫存目錄的新實例 (不沿用記憶體中的資料)"""
+    from modules.data.market_snapshot import MarketSnapshot
+    from modules.data.stock_master import StockMaster
+    from modules.data.price_archive import PriceArchive
+    from modules.analysis.indicator_state import IndicatorStateBook
+    path = lambda name: os.path.join(state_dir, name)
+    return (PriceArchive(path('prices')), IndicatorStateBook(path('indicator_state.json')),
+            MarketSnapshot(path('market_snapshot.json')), StockMaster(path('stock_master.pkl')))
+
+
+def _cache_inputs(stock_ids):
+    """取得寫入快取用的資料 (股價、報價表與股票基本資料)"""
+    from modules.data.price_history import get_price_histories
+    from modules.data.market_snapshot import get_market_quotes
+    from modules.data.scraper import get_all_valid_twse_stocks
+    frames = get_price_histories(stock_ids, period="1y")
+    records = get_all_valid_twse_stocks(use_cache=False)
+    return frames, get_market_quotes(), records
+
+
+def bench_cache_write(stock_ids, repeats, state_dir):
+    frames, quotes, records = _cache_inputs(stock_ids)
+    samples, stages = [], {}
+    for _ in range(repeats):
+        archive, book, snapshot, master = _cache_stores(state_dir)
+        timings = {
+            "price_archive": _timed(lambda: [archive.write(f"{sid}.TW", df) for sid, df in frames.items()]),
+            "indicator_state": _timed(lambda: (book.sync_frames(frames), book.save())),
+            "market_snapshot": _timed(snapshot._save_cache, quotes, {"data_date": None}),
+            "stock_master": _timed(master.update, records),
+        }
+        samples.append(sum(timings.values()))
+        for name, seconds in timings.items():
+            stages.setdefault(name, []).append(seconds)
+    return samples, {"stages": {name: round(float(np.median(v)), 4) for name, v in stages.items()}}
+
+
+def bench_cache_read(stock_ids, repeats, state_dir):
+    bench_cache_write(stock_ids, 1, state_dir)
+    samples, stages = [], {}
+    for _ in range(repeats):
+        archive, book, snapshot, master = _cache_stores(state_dir)
+        timings = {
+            "price_archive": _timed(lambda: [archive.read(f"{sid}.TW") for sid in stock_ids]),
+            "indicator_state": _timed(book.load),
+            "market_snapshot": _timed(snapshot._load_cache),
+            "stock_master": _timed(master._load_snapshot),
+        }
+        samples.append(sum(timings.values()))
+        for name, seconds in timings.items():
+            stages.setdefault(name, []).append(seconds)
+    return samples, {"stages": {name: round(float(np.median(v)), 4) for name, v in stages.items()}}
+
+
+# 測試項目
+BENCH_CASES = {
+    "generate_ta_signals": bench_generate_ta_signals,
+    "analyze_technical_indicators": bench_analyze_technical_indicators,
+    "multi_strategy": bench_multi_strategy,
+    "analyze_stock_value": bench_analyze_stock_value,
+    "analyze_stock_values": bench_analyze_stock_values,
+    "cache_write": bench_cache_write,
+    "cache_read": bench_cache_read,
+}
+
+
+def summarize(case, size, samples, extra):
+    """
+    由耗時樣本計算統計值 (第一次為冷啟動，其餘為暖機後)
+
+    參數:
+    - case: 測試項目
+    - size: 股票數
+    - samples: 耗時列表 (秒)
+    - extra: 其他附加資訊
+
+    返回:
+    - 結果字典
+    """
+    warm = samples[1:] if len(samples) > 1 else samples
+    p50 = float(np.percentile(warm, 50))
+    unit = extra.pop("unit", "tickers/s")
+    result = {
+        "case": case,
+        "size": size,
+        "samples": [round(s, 4) for s in samples],
+        "cold": round(samples[0], 4),
+        "p50": round(p50, 4),
+        "p95": round(float(np.percentile(warm, 95)), 4),
+        "throughput": round((1.0 if unit == "calls/s" else size) / p50, 2) if p50 > 0 else None,
+        "unit": unit,
+    }
+    result.update(extra)
+    return result
+
+
+def run_child(case, size, repeats, fixtures_root, out_file):
+    """
+    子行程：重播資料並執行一個測試項目，結果寫入 out_file
+    """
+    from benchmarks.fixtures import FixtureSet, replay
+
+    state_dir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        isolate_state(state_dir)
+        fixtures = FixtureSet(fixtures_root, limit=size)
+        with replay(fixtures):
+            samples, extra = BENCH_CASES[case](fixtures.stock_ids, repeats, state_dir)
+        result = summarize(case, len(fixtures.stock_ids), samples, extra)
+        if resource is not None:
+            result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        with open(out_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def run_case(case, size, repeats, fixtures_root, verbose=False):
+    """
+    在獨立子行程執行一個測試項目
+
+    返回:
+    - 結果字典，失敗時包含 "error"
+    """
+    fd, out_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    env = dict(os.environ, **CHILD_ENV)
+    command = [sys.executable, '-m', 'benchmarks.run', '--child', case, str(size),
+               '--repeats', str(repeats), '--fixtures', fixtures_root, '--out', out_file]
+    try:
+        proc = subprocess.run(command, cwd=ROOT_DIR, env=env, timeout=BENCH_TIMEOUT,
+                              stdout=None if verbose else subprocess.DEVNULL,
+                              stderr=None if verbose else subprocess.PIPE)
+        if proc.returncode != 0:
+            message = (proc.stderr or b'').decode('utf-8', errors='replace').strip().splitlines()
+            return {"case": case, "size": size, "error": message[-1] if message else f"exit {proc.returncode}"}
+        with open(out_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"case": case, "size": size, "error": f"超過 {BENCH_TIMEOUT} 秒"}
+    finally:
+        os.remove(out_file)
+
+
+def compare(results, baseline):
+    """
+    與基準結果比較，標記 p50 退步的項目
+
+    參數:
+    - results: 本次結果列表
+    - baseline: 基準結果列表
+
+    返回:
+    - 退步的項目列表
+    """
+    reference = {(r["case"], r["size"]): r for r in baseline if "p50" in r}
+    regressions = []
+    for result in results:
+        base = reference.get((result["case"], result["size"]))
+        if base is None or "p50" not in result:
+            continue
+        change = result["p50"] / base["p50"] - 1 if base["p50"] > 0 else 0.0
+        result["baseline_p50"] = base["p50"]
+        result["change"] = round(change, 4)
+        if change > BENCH_REGRESSION_THRESHOLD and result["p50"] - base["p50"] > BENCH_REGRESSION_MIN_SECONDS:
+            result["regression"] = True
+            regressions.append(result)
+    return regressions
+
+
+def print_table(results):
+    """輸出結果表"""
+    print(f"{'case':<30}{'size':>6}{'cold':>9}{'p50':>9}{'p95':>9}{'throughput':>18}{'rss MB':>9}{'vs base':>10}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<30}{r['size']:>6}  ❌ {r['error']}")
+            continue
+        change = f"{r['change']:+.0%}" if "change" in r else "-"
+        flag = " ⚠️" if r.get("regression") else ""
+        throughput = f"{r['throughput']} {r['unit']}" if r.get("throughput") is not None else "-"
+        print(f"{r['case']:<30}{r['size']:>6}{r['cold']:>9.3f}{r['p50']:>9.3f}{r['p95']:>9.3f}"
+              f"{throughput:>18}{r.get('peak_rss_mb', '-'):>9}{change:>10}{flag}")
+
+
+def main(argv=None):
+    from benchmarks.fixtures import DEFAULT_FIXTURES, ensure_fixtures
+
+    parser = argparse.ArgumentParser(description="離線效能測試")
+    parser.add_argument("--cases", default=",".join(BENCH_CASES), help="測試項目 (逗號分隔)")
+    parser.add_argument("--sizes", default=",".join(map(str, BENCH_SIZES)), help="股票數 (逗號分隔)")
+    parser.add_argument("--repeats", type=int, default=BENCH_REPEATS, help="每個項目的重複次數")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="資料目錄")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基準結果檔")
+    parser.add_argument("--save-baseline", action="store_true", help="將本次結果存為基準")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有退步時以非零狀態結束")
+    parser.add_argument("--verbose", action="store_true", help="顯示子行程輸出")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "SIZE"), help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.repeats, args.fixtures, args.out)
+        return 0
+
+    cases = [case.strip() for case in args.cases.split(",") if case.strip()]
+    unknown = [case for case in cases if case not in BENCH_CASES]
+    if unknown:
+        parser.error(f"未知的測試項目: {', '.join(unknown)}")
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    ensure_fixtures(args.fixtures, stocks=max(sizes))
+
+    results = []
+    for case in cases:
+        for size in sizes:
+            print(f"[bench] ⏳ {case} ({size} 檔)...")
+            results.append(run_case(case, size, args.repeats, args.fixtures, args.verbose))
+
+    baseline = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get("results", [])
+    regressions = compare(results, baseline)
+    print_table(results)
+
+    with open(os.path.join(args.fixtures, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fixtures": {"source": manifest.get("source"), "stocks": manifest.get("stocks"),
+                     "created_at": manifest.get("created_at")},
+        "repeats": args.repeats,
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_file = os.path.join(RESULTS_DIR, f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(out_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"[bench] ✅ 已寫入結果: {out_file}")
+
+    if args.save_baseline:
+        shutil.copyfile(out_file, args.baseline)
+        print(f"[bench] ✅ 已更新基準: {args.baseline}")
+    if regressions:
+        print(f"[bench] ⚠️ {len(regressions)} 個項目比基準慢超過 {BENCH_REGRESSION_THRESHOLD:.0%}")
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,521 @@
+"""
+本機替身伺服器 - 以記錄的回應 (benchmarks/fixtures) 模擬 Yahoo Finance、證交所、公開資訊觀測站、
+goodinfo 與 LINE 端點，可設定延遲、錯誤率與 429 注入，用於量測抓取路徑的並行上限與混沌測試
+
+各端點掛在 <基礎網址>/<端點名稱> 之下 (與 modules.data.endpoints 的 STUB_BASE_URL 對應)：
+- /twse/exchangeReport/MI_INDEX
+- /isin/isin/C_public.jsp
+- /mops/mops/web/ajax_t05st09_1、/mops/mops/web/ajax_t05st34
+- /goodinfo/tw/StockInfo.asp?STOCK_ID=
+- /yahoo_query/v8/finance/chart/<代號>、/yahoo_query/v7/finance/quote?symbols=
+- /yahoo_finance/quote/<代號> (連線測試)
+- /line/v2/bot/message/push、/line/v2/bot/info
+- /__stats 各端點的請求數、狀態碼與最大並行數
+
+使用方式:
+- python -m benchmarks.stub_server serve --port 8765 --latency 0.05 --rate-limit-rate 0.02
+  另一個終端機: STUB_BASE_URL=http://127.0.0.1:8765 python main.py
+- python -m benchmarks.stub_server load --stocks 500 --latency 0.05 --error-rate 0.01
+  在同一行程內啟動伺服器並執行各抓取路徑，輸出各端點的請求統計
+"""
+print("[stub_server] ✅ 已載入最新版")
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+import pandas as pd
+
+from benchmarks.fixtures import DEFAULT_FIXTURES, FixtureSet, ensure_fixtures
+from modules.data.endpoints import DEFAULT_BASE_URLS, override_base_urls
+
+# 預設監聽位址
+STUB_HOST = os.getenv("STUB_HOST", "127.0.0.1")
+STUB_PORT = int(os.getenv("STUB_PORT", "8765"))
+
+# 429 回應的 Retry-After 秒數
+STUB_RETRY_AFTER = int(os.getenv("STUB_RETRY_AFTER", "1"))
+
+# 日K時間戳對應的台北開盤時間 (與 Yahoo chart API 相同，以開盤時刻表示當日)
+MARKET_OPEN = pd.Timedelta(hours=9)
+
+
+def _knob(value, service):
+    """取得旋鈕值 (可為單一數值或 {端點名稱: 數值}，字典中的 "*" 為預設值)"""
+    if isinstance(value, dict):
+        return value.get(service, value.get("*", 0))
+    return value or 0
+
+
+class StubServer:
+    """
+    替身伺服器
+
+    - latency / jitter：每個回應的固定延遲與額外隨機延遲 (秒)
+    - error_rate：回應 500 的機率
+    - rate_limit_rate：回應 429 的機率
+    - max_rps：每個端點每秒最多處理的請求數，超過時回應 429 (模擬正式端點的速率限制)
+    - 以上旋鈕皆可為單一數值或 {端點名稱: 數值}，例如 latency={"mops": 0.8, "*": 0.05}
+    """
+
+    def __init__(self, fixtures=None, host=STUB_HOST, port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, max_rps=None, retry_after=STUB_RETRY_AFTER, seed=None):
+        """
+        初始化替身伺服器
+
+        參數:
+        - fixtures: FixtureSet 實例，None 表示使用預設資料目錄 (不存在時產生合成資料)
+        - host: 監聽位址
+        - port: 監聽連接埠 (0 表示自動選擇)
+        - latency: 固定延遲 (秒)
+        - jitter: 額外隨機延遲上限 (秒)
+        - error_rate: 回應 500 的機率
+        - rate_limit_rate: 回應 429 的機率
+        - max_rps: 每個端點每秒最多處理的請求數，None 表示不限制
+        - retry_after: 429 回應的 Retry-After 秒數
+        - seed: 隨機種子 (固定後錯誤注入可重現)
+        """
+        if fixtures is None:
+            ensure_fixtures(DEFAULT_FIXTURES)
+            fixtures = FixtureSet(DEFAULT_FIXTURES)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._windows = {}  # 端點名稱 -> (目前秒數, 已處理請求數)
+        self._line_messages = []
+        self.reset_stats()
+
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 256
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """伺服器網址 (作為 STUB_BASE_URL)"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """
+        子行程使用替身伺服器所需的環境變量
+
+        返回:
+        - 字典 {"STUB_BASE_URL": 網址}
+        """
+        return {"STUB_BASE_URL": self.base_url}
+
+    def override(self):
+        """
+        在同一行程內將全部端點改指向替身伺服器
+
+        返回:
+        - context manager
+        """
+        return override_base_urls(self.base_url)
+
+    def start(self):
+        """
+        在背景執行緒啟動伺服器
+
+        返回:
+        - self
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止伺服器"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        """清除請求統計"""
+        with self._lock:
+            self._stats = {}
+            self._active = {}
+
+    def stats(self):
+        """
+        取得各端點的請求統計
+
+        返回:
+        - 字典 {端點名稱: {"requests", "status", "max_concurrency", "avg_latency"}}
+        """
+        with self._lock:
+            result = {}
+            for service, s in sorted(self._stats.items()):
+                result[service] = {
+                    "requests": s["requests"],
+                    "status": dict(sorted(s["status"].items())),
+                    "max_concurrency": s["max_concurrency"],
+                    "avg_latency": round(s["latency"] / s["requests"], 4) if s["requests"] else 0.0,
+                }
+            return result
+
+    @property
+    def line_messages(self):
+        """已收到的 LINE 推播內容"""
+        with self._lock:
+            return list(self._line_messages)
+
+    def _enter(self, service):
+        """記錄一個處理中的請求"""
+        with self._lock:
+            s = self._stats.setdefault(service, {"requests": 0, "status": {}, "max_concurrency": 0, "latency": 0.0})
+            s["requests"] += 1
+            self._active[service] = self._active.get(service, 0) + 1
+            s["max_concurrency"] = max(s["max_concurrency"], self._active[service])
+
+    def _leave(self, service, status, elapsed):
+        """記錄請求結束"""
+        with self._lock:
+            s = self._stats[service]
+            s["status"][str(status)] = s["status"].get(str(status), 0) + 1
+            s["latency"] += elapsed
+            self._active[service] -= 1
+
+    def _over_limit(self, service):
+        """檢查端點在目前這一秒是否已超過 max_rps"""
+        limit = _knob(self.max_rps, service)
+        if not limit:
+            return False
+        second = int(time.monotonic())
+        with self._lock:
+            window, handled = self._windows.get(service, (second, 0))
+            if window != second:
+                window, handled = second, 0
+            self._windows[service] = (window, handled + 1)
+            return handled >= limit
+
+    def inject(self, service):
+        """
+        依旋鈕決定是否注入錯誤，並套用延遲
+
+        參數:
+        - service: 端點名稱
+
+        返回:
+        - 注入的狀態碼 (429/500)，不注入時返回 None
+        """
+        with self._lock:
+            roll = self._random.random()
+            delay = _knob(self.latency, service) + self._random.uniform(0, _knob(self.jitter, service))
+        if delay > 0:
+            time.sleep(delay)
+        if self._over_limit(service):
+            return 429
+        rate_limit_rate = _knob(self.rate_limit_rate, service)
+        if roll < rate_limit_rate:
+            return 429
+        if roll < rate_limit_rate + _knob(self.error_rate, service):
+            return 500
+        return None
+
+    # ---- 各端點的回應 ----
+
+    def chart(self, symbol, query):
+        """Yahoo v8 chart API"""
+        interval = query.get("interval", ["1d"])[0]
+        if "period1" in query:
+            start = pd.Timestamp(int(query["period1"][0]), unit="s").normalize()
+            end = pd.Timestamp(int(query["period2"][0]), unit="s").normalize() if "period2" in query else None
+            df = self.fixtures.frame(symbol, start=start, end=end)
+        else:
+            df = self.fixtures.frame(symbol, period=query.get("range", ["1mo"])[0])
+        if df is None or df.empty:
+            return 404, {"chart": {"result": None, "error": {"code": "Not Found",
+                                                              "description": f"No data found, symbol may be delisted: {symbol}"}}}
+
+        index = (df.index + MARKET_OPEN).tz_localize("Asia/Taipei")
+        quote = {column.lower(): [None if pd.isna(v) else float(v) for v in df[column]] for column in df.columns}
+        return 200, {"chart": {"result": [{
+            "meta": {"symbol": symbol, "currency": "TWD", "exchangeTimezoneName": "Asia/Taipei",
+                     "dataGranularity": interval},
+            "timestamp": [int(ts.timestamp()) for ts in index],
+            "indicators": {"quote": [quote], "adjclose": [{"adjclose": quote.get("close", [])}]},
+        }], "error": None}}
+
+    def quote(self, query):
+        """Yahoo v7 quote API"""
+        symbols = [s for s in ",".join(query.get("symbols", [""])).split(",") if s]
+        results = []
+        for symbol in symbols:
+            info = self.fixtures.ticker_info(symbol)
+            if info:
+                results.append(dict(info, symbol=symbol))
+        return 200, {"quoteResponse": {"result": results, "error": None}}
+
+    def goodinfo(self, query):
+        """goodinfo StockInfo.asp (只包含 scraper 解析的本益比、股價淨值比與 ROE)"""
+        stock_id = query.get("STOCK_ID", [""])[0]
+        info = self.fixtures.ticker_info(f"{stock_id}.TW")
+        if not info:
+            return 200, "<html><body>查無資料</body></html>"
+        pe = info.get("trailingPE")
+        pb = info.get("priceToBook", round(pe / 10, 2) if pe else None)
+        roe = info.get("returnOnEquity", round(pb / pe * 100, 2) if pe and pb else None)
+        cells = "".join(f"<tr><td>{name}</td><td>{'-' if value is None else value}</td></tr>"
+                        for name, value in (("本益比", pe), ("股價淨值比", pb), ("ROE", roe)))
+        return 200, f"<html><body><table><tr><td>{stock_id}</td><td>{info.get('shortName', '')}</td></tr>" \
+                    f"{cells}</table></body></html>"
+
+    def line_push(self, body):
+        """LINE Messaging API push"""
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return 400, {"message": "The request body has 1 error(s)"}
+        with self._lock:
+            self._line_messages.append(payload)
+        return 200, {}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """替身伺服器的請求處理 (依路徑分派至 StubServer 的各端點)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False)
+        if isinstance(body, str):
+            body = body.encode(content_type.split("charset=")[-1] if "charset=" in content_type else "utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+
+        if parsed.path == "/__stats":
+            self._send(200, stub.stats())
+            return
+
+        # 第一段路徑為端點名稱，其餘為正式端點的路徑
+        _, service, path = (parsed.path.split("/", 2) + ["", ""])[:3]
+        path = "/" + path
+        if service not in DEFAULT_BASE_URLS:
+            self._send(404, {"message": f"unknown endpoint: {parsed.path}"})
+            return
+
+        started = time.perf_counter()
+        stub._enter(service)
+        status = 500
+        try:
+            injected = stub.inject(service)
+            if injected == 429:
+                status = 429
+                self._send(429, {"message": "Too Many Requests"}, headers={"Retry-After": str(stub.retry_after)})
+                return
+            if injected == 500:
+                status = 500
+                self._send(500, {"message": "Internal Server Error (injected)"})
+                return
+
+            status, payload, content_type = self._route(stub, service, path, query, body)
+            self._send(status, payload, content_type)
+        except Exception as e:
+            status = 500
+            self._send(500, {"message": f"{type(e).__name__}: {e}"})
+        finally:
+            stub._leave(service, status, time.perf_counter() - started)
+
+    def _route(self, stub, service, path, query, body):
+        """依端點與路徑產生 (狀態碼, 回應主體, Content-Type)"""
+        html = "text/html; charset=utf-8"
+        json_type = "application/json; charset=utf-8"
+        if service in ("twse", "isin", "mops"):
+            status, content_type, _, payload = stub.fixtures.http_response(path)
+            return status, payload, content_type
+        if service == "goodinfo" and path.startswith("/tw/StockInfo.asp"):
+            return (*stub.goodinfo(query), html)
+        if service == "yahoo_query":
+            match = re.match(r"^/v8/finance/chart/([^/]+)$", path)
+            if match:
+                return (*stub.chart(unquote(match.group(1)), query), json_type)
+            if path == "/v7/finance/quote":
+                return (*stub.quote(query), json_type)
+        if service == "yahoo_finance":
+            return 200, "<html><body>stub</body></html>", html
+        if service == "line":
+            if path == "/v2/bot/message/push" and self.command == "POST":
+                return (*stub.line_push(body), json_type)
+            if path == "/v2/bot/info":
+                return 200, {"userId": "Ustub", "basicId": "@stub", "displayName": "stub"}, json_type
+        return 404, {"message": f"not found: {path}"}, json_type
+
+
+def spawn_stub_server(port=STUB_PORT, args=(), timeout=30):
+    """
+    以子行程啟動替身伺服器並等待就緒
+
+    參數:
+    - port: 監聽連接埠
+    - args: 其他命令列參數 (例如 ["--latency", "0.05"])
+    - timeout: 等待就緒的秒數
+
+    返回:
+    - (subprocess.Popen, 伺服器網址)
+    """
+    import requests
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server", "serve", "--port", str(port), *args],
+                               cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://{STUB_HOST}:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"替身伺服器啟動失敗 (結束碼 {process.returncode})")
+        try:
+            requests.get(f"{base_url}/__stats", timeout=1)
+            return process, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError(f"替身伺服器 {timeout} 秒內未就緒")
+
+
+def run_load(stub, stocks=500):
+    """
+    在同一行程內將端點改指向替身伺服器，依序執行各抓取路徑並輸出各端點的請求統計
+
+    參數:
+    - stub: 已啟動的 StubServer
+    - stocks: 下載日K與基本面的股票數
+
+    返回:
+    - 字典 {階段名稱: 耗時秒數}
+    """
+    from modules.data.market_snapshot import MarketSnapshot
+    from modules.data.price_history import download_price_batch
+    from modules.data.scraper import get_eps_data_from_mops, fetch_fundamental_data, get_all_valid_twse_stocks
+    from modules.notification.line_bot import send_line_bot_message
+
+    stock_ids = stub.fixtures.stock_ids[:stocks]
+    snapshot_dir = tempfile.mkdtemp(prefix="stub_load_")
+    stages = [
+        ("MI_INDEX", lambda: MarketSnapshot(os.path.join(snapshot_dir, 'snapshot.json')).get_quotes(refresh=True)),
+        ("ISIN", lambda: get_all_valid_twse_stocks(use_cache=False)),
+        ("MOPS", get_eps_data_from_mops),
+        ("goodinfo", lambda: fetch_fundamental_data(stock_ids[:min(stocks, 100)], max_stocks=100)),
+        ("chart", lambda: download_price_batch(stock_ids, period="60d")),
+        ("LINE", lambda: send_line_bot_message("stub load test", max_retries=1)),
+    ]
+    timings = {}
+    with stub.override():
+        for name, func in stages:
+            started = time.perf_counter()
+            try:
+                func()
+            except Exception as e:
+                print(f"[stub_server] ⚠️ {name} 失敗: {e}")
+            timings[name] = round(time.perf_counter() - started, 3)
+            print(f"[stub_server] ⏱️ {name}: {timings[name]:.3f}s")
+
+    print(f"[stub_server] 📊 {'端點':<14}{'請求':>6}{'最大並行':>8}{'平均延遲':>10}  狀態碼")
+    for service, s in stub.stats().items():
+        print(f"[stub_server]    {service:<14}{s['requests']:>6}{s['max_concurrency']:>8}"
+              f"{s['avg_latency']:>10.3f}  {s['status']}")
+    return timings
+
+
+def _parse_knob(values, cast=float):
+    """解析可重複的旋鈕參數：單一數值或 端點=數值"""
+    if not values:
+        return None
+    knob = {}
+    for value in values:
+        if "=" in value:
+            service, value = value.split("=", 1)
+            knob[service] = cast(value)
+        else:
+            knob["*"] = cast(value)
+    return knob if set(knob) != {"*"} else knob["*"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本機替身伺服器 (Yahoo/證交所/公開資訊觀測站/goodinfo/LINE)")
+    parser.add_argument("action", choices=["serve", "load"])
+    parser.add_argument("--host", default=STUB_HOST, help="監聽位址")
+    parser.add_argument("--port", type=int, default=STUB_PORT, help="監聽連接埠 (load 模式預設自動選擇)")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="資料目錄")
+    parser.add_argument("--stocks", type=int, default=None, help="只提供前 N 檔股票 (load 模式預設 500)")
+    parser.add_argument("--latency", action="append", help="固定延遲秒數，可寫成 端點=秒數 (可重複)")
+    parser.add_argument("--jitter", action="append", help="額外隨機延遲上限 (秒)")
+    parser.add_argument("--error-rate", action="append", help="回應 500 的機率")
+    parser.add_argument("--rate-limit-rate", action="append", help="回應 429 的機率")
+    parser.add_argument("--max-rps", action="append", help="每個端點每秒最多處理的請求數")
+    parser.add_argument("--retry-after", type=int, default=STUB_RETRY_AFTER, help="429 的 Retry-After 秒數")
+    parser.add_argument("--seed", type=int, default=None, help="隨機種子")
+    args = parser.parse_args(argv)
+
+    ensure_fixtures(args.fixtures, stocks=args.stocks or 0)
+    stocks = args.stocks or (500 if args.action == "load" else None)
+    stub = StubServer(FixtureSet(args.fixtures, limit=stocks), host=args.host,
+                      port=0 if args.action == "load" and args.port == STUB_PORT else args.port,
+                      latency=_parse_knob(args.latency), jitter=_parse_knob(args.jitter),
+                      error_rate=_parse_knob(args.error_rate), rate_limit_rate=_parse_knob(args.rate_limit_rate),
+                      max_rps=_parse_knob(args.max_rps, int), retry_after=args.retry_after, seed=args.seed)
+
+    if args.action == "load":
+        with stub:
+            run_load(stub, stocks=stocks)
+        return 0
+
+    print(f"[stub_server] ✅ 已啟動: {stub.base_url} (設定 STUB_BASE_URL={stub.base_url})")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
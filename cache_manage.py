@@ -35,6 +35,9 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# HTTP 回應快取 (cache/http) 的保留天數
+HTTP_CACHE_RETENTION_DAYS = int(os.getenv("HTTP_CACHE_RETENTION_DAYS", "30"))
+
 # 緩存類型配置 - 不同類型的緩存有不同的保留期限和備份策略
 CACHE_CONFIG = {
     'eps_data_cache.json': {
@@ -361,6 +364,26 @@ def backup_cache(specific_file=None):
     log_event(f"成功備份 {success_count}/{len(cache_files)} 個緩存文件到 {backup_subdir}")
     return success_count > 0
 
+def prune_http_cache(days=None):
+    """
+    清理 HTTP 回應快取 (cache/http) 中過久未更新的項目與不再被引用的回應主體
+    
+    參數:
+    - days: 保留的天數，None表示使用 HTTP_CACHE_RETENTION_DAYS
+    
+    返回:
+    - int: 刪除的文件數量
+    """
+    try:
+        from modules.data.http_cache import HttpCache
+        retention_days = days if days is not None else HTTP_CACHE_RETENTION_DAYS
+        removed = HttpCache.get_instance().prune(max_age_days=retention_days)
+        log_event(f"HTTP 回應快取清理完成，共刪除 {removed} 個文件 (保留 {retention_days} 天)")
+        return removed
+    except Exception as e:
+        log_event(f"清理 HTTP 回應快取失敗: {e}", 'error')
+        return 0
+
 def clean_old_cache(days=None, force=False):
     """
     清理過舊的緩存文件
@@ -416,6 +439,9 @@ def clean_old_cache(days=None, force=False):
             except Exception as e:
                 log_event(f"刪除文件 {file_path} 失敗: {e}", 'error')
     
+    # HTTP 回應主體以內容雜湊存放，頁面變動後舊主體不會被覆寫，需一併清理
+    deleted_count += prune_http_cache(days)
+    
     log_event(f"清理完成，共刪除 {deleted_count} 個過期緩存文件")
     return deleted_count
 
@@ -1018,7 +1044,10 @@ if __name__ == "__main__":
                         backup_single_file(filename)  # 先備份
                         os.remove(file_path)  # 再刪除
         
-        # 4. 清理過舊的備份
+        # 4. 清理 HTTP 回應快取中過期的項目與回應主體
+        prune_http_cache()
+        
+        # 5. 清理過舊的備份
         auto_cleanup_backups()
         
         print("\n=== 自動維護完成 ===")
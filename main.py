@@ -76,6 +76,8 @@ def morning_push(global_timeout=240):
     """
     print("[main] ⏳ 執行早盤前推播...")
     
+    from modules.tracing import start_run, finish_run, span
+    start_run("morning_push")
     start_time = datetime.now()
     
     try:
@@ -84,12 +86,13 @@ def morning_push(global_timeout=240):
         print(f"[main] 設置多策略分析超時時間為 {timeout_recommendations} 秒")
         
         # 使用超時執行獲取多策略推薦
-        strategies_data = run_with_timeout(
-            get_multi_strategy_recommendations, 
-            args=('morning',), 
-            timeout_seconds=timeout_recommendations,
-            default_result={"short_term": [], "long_term": [], "weak_stocks": []}
-        )
+        with span("main.recommendations"):
+            strategies_data = run_with_timeout(
+                get_multi_strategy_recommendations, 
+                args=('morning',), 
+                timeout_seconds=timeout_recommendations,
+                default_result={"short_term": [], "long_term": [], "weak_stocks": []}
+            )
         
         # 檢查是否獲取到足夠的推薦
         short_term_stocks = strategies_data.get("short_term", [])
@@ -106,26 +109,26 @@ def morning_push(global_timeout=240):
             
             if os.path.exists(cache_file):
                 try:
-                    with open(cache_file, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                        if 'recommendations' in cache_data:
-                            # 如果短線推薦不足，從緩存獲取
-                            if not short_term_stocks and "short_term" in cache_data['recommendations']:
-                                short_term_stocks = cache_data['recommendations']["short_term"]
-                                strategies_data["short_term"] = short_term_stocks
-                                print(f"[main] ✅ 從緩存獲取了 {len(short_term_stocks)} 檔短線推薦股票")
+                    from modules.cache_store import read_json
+                    cache_data = read_json(cache_file) or {}
+                    if 'recommendations' in cache_data:
+                        # 如果短線推薦不足，從緩存獲取
+                        if not short_term_stocks and "short_term" in cache_data['recommendations']:
+                            short_term_stocks = cache_data['recommendations']["short_term"]
+                            strategies_data["short_term"] = short_term_stocks
+                            print(f"[main] ✅ 從緩存獲取了 {len(short_term_stocks)} 檔短線推薦股票")
                             
-                            # 如果長線推薦不足，從緩存獲取
-                            if not long_term_stocks and "long_term" in cache_data['recommendations']:
-                                long_term_stocks = cache_data['recommendations']["long_term"]
-                                strategies_data["long_term"] = long_term_stocks
-                                print(f"[main] ✅ 從緩存獲取了 {len(long_term_stocks)} 檔長線推薦股票")
+                        # 如果長線推薦不足，從緩存獲取
+                        if not long_term_stocks and "long_term" in cache_data['recommendations']:
+                            long_term_stocks = cache_data['recommendations']["long_term"]
+                            strategies_data["long_term"] = long_term_stocks
+                            print(f"[main] ✅ 從緩存獲取了 {len(long_term_stocks)} 檔長線推薦股票")
                             
-                            # 如果極弱谷警示不足，從緩存獲取
-                            if not weak_stocks and "weak_stocks" in cache_data['recommendations']:
-                                weak_stocks = cache_data['recommendations']["weak_stocks"]
-                                strategies_data["weak_stocks"] = weak_stocks
-                                print(f"[main] ✅ 從緩存獲取了 {len(weak_stocks)} 檔極弱股警示")
+                        # 如果極弱谷警示不足，從緩存獲取
+                        if not weak_stocks and "weak_stocks" in cache_data['recommendations']:
+                            weak_stocks = cache_data['recommendations']["weak_stocks"]
+                            strategies_data["weak_stocks"] = weak_stocks
+                            print(f"[main] ✅ 從緩存獲取了 {len(weak_stocks)} 檔極弱股警示")
                 except Exception as e:
                     print(f"[main] ⚠️ 讀取緩存推薦失敗: {e}")
                     log_error(f"讀取緩存推薦失敗: {e}")
@@ -148,7 +151,8 @@ def morning_push(global_timeout=240):
         # 使用雙重通知系統發送綜合推薦報告
         try:
             # 使用新的综合推播功能
-            send_combined_recommendations(strategies_data, "早盤前")
+            with span("main.notify"):
+                send_combined_recommendations(strategies_data, "早盤前")
             print("[main] ✅ 已發送多策略分析報告")
         except Exception as e:
             print(f"[main] ⚠️ 發送多策略分析報告失敗: {e}")
@@ -175,5 +179,8 @@ def morning_push(global_timeout=240):
             log_error(f"發送錯誤通知失敗: {notify_error}")
         
         return False
+    finally:
+        # 輸出最慢的區段並寫出 logs/profile_morning_push_*.json
+        finish_run()
 
 # 其它 noon_push(), afternoon_push(), evening_push() 函數也做相同的更新
@@ -0,0 +1,366 @@
+"""
+技術指標狀態模組 - 保存每檔股票的 EMA、KD、RSI 與均線/布林通道狀態，新增一根K線只需常數時間更新
+"""
+print("[indicator_state] ✅ 已載入最新版")
+
+import os
+import math
+import copy
+import atexit
+import threading
+import numpy as np
+import pandas as pd
+
+from modules.analysis.indicators import SIGNAL_COLUMNS
+from modules.cache_store import read_json, write_json
+
+# 狀態檔設置
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+STATE_FILE = os.path.join(CACHE_DIR, 'indicator_state.json')
+
+# 指標參數 (與 compute_signal_table 相同)
+KD_WINDOW = 9
+RSI_WINDOW = 14
+MA_SHORT = 5
+MA_LONG = 20
+STATE_VERSION = 1
+
+
+def _ema_update(state, value, alpha):
+    """
+    以遞迴方式更新 EMA (等同 pandas ewm(adjust=True))
+
+    參數:
+    - state: {"num", "den"}，None 表示尚無資料
+    - value: 新的觀測值，NaN 表示尚未有值 (不影響結果)
+    - alpha: 平滑系數
+
+    返回:
+    - 更新後的狀態
+    """
+    if value is None or math.isnan(value):
+        if state is not None:
+            # 與 pandas 相同：有值之後的缺值仍會使舊資料的權重衰減
+            state = {"num": state["num"] * (1 - alpha), "den": state["den"] * (1 - alpha)}
+        return state
+    if state is None:
+        return {"num": value, "den": 1.0}
+    return {"num": value + (1 - alpha) * state["num"], "den": 1.0 + (1 - alpha) * state["den"]}
+
+
+def _ema_value(state):
+    """取得 EMA 狀態目前的值"""
+    if state is None or state["den"] == 0:
+        return float("nan")
+    return state["num"] / state["den"]
+
+
+def _push(window, value, size):
+    """將值加入固定長度的視窗"""
+    window.append(value)
+    if len(window) > size:
+        del window[0]
+
+
+class IndicatorState:
+    """
+    單一股票的技術指標狀態
+
+    - EMA12/EMA26/訊號線與 K/D 平滑以分子、分母遞迴保存，更新為 O(1)
+    - RSI 漲跌幅、KD 高低點與均線收盤價只保留固定長度視窗
+    - 保留上一根K線前的狀態，同一日期的K線 (盤中) 可重複更新而不重複計入
+    """
+
+    def __init__(self, data=None):
+        """
+        初始化狀態
+
+        參數:
+        - data: 由 to_dict 產生的字典，None 表示全新狀態
+        """
+        data = data or {}
+        self.bars = data.get("bars", 0)
+        self.last_date = data.get("last_date")
+        self.last_close = data.get("last_close")
+        self.ema12 = data.get("ema12")
+        self.ema26 = data.get("ema26")
+        self.signal = data.get("signal")
+        self.k = data.get("k")
+        self.d = data.get("d")
+        self.highs = list(data.get("highs", []))
+        self.lows = list(data.get("lows", []))
+        self.gains = list(data.get("gains", []))
+        self.losses = list(data.get("losses", []))
+        self.closes = list(data.get("closes", []))
+        self.prev = data.get("prev")
+
+    def to_dict(self, with_prev=True):
+        """
+        轉換為可寫入 JSON 的字典
+
+        參數:
+        - with_prev: 是否包含上一根K線前的狀態
+
+        返回:
+        - 字典
+        """
+        data = {
+            "bars": self.bars,
+            "last_date": self.last_date,
+            "last_close": self.last_close,
+            "ema12": self.ema12,
+            "ema26": self.ema26,
+            "signal": self.signal,
+            "k": self.k,
+            "d": self.d,
+            "highs": self.highs,
+            "lows": self.lows,
+            "gains": self.gains,
+            "losses": self.losses,
+            "closes": self.closes,
+        }
+        if with_prev:
+            data["prev"] = self.prev
+        return data
+
+    def update(self, date, high, low, close):
+        """
+        加入一根K線 (日期與最後一根相同時視為更新該K線)
+
+        參數:
+        - date: K線日期 (YYYY-MM-DD)
+        - high: 最高價
+        - low: 最低價
+        - close: 收盤價
+
+        返回:
+        - bool: 是否成功更新
+        """
+        if close is None or math.isnan(close):
+            return False
+        if self.last_date is not None and date < self.last_date:
+            return False
+        if date == self.last_date:
+            # 同一日期：先還原到該K線之前的狀態再重新計入
+            if self.prev is None:
+                return False
+            self.__init__(self.prev)
+        self.prev = copy.deepcopy(self.to_dict(with_prev=False))
+
+        # MACD
+        self.ema12 = _ema_update(self.ema12, close, 2 / (12 + 1))
+        self.ema26 = _ema_update(self.ema26, close, 2 / (26 + 1))
+        macd = _ema_value(self.ema12) - _ema_value(self.ema26)
+        self.signal = _ema_update(self.signal, macd, 2 / (9 + 1))
+
+        # KD (區間為零時 RSV 記為 0)
+        _push(self.highs, high, KD_WINDOW)
+        _push(self.lows, low, KD_WINDOW)
+        rsv = float("nan")
+        if len(self.highs) == KD_WINDOW:
+            high_max, low_min = max(self.highs), min(self.lows)
+            rsv = (close - low_min) / (high_max - low_min) * 100 if high_max != low_min else 0.0
+        self.k = _ema_update(self.k, rsv, 1 / 3)
+        self.d = _ema_update(self.d, _ema_value(self.k), 1 / 3)
+
+        # RSI 漲跌幅視窗
+        if self.last_close is not None:
+            delta = close - self.last_close
+            _push(self.gains, max(delta, 0.0), RSI_WINDOW)
+            _push(self.losses, max(-delta, 0.0), RSI_WINDOW)
+
+        # 均線與布林通道
+        _push(self.closes, close, MA_LONG)
+
+        self.last_close = close
+        self.last_date = date
+        self.bars += 1
+        return True
+
+    def signals(self):
+        """
+        由狀態計算訊號表的一列
+
+        返回:
+        - 字典 (欄位同 SIGNAL_COLUMNS)
+        """
+        macd = _ema_value(self.ema12) - _ema_value(self.ema26)
+        k, d = _ema_value(self.k), _ema_value(self.d)
+
+        rsi = 0.0
+        if len(self.losses) == RSI_WINDOW:
+            avg_gain = sum(self.gains) / RSI_WINDOW
+            avg_loss = sum(self.losses) / RSI_WINDOW
+            if avg_loss > 0:
+                rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+
+        ma_score, bb_signal = 0, 0
+        if len(self.closes) == MA_LONG:
+            ma5 = sum(self.closes[-MA_SHORT:]) / MA_SHORT
+            ma20 = sum(self.closes) / MA_LONG
+            variance = sum((c - ma20) ** 2 for c in self.closes) / (MA_LONG - 1)
+            ma_score = int(ma5 > ma20)
+            bb_signal = int(self.last_close > ma20 + 2 * math.sqrt(variance))
+
+        return {
+            "MACD": int(macd > _ema_value(self.signal)),
+            "K": 0.0 if math.isnan(k) else k,
+            "D": 0.0 if math.isnan(d) else d,
+            "RSI": rsi,
+            "均線": ma_score,
+            "布林通道": bb_signal,
+        }
+
+
+class IndicatorStateBook:
+    """
+    全部股票的技術指標狀態 (保存於 cache/indicator_state.json)
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的狀態實例
+
+        返回:
+        - IndicatorStateBook: 實例
+        """
+        with IndicatorStateBook._instance_lock:
+            if IndicatorStateBook._instance is None:
+                IndicatorStateBook._instance = IndicatorStateBook()
+                # 分析過程只更新記憶體中的狀態，每次執行結束時寫入一次狀態檔
+                atexit.register(IndicatorStateBook._instance.save)
+            return IndicatorStateBook._instance
+
+    def __init__(self, state_file=STATE_FILE):
+        """
+        初始化並載入狀態檔
+
+        參數:
+        - state_file: 狀態檔路徑
+        """
+        self.state_file = state_file
+        self._lock = threading.RLock()
+        self._states = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """載入狀態檔"""
+        try:
+            data = read_json(self.state_file)
+            if data is not None and data.get("version") == STATE_VERSION:
+                self._states = {sid: IndicatorState(s) for sid, s in data.get("states", {}).items()}
+        except Exception as e:
+            print(f"[indicator_state] ⚠️ 讀取指標狀態失敗: {e}")
+            self._states = {}
+
+    def save(self):
+        """寫入狀態檔 (只在狀態有變動時寫入)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "version": STATE_VERSION,
+                "states": {sid: state.to_dict() for sid, state in self._states.items()}
+            }
+            if write_json(self.state_file, data):
+                self._dirty = False
+
+    def get(self, stock_id):
+        """取得單一股票的狀態，沒有時返回 None"""
+        return self._states.get(stock_id)
+
+    def sync_frames(self, price_frames):
+        """
+        以股價資料更新狀態：已有狀態者只加入最後日期之後的K線，其餘由整段資料建立
+
+        參數:
+        - price_frames: 個股股價資料 {stock_id: DataFrame}
+
+        返回:
+        - int: 有更新的股票數量
+        """
+        updated = 0
+        with self._lock:
+            for stock_id, df in price_frames.items():
+                if df is None or df.empty or "Close" not in df.columns:
+                    continue
+                dates = df.index.strftime('%Y-%m-%d')
+                state = self._states.get(stock_id)
+
+                if state is None or state.last_date not in set(dates):
+                    # 沒有狀態或資料無法銜接：由整段資料重新建立
+                    state = IndicatorState()
+                    start = 0
+                else:
+                    # 從最後一根K線當日開始 (盤中K線可能已變動)
+                    start = list(dates).index(state.last_date)
+                    if start == len(df) - 1 and state.last_close == float(df["Close"].iloc[-1]):
+                        continue
+
+                rows = df.iloc[start:]
+                for date, high, low, close in zip(dates[start:], rows["High"], rows["Low"], rows["Close"]):
+                    state.update(date, float(high), float(low), float(close))
+                self._states[stock_id] = state
+                updated += 1
+            if updated:
+                self._dirty = True
+        return updated
+
+    def apply_bars(self, bars):
+        """
+        直接加入最新一根K線 (例如收盤行情快照)，不需要歷史資料
+        狀態與K線之間缺少交易日時不更新 (需由 sync_frames 以歷史資料補齊)
+
+        參數:
+        - bars: {stock_id: (date, high, low, close)}
+
+        返回:
+        - int: 有更新的股票數量
+        """
+        updated = 0
+        with self._lock:
+            for stock_id, (date, high, low, close) in bars.items():
+                state = self._states.get(stock_id)
+                if state is None:
+                    continue
+                # 只接受同一日 (重新計入) 或下一個平日的K線；遇到連假時同樣交由歷史資料補齊
+                if state.last_date is not None and np.busday_count(state.last_date, date) > 1:
+                    continue
+                if state.update(date, float(high), float(low), float(close)):
+                    updated += 1
+            if updated:
+                self._dirty = True
+        return updated
+
+    def signal_table(self, stock_ids, min_bars=30, as_of=None):
+        """
+        由狀態建立訊號表 (格式同 compute_signal_table)
+
+        參數:
+        - stock_ids: 股票代碼列表
+        - min_bars: 每檔股票最少需要的K線數量
+        - as_of: 最近一個收盤日 (YYYY-MM-DD)，最後K線早於此日期的狀態視為過期，None 表示不檢查
+
+        返回:
+        - 訊號表 DataFrame (index=股票代碼)，沒有狀態、K線不足或已過期的股票不會出現
+        """
+        rows = {}
+        with self._lock:
+            for stock_id in stock_ids:
+                state = self._states.get(stock_id)
+                if state is None or state.bars < min_bars:
+                    continue
+                if as_of is not None and (state.last_date is None or state.last_date < as_of):
+                    continue
+                rows[stock_id] = state.signals()
+
+        table = pd.DataFrame.from_dict(rows, orient="index", columns=SIGNAL_COLUMNS)
+        table.index.name = "證券代號"
+        return table
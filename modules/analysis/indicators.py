@@ -0,0 +1,333 @@
+"""
+技術指標計算引擎 - 以 (日期 × 股票) 寬表一次計算全部股票的 MACD、KD、RSI、均線與布林通道
+"""
+print("[indicators] ✅ 已載入最新版")
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# 訊號表欄位 (沿用 generate_ta_signals 的欄位名稱)
+SIGNAL_COLUMNS = ["MACD", "K", "D", "RSI", "均線", "布林通道"]
+
+# 多行程計算設置：全市場掃描時將股票分片到多個 CPU 核心計算
+TA_PARALLEL = os.getenv("TA_PARALLEL", "false").lower() in ('true', 'yes', '1', 'on')
+TA_WORKERS = int(os.getenv("TA_WORKERS", "0")) or os.cpu_count() or 1
+TA_PARALLEL_MIN_STOCKS = int(os.getenv("TA_PARALLEL_MIN_STOCKS", "200"))  # 股票數少於此值時多行程的開銷大於效益
+PANEL_FIELDS = ("High", "Low", "Close")
+
+
+def ema(values, span, adjust=False):
+    """
+    計算指數移動平均線 (預設為遞迴式 EMA，首值為第一筆資料)
+
+    參數:
+    - values: 價格序列，可為一維 (單一股票) 或二維 (日期 × 股票) 的 array/Series/DataFrame
+    - span: EMA 週期
+    - adjust: 是否使用 pandas 的 adjust=True 權重 (早期資料依實際筆數正規化，訊號表沿用此算法)
+
+    返回:
+    - 與輸入相同形狀的完整 EMA 序列 (輸入為 pandas 物件時返回相同型別)
+    """
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        return values.astype(float).ewm(span=span, adjust=adjust).mean()
+    array = np.asarray(values, dtype=np.float64)
+    return pd.DataFrame(array.reshape(len(array), -1)).ewm(span=span, adjust=adjust).mean().to_numpy().reshape(array.shape)
+
+
+def macd(values, fast=12, slow=26, signal=9, adjust=False):
+    """
+    計算 MACD 線、訊號線與柱狀圖的完整序列
+
+    參數:
+    - values: 價格序列 (一維或二維，同 ema)
+    - fast: 快線週期
+    - slow: 慢線週期
+    - signal: 訊號線週期
+    - adjust: 同 ema
+
+    返回:
+    - (macd_line, signal_line, histogram)
+    """
+    macd_line = ema(values, fast, adjust) - ema(values, slow, adjust)
+    signal_line = ema(macd_line, signal, adjust)
+    return macd_line, signal_line, macd_line - signal_line
+
+
+def build_price_panel(price_frames, fields=("High", "Low", "Close", "Volume")):
+    """
+    將個股 OHLCV 資料合併為 (日期 × 股票) 寬表
+
+    參數:
+    - price_frames: 個股股價資料 {stock_id: DataFrame}
+    - fields: 要建立寬表的欄位
+
+    返回:
+    - 字典: {field: DataFrame(index=日期, columns=股票代碼)}，停牌日以 NaN 表示
+    """
+    panel = {}
+    for field in fields:
+        columns = {
+            stock_id: df[field]
+            for stock_id, df in price_frames.items()
+            if df is not None and field in df.columns
+        }
+        if columns:
+            panel[field] = pd.DataFrame(columns).sort_index().astype(float)
+        else:
+            panel[field] = pd.DataFrame(dtype=float)
+    return panel
+
+
+def _compact_panel(frames, valid):
+    """
+    將每檔股票的有效K線往下對齊：缺漏日移到最前面並設為 NaN，有效K線依原順序排在後面，
+    使滾動與 ewm 運算只涵蓋該股票自己的K線 (與逐檔 dropna 後計算相同)，且最後一列即為最後一根有效K線
+
+    參數:
+    - frames: 相同形狀的寬表列表 (index=日期, columns=股票代碼)
+    - valid: 各日期是否為有效K線的布林寬表
+
+    返回:
+    - 對齊後的寬表列表 (index 為位置序號)
+    """
+    mask = valid.to_numpy()
+    # 穩定排序：無效列 (False) 在前、有效列 (True) 在後，各自保持原本的日期順序
+    order = np.argsort(mask, axis=0, kind="stable")
+    leading = np.arange(len(mask))[:, None] < (len(mask) - mask.sum(axis=0))[None, :]
+    compacted = []
+    for frame in frames:
+        values = np.take_along_axis(frame.to_numpy(dtype=np.float64), order, axis=0)
+        values[leading] = np.nan
+        compacted.append(pd.DataFrame(values, columns=frame.columns))
+    return compacted
+
+
+def compute_signal_table(panel, min_bars=30):
+    """
+    以欄向量化運算一次計算所有股票的技術指標
+
+    參數:
+    - panel: build_price_panel 產生的寬表 (至少需要 High、Low、Close)
+    - min_bars: 每檔股票最少需要的K線數量
+
+    返回:
+    - 訊號表 DataFrame (index=股票代碼, columns=SIGNAL_COLUMNS)
+    """
+    close = panel.get("Close")
+    if close is None or close.empty:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+    high = panel["High"].reindex(index=close.index, columns=close.columns)
+    low = panel["Low"].reindex(index=close.index, columns=close.columns)
+
+    # 寬表為所有股票日期的聯集，缺任一價格的日期不是該股票的K線 (同逐檔計算時的 dropna)
+    valid = close.notna() & high.notna() & low.notna()
+
+    # 排除資料不足的股票
+    valid_columns = close.columns[valid.sum() >= min_bars]
+    if len(valid_columns) == 0:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+    close, high, low = _compact_panel(
+        [close[valid_columns], high[valid_columns], low[valid_columns]], valid[valid_columns]
+    )
+
+    # MACD (沿用 generate_ta_signals 的 adjust=True 權重，與指標狀態的遞迴結果一致)
+    macd_line, signal_line, _ = macd(close, adjust=True)
+    macd_signal = (macd_line.iloc[-1] > signal_line.iloc[-1]).astype(int)
+
+    # KD (區間為零時 RSV 記為 0)
+    low_min = low.rolling(window=9).min()
+    high_max = high.rolling(window=9).max()
+    denom = high_max - low_min
+    rsv = ((close - low_min) / denom * 100).where(denom != 0, 0.0)
+    k = ema(rsv, 5, adjust=True)  # com=2 與 span=5 的平滑系數同為 1/3
+    d = ema(k, 5, adjust=True)
+
+    # RSI (平均跌幅為零時記為 0)
+    delta = close.diff()
+    avg_gain = delta.clip(lower=0).rolling(window=14).mean().iloc[-1]
+    avg_loss = (-delta).clip(lower=0).rolling(window=14).mean().iloc[-1]
+    rsi = (100 - 100 / (1 + avg_gain / avg_loss)).where(avg_loss > 0, 0.0)
+
+    # 均線
+    ma5 = close.rolling(window=5).mean()
+    ma20 = close.rolling(window=20).mean()
+    ma_score = (ma5.iloc[-1] > ma20.iloc[-1]).astype(int)
+
+    # 布林通道
+    upper = ma20 + 2 * close.rolling(window=20).std()
+    bb_signal = (close.iloc[-1] > upper.iloc[-1]).astype(int)
+
+    table = pd.DataFrame({
+        "MACD": macd_signal,
+        "K": k.iloc[-1].fillna(0.0),
+        "D": d.iloc[-1].fillna(0.0),
+        "RSI": rsi.fillna(0.0),
+        "均線": ma_score,
+        "布林通道": bb_signal,
+    })
+    table.index.name = "證券代號"
+    return table[SIGNAL_COLUMNS]
+
+
+def score_signal_table(table, weights=None):
+    """
+    依市場情緒權重為訊號表評分
+
+    參數:
+    - table: compute_signal_table 產生的訊號表
+    - weights: 各指標權重調整系數，None 表示全部為 1.0
+
+    返回:
+    - 分析結果字典 {stock_id: {"score", "desc", "label", "suggestion", "is_weak", "RSI"}}
+    """
+    if table is None or table.empty:
+        return {}
+    if weights is None:
+        weights = {}
+
+    k = table["K"].to_numpy(dtype=float)
+    d = table["D"].to_numpy(dtype=float)
+    rsi = table["RSI"].to_numpy(dtype=float)
+    ma = table["均線"].to_numpy()
+
+    # 各條件以布林陣列表示，順序即為描述文字的順序
+    conditions = [
+        (table["MACD"].to_numpy() == 1, "MACD", "MACD黃金交叉"),
+        ((k < 80) & (k > d), "KD", "KD黃金交叉"),
+        (rsi > 50, "RSI", "RSI走強"),
+        (ma == 1, "MA", "站上均線"),
+        (table["布林通道"].to_numpy() == 1, "BB", "布林通道偏多"),
+    ]
+
+    score = np.zeros(len(table))
+    for mask, key, _ in conditions:
+        score += mask * weights.get(key, 1.0)
+
+    is_recommend = score >= 7
+    is_weak = ~is_recommend & (rsi < 30) & (ma == 0)
+
+    results = {}
+    for i, sid in enumerate(table.index):
+        desc = [text for mask, _, text in conditions if mask[i]]
+
+        if is_recommend[i]:
+            label, suggestion = "✅ 推薦", "建議立即列入關注清單"
+        elif is_weak[i]:
+            label, suggestion = "⚠️ 走弱", "不建議操作，短線偏空"
+        else:
+            label, suggestion = "📌 觀察", "建議密切觀察"
+
+        results[sid] = {
+            "score": round(float(score[i]), 1),
+            "desc": "、".join(desc) if desc else "無明顯技術特徵",
+            "label": label,
+            "suggestion": suggestion,
+            "is_weak": bool(is_weak[i]),
+            "RSI": float(rsi[i])
+        }
+
+    return results
+
+
+def _compute_shard(shm_name, shape, index, columns, start, stop, min_bars):
+    """
+    子行程工作：由共享記憶體讀取一段股票的價格陣列並計算訊號表
+
+    參數:
+    - shm_name: 共享記憶體名稱
+    - shape: 陣列形狀 (欄位數, 日期數, 股票數)
+    - index: 日期索引
+    - columns: 本分片的股票代碼
+    - start, stop: 本分片在股票維度的範圍
+    - min_bars: 每檔股票最少需要的K線數量
+
+    返回:
+    - 本分片的訊號表
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        panel = {
+            field: pd.DataFrame(values[i, :, start:stop], index=index, columns=columns)
+            for i, field in enumerate(PANEL_FIELDS)
+        }
+        return compute_signal_table(panel, min_bars=min_bars)
+    finally:
+        shm.close()
+
+
+def compute_signal_table_parallel(panel, min_bars=30, workers=None):
+    """
+    以多行程計算訊號表：將股票分片到多個子行程，價格陣列經由共享記憶體傳遞 (不需 pickle DataFrame)，
+    各分片的訊號表依原順序合併，結果與 compute_signal_table 相同
+
+    參數:
+    - panel: build_price_panel 產生的寬表 (至少需要 High、Low、Close)
+    - min_bars: 每檔股票最少需要的K線數量
+    - workers: 子行程數，None 表示使用 TA_WORKERS
+
+    返回:
+    - 訊號表 DataFrame (index=股票代碼, columns=SIGNAL_COLUMNS)
+    """
+    close = panel.get("Close")
+    workers = workers or TA_WORKERS
+    if close is None or close.empty or workers <= 1 or len(close.columns) < TA_PARALLEL_MIN_STOCKS:
+        return compute_signal_table(panel, min_bars=min_bars)
+
+    columns = list(close.columns)
+    shape = (len(PANEL_FIELDS), len(close.index), len(columns))
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    values = None
+    try:
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for i, field in enumerate(PANEL_FIELDS):
+            values[i] = panel[field].reindex(index=close.index, columns=columns).to_numpy(dtype=np.float64)
+
+        bounds = np.linspace(0, len(columns), workers + 1).astype(int)
+        shards = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [
+                executor.submit(_compute_shard, shm.name, shape, close.index, columns[start:stop],
+                                start, stop, min_bars)
+                for start, stop in shards
+            ]
+            tables = [future.result() for future in futures]
+    except Exception as e:
+        print(f"[indicators] ⚠️ 多行程計算失敗，改為單行程計算：{e}")
+        return compute_signal_table(panel, min_bars=min_bars)
+    finally:
+        # 釋放對共享記憶體的參照後才能關閉
+        values = None
+        shm.close()
+        shm.unlink()
+
+    tables = [table for table in tables if not table.empty]
+    if not tables:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+    table = pd.concat(tables)
+    table.index.name = "證券代號"
+    return table[SIGNAL_COLUMNS]
+
+
+def compute_signals(panel, min_bars=30, parallel=None):
+    """
+    計算訊號表，依設定選擇單行程或多行程
+
+    參數:
+    - panel: build_price_panel 產生的寬表
+    - min_bars: 每檔股票最少需要的K線數量
+    - parallel: 是否使用多行程，None 表示依 TA_PARALLEL 設定
+
+    返回:
+    - 訊號表 DataFrame
+    """
+    if parallel is None:
+        parallel = TA_PARALLEL
+    if parallel:
+        return compute_signal_table_parallel(panel, min_bars=min_bars)
+    return compute_signal_table(panel, min_bars=min_bars)
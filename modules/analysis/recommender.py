@@ -2,69 +2,629 @@
 股票推薦生成模組 - 支持多種策略選股
 """
 import os
-import json
 import traceback
-import yfinance as yf
+from contextlib import contextmanager
+import pandas as pd
 from datetime import datetime, timedelta
 
 # 修正導入路徑
 from modules.data.fetcher import get_top_stocks
+from modules.data.market_snapshot import get_market_quotes, get_ranked_universe
+from modules.data.stock_master import get_stock_master
+from modules.data.async_fetcher import fetch_many
 from modules.data.scraper import get_eps_data
+from modules.data.price_history import get_price_history, get_ticker_info
 from modules.analysis.technical import analyze_technical_indicators
+from modules.analysis.sentiment import get_market_strength_table
+from modules.tracing import span, traced, count as count_event
+from modules.cache_store import read_json, write_json
 
 # 直接定義 CACHE_DIR 而不是導入
 CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# 多策略分析共用掃描的股票數 (短線 30~50、長線 100、極弱股 50 檔的聯集)
+MULTI_STRATEGY_SCAN_LIMIT = 100
+
+# 各策略的掃描限制
+LONG_TERM_SCAN_LIMIT = 100
+WEAK_SCAN_LIMIT = 50
+GENERIC_SHORT_TERM_SCAN_LIMIT = 50
+
+# 晚間時段是否掃描全部上市股票 (get_all_valid_twse_stocks 的完整清單，而非成交金額前 N 名)
+EVENING_FULL_SCAN = os.getenv("EVENING_FULL_SCAN", "false").lower() in ('true', 'yes', '1', 'on')
+
+# 全市場掃描的目標耗時 (秒，價格歷史與行情快照已有快取時)
+FULL_SCAN_TARGET_SECONDS = float(os.getenv("FULL_SCAN_TARGET_SECONDS", "60"))
+
+# 短線策略排除相對強度落後的股票：rs_percentile (0~100) 低於此值者不推薦，0 表示不篩選 (預設)
+SHORT_TERM_MIN_RS_PERCENTILE = float(os.getenv("SHORT_TERM_MIN_RS_PERCENTILE", "0"))
+
+# 極弱股警示中相對強度位於後段 (rs_percentile 不高於此值) 時加註「弱於大盤」，0 表示不標註 (預設)
+WEAK_RS_PERCENTILE = float(os.getenv("WEAK_RS_PERCENTILE", "0"))
+
+# 是否需要相對強度排名表 (兩項設定都關閉時不計算，避免每次掃描都下載全部股票的股價歷史)
+RS_RANKING_ENABLED = SHORT_TERM_MIN_RS_PERCENTILE > 0 or WEAK_RS_PERCENTILE > 0
+
+# Yahoo Finance 補查報價的同時請求數 (速率由 rate_limiter 控制)
+QUOTE_FETCH_CONCURRENCY = int(os.getenv("QUOTE_FETCH_CONCURRENCY", "4"))
+
+
+def is_morning_pick(data):
+    """早盤策略: KD曲線向上，RSI > 50，MACD > 0"""
+    return data.get('RSI', 0) > 50 and data.get('score', 0) >= 3
+
+
+def is_noon_pick(data):
+    """午盤策略: 技術指標得分高且均線多頭排列"""
+    return '均線多頭排列' in data.get('desc', '') and data.get('score', 0) >= 3
+
+
+def is_afternoon_pick(data):
+    """下午策略: 突破盤整，交易量放大"""
+    return '突破盤整' in data.get('desc', '') and data.get('score', 0) >= 3
+
+
+def is_evening_pick(data):
+    """盤後策略: 技術指標良好，當日表現不錯"""
+    return data.get('score', 0) >= 4
+
+
+def is_short_term_pick(data):
+    """通用短線條件: RSI > 50、KD 金叉、MACD 翻多、均線支撐"""
+    return data.get('RSI', 0) > 50 and 'KD黃金交叉' in data.get('desc', '') and data.get('score', 0) >= 3
+
+
+def is_weak_stock(data):
+    """極弱股條件：RSI < 30, 技術指標得分低，跌破支撐"""
+    return data.get('RSI', 99) < 30 or data.get('score', 5) <= 1 or '跌破支撐' in data.get('desc', '')
+
+
+def long_term_score(data, eps_info):
+    """
+    長線評分 (不含本益比，本益比需在取得報價後加分)
+
+    參數:
+    - data: 技術分析結果
+    - eps_info: 該股票的 EPS 與股息資料
+
+    返回:
+    - (評分, 理由列表)
+    """
+    eps = eps_info.get('eps', 0)
+    dividend = eps_info.get('dividend', 0)
+
+    score = 0
+    reasons = []
+
+    # EPS 評分
+    if eps and eps > 5:
+        score += 2
+        reasons.append(f"EPS {eps} 元優異")
+    elif eps and eps > 2:
+        score += 1
+        reasons.append(f"EPS {eps} 元良好")
+
+    # 股息率評分
+    if dividend and dividend >= 4:
+        score += 2
+        reasons.append(f"殖利率 {dividend}% 豐厚")
+    elif dividend and dividend >= 2.5:
+        score += 1
+        reasons.append(f"殖利率 {dividend}% 不錯")
+
+    # 技術面評分
+    if data.get('score', 0) >= 4:
+        score += 2
+        reasons.append(data.get('desc', '技術指標強勢'))
+    elif data.get('score', 0) >= 2:
+        score += 1
+        reasons.append(data.get('desc', '技術指標尚可'))
+
+    return score, reasons
+
+
+# 各時段短線策略的 (掃描限制, 篩選條件)
+SHORT_TERM_RULES = {
+    'morning': (40, is_morning_pick),
+    'noon': (30, is_noon_pick),
+    'afternoon': (30, is_afternoon_pick),
+    'evening': (50, is_evening_pick),
+}
+
+
+def rank_candidates(matches, pre_score):
+    """
+    依取得報價前即可計算的預估分數排序候選股票
+
+    參數:
+    - matches: 候選列表 (每項第一個元素為股票代碼)
+    - pre_score: 計算預估分數的函數
+
+    返回:
+    - 候選在 matches 中的索引列表 (分數高者在前，同分依原順序)
+    """
+    return sorted(range(len(matches)), key=lambda i: (-pre_score(matches[i]), i))
+
+
+def _enrich_in_rank_order(matches, order, resolve, build, chunk_size):
+    """依排名順序逐批取得報價並建立候選結果 (生成器，呼叫端停止迭代後不再查詢)"""
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        quotes = resolve([matches[i][0] for i in chunk])
+        for i in chunk:
+            yield i, build(matches[i], quotes.get(matches[i][0]))
+
+
+def select_top(matches, count, pre_score, build, resolve, max_bonus=0):
+    """
+    依預估分數的排名逐批取得報價，前 count 名確定後即停止，其餘候選不再查詢
+
+    參數:
+    - matches: 候選列表 (每項第一個元素為股票代碼，順序即原始掃描順序)
+    - count: 需要的數量
+    - pre_score: 取得報價前的預估分數函數
+    - build: 以 (候選, 報價) 建立結果的函數，返回 (最終分數, 結果字典)，不採用時返回 None
+    - resolve: 批次取得報價的函數 (股票代碼列表 -> {股票代碼: 報價})
+    - max_bonus: 取得報價後最多能增加的分數
+
+    返回:
+    - 最終分數由高到低 (同分依原順序) 的前 count 筆結果
+    """
+    if count <= 0 or not matches:
+        return []
+
+    order = rank_candidates(matches, pre_score)
+    results = []  # (排序鍵, 結果字典)
+    for position, (i, built) in enumerate(_enrich_in_rank_order(matches, order, resolve, build, count)):
+        if built is not None:
+            score, candidate = built
+            results.append(((-score, i), candidate))
+
+        if len(results) < count or position + 1 >= len(order):
+            continue
+
+        # 下一個候選的分數上限仍無法擠進前 count 名時，之後的候選 (上限更低) 也不可能
+        results.sort(key=lambda x: x[0])
+        nxt = order[position + 1]
+        if (-(pre_score(matches[nxt]) + max_bonus), nxt) > results[count - 1][0]:
+            break
+
+    results.sort(key=lambda x: x[0])
+    return [candidate for _, candidate in results[:count]]
+
+
+class ScanContext:
+    """
+    單一時段共用的技術掃描結果
+
+    熱門股依成交金額排序，各策略的掃描範圍都是同一份排序的前 N 檔，
+    因此只需對聯集範圍執行一次 get_top_stocks 與 analyze_technical_indicators，
+    各策略再依自己的掃描限制篩選。
+    """
+
+    def __init__(self, time_slot, stock_ids, tech_results, full=False, timings=None):
+        """
+        初始化掃描結果
+
+        參數:
+        - time_slot: 時段
+        - stock_ids: 依成交金額排序的股票代碼列表
+        - tech_results: analyze_technical_indicators 的分析結果
+        - full: 是否為全市場掃描 (各策略不再套用掃描限制)
+        - timings: 已記錄的各階段耗時 {階段: 秒}
+        """
+        self.time_slot = time_slot
+        self.stock_ids = list(stock_ids)
+        self.tech_results = tech_results
+        self.full = full
+        self.timings = dict(timings or {})
+        self.quotes = {}  # 已解析的報價 {股票代碼: 報價字典或 None}
+        self._strength = None  # 相對強度與資金流向排名表 (第一次使用時計算)
+
+    @staticmethod
+    def build(time_slot, scan_limit):
+        """
+        執行一次技術掃描
+
+        參數:
+        - time_slot: 時段
+        - scan_limit: 掃描的股票數
+
+        返回:
+        - ScanContext 實例
+        """
+        print(f"[stock_recommender] ⏳ 執行{time_slot}共用技術掃描 ({scan_limit} 檔)...")
+        timings = {}
+        with span("recommender.universe") as stage:
+            stock_ids = get_top_stocks(limit=scan_limit)
+        timings["universe"] = stage["duration"]
+        tech_results = analyze_technical_indicators(stock_ids, timings=timings)
+        return ScanContext(time_slot, stock_ids, tech_results, timings=timings)
+
+    @staticmethod
+    def build_full(time_slot):
+        """
+        執行全市場技術掃描：全部上市股票一次批次取得價格歷史 (共用價格快取)，
+        以多行程向量化計算指標並一次評分
+
+        參數:
+        - time_slot: 時段
+
+        返回:
+        - ScanContext 實例
+        """
+        timings = {}
+        with span("recommender.universe", full=True) as stage:
+            stock_ids = full_market_universe()
+        timings["universe"] = stage["duration"]
+        print(f"[stock_recommender] ⏳ 執行{time_slot}全市場技術掃描 ({len(stock_ids)} 檔)...")
+        tech_results = analyze_technical_indicators(stock_ids, parallel=True, timings=timings)
+        return ScanContext(time_slot, stock_ids, tech_results, full=True, timings=timings)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        記錄一個階段的耗時 (同名階段累加，同時記為追蹤區段 recommender.<name>)
+
+        參數:
+        - name: 階段名稱
+        """
+        with span(f"recommender.{name}") as stage:
+            try:
+                yield
+            finally:
+                self.timings[name] = self.timings.get(name, 0.0) + stage["duration"]
+
+    def report(self):
+        """
+        輸出各階段耗時報告 (全市場掃描時與目標耗時比較)
+
+        返回:
+        - 字典 {"mode", "stocks", "scored", "stages", "total", "target", "within_target"}
+        """
+        total = sum(self.timings.values())
+        report = {
+            "mode": "full" if self.full else "top",
+            "stocks": len(self.stock_ids),
+            "scored": len(self.tech_results),
+            "stages": {name: round(seconds, 3) for name, seconds in self.timings.items()},
+            "total": round(total, 3),
+            "target": FULL_SCAN_TARGET_SECONDS if self.full else None,
+            "within_target": total <= FULL_SCAN_TARGET_SECONDS if self.full else None,
+        }
+
+        stages = "、".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+        print(f"[stock_recommender] ⏱️ {self.time_slot}掃描 {report['scored']}/{report['stocks']} 檔，"
+              f"總耗時 {total:.2f}s ({stages})")
+        if self.full:
+            rate = report['stocks'] / total if total > 0 else 0.0
+            status = "✅ 達成" if report["within_target"] else "⚠️ 超過"
+            print(f"[stock_recommender] {status}全市場掃描目標 {FULL_SCAN_TARGET_SECONDS:.0f}s (每秒 {rate:.0f} 檔)")
+        return report
+
+    def top(self, limit):
+        """
+        取得前 limit 檔熱門股的技術分析結果 (全市場掃描時返回全部結果)
+
+        參數:
+        - limit: 掃描限制
+
+        返回:
+        - 分析結果字典 (順序與 analyze_technical_indicators 相同)
+        """
+        if self.full:
+            return {sid: self.tech_results[sid] for sid in self.stock_ids if sid in self.tech_results}
+        if limit > len(self.stock_ids):
+            print(f"[stock_recommender] ⚠️ 共用掃描僅涵蓋 {len(self.stock_ids)} 檔，少於要求的 {limit} 檔")
+        return {
+            sid: self.tech_results[sid]
+            for sid in self.stock_ids[:limit]
+            if sid in self.tech_results
+        }
+
+    def strength_table(self):
+        """
+        取得掃描範圍內全部股票的相對強度與資金流向排名表 (一次向量化計算，之後直接重用)
+
+        短線策略依 rs_percentile 排除落後股 (見 StockRecommender._drop_laggards)，
+        極弱股警示以此標註弱於大盤的股票
+
+        返回:
+        - DataFrame (index=股票代碼，依相對強度由強到弱排序)，計算失敗時為空表
+        """
+        if self._strength is None:
+            try:
+                self._strength = get_market_strength_table(self.stock_ids)
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ 相對強度計算失敗：{e}")
+                self._strength = pd.DataFrame(columns=["rs_percentile"])
+        return self._strength
+
+    def rs_percentiles(self):
+        """
+        取得各股票的相對強度百分位
+
+        返回:
+        - 字典 {股票代碼: rs_percentile}，資料不足 (NaN) 的股票不會出現
+        """
+        return self.strength_table()["rs_percentile"].dropna().to_dict()
+
+    def quotes_for(self, stock_ids):
+        """
+        取得多檔股票的報價，尚未解析的股票一次批次查詢後存入共用報價表
+
+        參數:
+        - stock_ids: 股票代碼列表
+
+        返回:
+        - 字典 {股票代碼: 報價字典或 None}
+        """
+        missing = [sid for sid in dict.fromkeys(stock_ids) if sid not in self.quotes]
+        if missing:
+            # 全市場掃描的候選可達數百檔：快照沒有收盤價即為當日未成交，不再逐檔查詢 Yahoo Finance
+            self.quotes.update(resolve_quotes(missing, yahoo_fallback=not self.full))
+        return {sid: self.quotes.get(sid) for sid in stock_ids}
+
+
+def full_market_universe():
+    """
+    取得全市場掃描的股票清單：get_all_valid_twse_stocks 的全部上市股票 (經由股票基本資料表)，
+    當日有成交的股票依成交金額排序在前，其餘依原清單順序接在後面
+
+    返回:
+    - 股票代碼列表
+    """
+    try:
+        ranked = get_ranked_universe()
+    except Exception as e:
+        print(f"[stock_recommender] ⚠️ 行情快照讀取失敗：{e}")
+        ranked = []
+
+    try:
+        listed = [record["stock_id"] for record in get_stock_master().all()]
+    except Exception as e:
+        print(f"[stock_recommender] ⚠️ 股票基本資料讀取失敗：{e}")
+        listed = []
+
+    if not listed:
+        # 沒有股票列表時只保留行情快照中的一般股票代碼
+        return [sid for sid in ranked if len(sid) == 4 and sid.isdigit()]
+
+    listed_set = set(listed)
+    universe = [sid for sid in ranked if sid in listed_set]
+    seen = set(universe)
+    universe += [sid for sid in listed if sid not in seen]
+    return universe
+
+
+def _snapshot_quote(quotes, sid):
+    """由行情快照報價表取得報價，無當日收盤價時返回 None"""
+    if quotes is None or sid not in quotes.index:
+        return None
+    quote = quotes.loc[sid]
+    if pd.isna(quote.get('close')):
+        return None
+    return {
+        'name': quote.get('name') or sid,
+        'current_price': float(quote['close']),
+        'pe_ratio': quote['pe'] if pd.notna(quote.get('pe')) else None
+    }
+
+
+def _yahoo_quote(sid):
+    """由 Yahoo Finance 取得報價 (行情快照缺少的股票)"""
+    info = get_ticker_info(sid)
+    history = get_price_history(sid, period="1mo")
+    if history.empty:
+        return None
+    return {
+        'name': info.get('shortName', sid),
+        'current_price': history['Close'].iloc[-1],
+        'pe_ratio': info.get('trailingPE')
+    }
+
+
+def resolve_quotes(stock_ids, yahoo_fallback=True):
+    """
+    批次取得多檔股票的名稱、現價與本益比：先以證交所當日行情快照一次解析，
+    快照缺少的股票再以速率限制下的並行請求查詢 Yahoo Finance
+
+    參數:
+    - stock_ids: 股票代碼列表 (重複的代碼只查詢一次)
+    - yahoo_fallback: 快照缺少的股票是否改由 Yahoo Finance 查詢
+
+    返回:
+    - 字典 {股票代碼: {"name", "current_price", "pe_ratio"}}，無價格資料的股票值為 None
+    """
+    stock_ids = list(dict.fromkeys(stock_ids))
+    if not stock_ids:
+        return {}
+
+    try:
+        quotes = get_market_quotes()
+    except Exception as e:
+        print(f"[stock_recommender] ⚠️ 行情快照讀取失敗：{e}")
+        quotes = None
+
+    resolved = {sid: _snapshot_quote(quotes, sid) for sid in stock_ids}
+    count_event("quotes.snapshot", sum(quote is not None for quote in resolved.values()))
+
+    # 當日無成交或不在上市行情中：退回 Yahoo Finance
+    missing = [sid for sid, quote in resolved.items() if quote is None]
+    if missing and yahoo_fallback:
+        print(f"[stock_recommender] ⏳ 行情快照缺少 {len(missing)} 檔，改由 Yahoo Finance 查詢...")
+        count_event("quotes.yahoo", len(missing))
+        results = fetch_many('yahoo_finance', _yahoo_quote, [(sid,) for sid in missing],
+                             concurrency=QUOTE_FETCH_CONCURRENCY)
+        for sid, result in zip(missing, results):
+            if isinstance(result, Exception):
+                print(f"[stock_recommender] ⚠️ {sid} 報價查詢失敗：{result}")
+                continue
+            resolved[sid] = result
+
+    return resolved
+
+
+def lookup_quote(sid):
+    """
+    取得股票名稱、現價與本益比：優先使用證交所當日行情快照，快照缺少時才查詢 Yahoo Finance
+
+    參數:
+    - sid: 股票代碼
+
+    返回:
+    - 字典 {"name", "current_price", "pe_ratio"}，無價格資料時返回 None
+    """
+    return resolve_quotes([sid]).get(sid)
+
+
 class StockRecommender:
     """
     股票推薦系統，提供多種選股策略
     """
     
     @staticmethod
-    def _morning_strategy(count=5):
+    def _scan_results(scan_limit, scan=None):
+        """
+        取得前 scan_limit 檔熱門股的技術分析結果
+        
+        參數:
+        - scan_limit: 掃描限制
+        - scan: 共用的 ScanContext，None 表示自行掃描
+        
+        返回:
+        - 分析結果字典
+        """
+        if scan is not None:
+            return scan.top(scan_limit)
+        
+        # 獲取熱門股票並分析技術指標
+        stock_ids = get_top_stocks(limit=scan_limit)
+        return analyze_technical_indicators(stock_ids)
+    
+    @staticmethod
+    def _quotes_for(stock_ids, scan=None):
+        """
+        批次取得候選股票的報價 (有共用掃描結果時使用其報價表)
+        
+        參數:
+        - stock_ids: 股票代碼列表
+        - scan: 共用的 ScanContext
+        
+        返回:
+        - 字典 {股票代碼: 報價字典或 None}
+        """
+        if scan is not None:
+            return scan.quotes_for(stock_ids)
+        return resolve_quotes(stock_ids)
+    
+    @staticmethod
+    def _load_eps_data():
+        """獲取 EPS 和股息數據，失敗時返回空字典"""
+        try:
+            return get_eps_data(use_cache=True, cache_expiry_hours=72)
+        except Exception as e:
+            print(f"[stock_recommender] ⚠️ 獲取 EPS 數據失敗: {e}")
+            return {}
+    
+    @staticmethod
+    def _drop_laggards(matches, scan=None):
+        """
+        排除相對強度落後大盤的短線候選股
+
+        參數:
+        - matches: [(股票代碼, 技術分析結果)]
+        - scan: 共用的 ScanContext，None 表示不篩選
+
+        返回:
+        - 篩選後的列表 (沒有相對強度資料的股票保留)
+        """
+        if scan is None or SHORT_TERM_MIN_RS_PERCENTILE <= 0:
+            return matches
+        percentiles = scan.rs_percentiles()
+        return [(sid, data) for sid, data in matches
+                if percentiles.get(sid, 100) >= SHORT_TERM_MIN_RS_PERCENTILE]
+
+    @staticmethod
+    def _collect_candidates(time_slot, scan, eps_data, long_term_count, weak_stock_count):
+        """
+        收集三種策略第一批需要報價的候選股票 (去除重複)
+        
+        短線策略依現價排序，需要全部候選的報價；長線與極弱股依取得報價前的
+        預估分數排名，只需前 count 名，其餘候選由 select_top 視需要再查詢。
+        
+        參數:
+        - time_slot: 時段
+        - scan: 共用的 ScanContext
+        - eps_data: EPS 和股息數據
+        - long_term_count: 長線推薦數量
+        - weak_stock_count: 極弱股數量
+        
+        返回:
+        - 股票代碼列表
+        """
+        short_limit, short_pick = SHORT_TERM_RULES.get(
+            time_slot, (GENERIC_SHORT_TERM_SCAN_LIMIT, is_short_term_pick))
+        
+        short_matches = [(sid, data) for sid, data in scan.top(short_limit).items() if short_pick(data)]
+        stock_ids = [sid for sid, _ in StockRecommender._drop_laggards(short_matches, scan)]
+        
+        long_matches = []
+        for sid, data in scan.top(LONG_TERM_SCAN_LIMIT).items():
+            score = long_term_score(data, eps_data.get(sid, {}))[0]
+            if score >= 3:
+                long_matches.append((sid, score))
+        order = rank_candidates(long_matches, lambda match: match[1])
+        stock_ids += [long_matches[i][0] for i in order[:long_term_count]]
+        
+        weak_matches = [(sid, data) for sid, data in scan.top(WEAK_SCAN_LIMIT).items() if is_weak_stock(data)]
+        order = rank_candidates(weak_matches, lambda match: -match[1].get('RSI', 50))
+        stock_ids += [weak_matches[i][0] for i in order[:weak_stock_count]]
+        
+        return list(dict.fromkeys(stock_ids))
+    
+    @staticmethod
+    def _morning_strategy(count=5, scan=None):
         """
         早盤前策略: 關注前一天收漲且技術指標偏多的股票
         """
         # 掃描限制
         scan_limit = 40
         
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
-        
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
         # 篩選符合條件的股票
+        matches = [(sid, data) for sid, data in tech_results.items() if is_morning_pick(data)]
+        matches = StockRecommender._drop_laggards(matches, scan)
+        quotes = StockRecommender._quotes_for([sid for sid, _ in matches], scan)
+        
         candidates = []
-        for sid, data in tech_results.items():
-            # 早盤策略: KD曲線向上，RSI > 50，MACD > 0
-            if data.get('RSI', 0) > 50 and data.get('score', 0) >= 3:
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 計算目標價和止損價
-                    target_price = round(current_price * 1.05, 2)  # 上漲5%
-                    stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+        for sid, data in matches:
+            try:
+                quote = quotes.get(sid)
+                
+                if quote is None:
+                    continue
                     
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'reason': data.get('desc', '技術指標強勢'),
-                        'target_price': target_price,
-                        'stop_loss': stop_loss,
-                        'current_price': current_price
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 計算目標價和止損價
+                target_price = round(current_price * 1.05, 2)  # 上漲5%
+                stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+                
+                candidates.append({
+                    'code': sid,
+                    'name': name,
+                    'reason': data.get('desc', '技術指標強勢'),
+                    'target_price': target_price,
+                    'stop_loss': stop_loss,
+                    'current_price': current_price
+                })
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
         
         # 排序並限制數量
         candidates.sort(key=lambda x: x.get('current_price', 0) / x.get('stop_loss', 1), reverse=True)  # 風險報酬比排序
@@ -72,49 +632,46 @@ class StockRecommender:
         return candidates[:count]
     
     @staticmethod
-    def _noon_strategy(count=3):
+    def _noon_strategy(count=3, scan=None):
         """
         午盤策略: 關注上午交易量增加且呈現多頭排列的股票
         """
         # 掃描限制
         scan_limit = 30
         
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
-        
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
         # 篩選符合條件的股票
+        matches = [(sid, data) for sid, data in tech_results.items() if is_noon_pick(data)]
+        matches = StockRecommender._drop_laggards(matches, scan)
+        quotes = StockRecommender._quotes_for([sid for sid, _ in matches], scan)
+        
         candidates = []
-        for sid, data in tech_results.items():
-            # 技術指標得分高且符合午盤策略的股票
-            if '均線多頭排列' in data.get('desc', '') and data.get('score', 0) >= 3:
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 計算目標價和止損價
-                    target_price = round(current_price * 1.05, 2)  # 上漲5%
-                    stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+        for sid, data in matches:
+            try:
+                quote = quotes.get(sid)
+                
+                if quote is None:
+                    continue
                     
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'reason': data.get('desc', '技術指標強勢'),
-                        'target_price': target_price,
-                        'stop_loss': stop_loss,
-                        'current_price': current_price
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 計算目標價和止損價
+                target_price = round(current_price * 1.05, 2)  # 上漲5%
+                stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+                
+                candidates.append({
+                    'code': sid,
+                    'name': name,
+                    'reason': data.get('desc', '技術指標強勢'),
+                    'target_price': target_price,
+                    'stop_loss': stop_loss,
+                    'current_price': current_price
+                })
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
         
         # 排序並限制數量
         candidates.sort(key=lambda x: x.get('current_price', 0) / x.get('stop_loss', 1), reverse=True)  # 風險報酬比排序
@@ -122,49 +679,46 @@ class StockRecommender:
         return candidates[:count]
     
     @staticmethod
-    def _afternoon_strategy(count=3):
+    def _afternoon_strategy(count=3, scan=None):
         """
         下午策略: 關注突破盤整且交易量放大的股票
         """
         # 掃描限制
         scan_limit = 30
         
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
-        
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
         # 篩選符合條件的股票
+        matches = [(sid, data) for sid, data in tech_results.items() if is_afternoon_pick(data)]
+        matches = StockRecommender._drop_laggards(matches, scan)
+        quotes = StockRecommender._quotes_for([sid for sid, _ in matches], scan)
+        
         candidates = []
-        for sid, data in tech_results.items():
-            # 下午策略: 突破盤整，交易量放大
-            if '突破盤整' in data.get('desc', '') and data.get('score', 0) >= 3:
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 計算目標價和止損價
-                    target_price = round(current_price * 1.04, 2)  # 上漲4%
-                    stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+        for sid, data in matches:
+            try:
+                quote = quotes.get(sid)
+                
+                if quote is None:
+                    continue
                     
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'reason': data.get('desc', '突破盤整'),
-                        'target_price': target_price,
-                        'stop_loss': stop_loss,
-                        'current_price': current_price
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 計算目標價和止損價
+                target_price = round(current_price * 1.04, 2)  # 上漲4%
+                stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+                
+                candidates.append({
+                    'code': sid,
+                    'name': name,
+                    'reason': data.get('desc', '突破盤整'),
+                    'target_price': target_price,
+                    'stop_loss': stop_loss,
+                    'current_price': current_price
+                })
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
         
         # 排序並限制數量
         candidates.sort(key=lambda x: x.get('current_price', 0) / x.get('stop_loss', 1), reverse=True)  # 風險報酬比排序
@@ -172,49 +726,46 @@ class StockRecommender:
         return candidates[:count]
     
     @staticmethod
-    def _evening_strategy(count=5):
+    def _evening_strategy(count=5, scan=None):
         """
         盤後策略: 關注當日表現良好，技術指標多頭的股票
         """
         # 掃描限制
         scan_limit = 50
         
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
-        
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
         # 篩選符合條件的股票
+        matches = [(sid, data) for sid, data in tech_results.items() if is_evening_pick(data)]
+        matches = StockRecommender._drop_laggards(matches, scan)
+        quotes = StockRecommender._quotes_for([sid for sid, _ in matches], scan)
+        
         candidates = []
-        for sid, data in tech_results.items():
-            # 盤後策略: 技術指標良好，當日表現不錯
-            if data.get('score', 0) >= 4:
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 計算目標價和止損價
-                    target_price = round(current_price * 1.07, 2)  # 上漲7%
-                    stop_loss = round(current_price * 0.95, 2)     # 下跌5%
+        for sid, data in matches:
+            try:
+                quote = quotes.get(sid)
+                
+                if quote is None:
+                    continue
                     
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'reason': data.get('desc', '技術指標強勢'),
-                        'target_price': target_price,
-                        'stop_loss': stop_loss,
-                        'current_price': current_price
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 計算目標價和止損價
+                target_price = round(current_price * 1.07, 2)  # 上漲7%
+                stop_loss = round(current_price * 0.95, 2)     # 下跌5%
+                
+                candidates.append({
+                    'code': sid,
+                    'name': name,
+                    'reason': data.get('desc', '技術指標強勢'),
+                    'target_price': target_price,
+                    'stop_loss': stop_loss,
+                    'current_price': current_price
+                })
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 分析失敗：{e}")
         
         # 排序並限制數量
         candidates.sort(key=lambda x: x.get('current_price', 0) / x.get('stop_loss', 1), reverse=True)  # 風險報酬比排序
@@ -222,73 +773,73 @@ class StockRecommender:
         return candidates[:count]
     
     @staticmethod
-    def get_weak_valley_alerts(count=2):
+    def get_weak_valley_alerts(count=2, scan=None):
         """
         獲取技術極弱股警示
         """
         # 掃描限制
-        scan_limit = 50
+        scan_limit = WEAK_SCAN_LIMIT
         
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
-        
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
         # 篩選符合條件的股票
-        candidates = []
-        for sid, data in tech_results.items():
-            # 極弱股條件：RSI < 30, 技術指標得分低，跌破支撐
-            if data.get('RSI', 99) < 30 or data.get('score', 5) <= 1 or '跌破支撐' in data.get('desc', ''):
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 警報原因
-                    alert_reasons = []
-                    if data.get('RSI', 99) < 30:
-                        alert_reasons.append(f"RSI低迷({data.get('RSI', 0):.1f})")
-                    if '跌破支撐' in data.get('desc', ''):
-                        alert_reasons.append('跌破重要支撐')
-                    if data.get('score', 5) <= 1:
-                        alert_reasons.append('技術指標極弱')
-                    
-                    alert_reason = "、".join(alert_reasons)
+        matches = [(sid, data) for sid, data in tech_results.items() if is_weak_stock(data)]
+        percentiles = scan.rs_percentiles() if scan is not None and WEAK_RS_PERCENTILE > 0 else {}
+        
+        def build(match, quote):
+            sid, data = match
+            try:
+                if quote is None:
+                    return None
                     
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'alert_reason': alert_reason,
-                        'current_price': current_price
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 弱勢分析失敗：{e}")
-        
-        # 排序並限制數量 (按RSI值升序排序)
-        candidates.sort(key=lambda x: tech_results.get(x['code'], {}).get('RSI', 50))
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 警報原因
+                alert_reasons = []
+                if data.get('RSI', 99) < 30:
+                    alert_reasons.append(f"RSI低迷({data.get('RSI', 0):.1f})")
+                if '跌破支撐' in data.get('desc', ''):
+                    alert_reasons.append('跌破重要支撐')
+                if data.get('score', 5) <= 1:
+                    alert_reasons.append('技術指標極弱')
+                if percentiles.get(sid, 100) <= WEAK_RS_PERCENTILE:
+                    alert_reasons.append('弱於大盤')
+                
+                alert_reason = "、".join(alert_reasons)
+                
+                return -data.get('RSI', 50), {
+                    'code': sid,
+                    'name': name,
+                    'alert_reason': alert_reason,
+                    'current_price': current_price
+                }
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 弱勢分析失敗：{e}")
+                return None
         
-        return candidates[:count]
+        # 按RSI值升序排序：RSI 在取得報價前已知，依序查詢到滿足數量即停止
+        return select_top(matches, count, lambda match: -match[1].get('RSI', 50), build,
+                          lambda ids: StockRecommender._quotes_for(ids, scan))
     
     @staticmethod
-    def get_multi_strategy_recommendations(time_slot="morning", count=None):
+    @traced("recommender.multi_strategy")
+    def get_multi_strategy_recommendations(time_slot="morning", count=None, full_scan=None):
         """
         獲取多策略股票推薦 (短線、長線、極弱股)
         
         Args:
             time_slot (str): 時段 ('morning', 'noon', 'afternoon', 'evening')
             count (int): 每種策略的推薦股票數量
+            full_scan (bool): 是否掃描全部上市股票，None 表示晚間時段依 EVENING_FULL_SCAN 設定
         
         Returns:
             dict: 包含三種策略的推薦股票字典
         """
-        print(f"[stock_recommender] ⏳ 執行{time_slot}多策略分析...")
+        if full_scan is None:
+            full_scan = time_slot == 'evening' and EVENING_FULL_SCAN
+        print(f"[stock_recommender] ⏳ 執行{time_slot}多策略分析{'(全市場)' if full_scan else ''}...")
         
         # 根據時段設置每類推薦數量
         if count is None:
@@ -318,30 +869,52 @@ class StockRecommender:
             weak_stock_count = min(count, 2)  # 極弱股最多2檔，避免過多負面訊息
         
         # 檢查緩存
-        cache_file = os.path.join(CACHE_DIR, f'multi_strategy_{time_slot}_cache.json')
+        cache_name = f'{time_slot}_full' if full_scan else time_slot
+        cache_file = os.path.join(CACHE_DIR, f'multi_strategy_{cache_name}_cache.json')
         if os.path.exists(cache_file):
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    cache_data = json.load(f)
-                    cache_time = datetime.fromisoformat(cache_data['timestamp'])
-                    
-                    # 如果緩存時間不超過30分鐘，直接使用緩存
-                    if (datetime.now() - cache_time).total_seconds() < 1800:  # 30分鐘
-                        print(f"[stock_recommender] ✅ 使用緩存的{time_slot}多策略推薦")
-                        return cache_data['recommendations']
+                cache_data = read_json(cache_file)
+                cache_time = datetime.fromisoformat(cache_data['timestamp'])
+                
+                # 如果緩存時間不超過30分鐘，直接使用緩存
+                if (datetime.now() - cache_time).total_seconds() < 1800:  # 30分鐘
+                    print(f"[stock_recommender] ✅ 使用緩存的{time_slot}多策略推薦")
+                    return cache_data['recommendations']
             except Exception as e:
                 print(f"[stock_recommender] ⚠️ 讀取多策略推薦緩存失敗: {e}")
         
         # 獲取各策略推薦
         try:
-            # 1. 獲取短線推薦
-            short_term_stocks = StockRecommender._short_term_strategy(short_term_count, time_slot)
+            # 0. 以三種策略的聯集範圍執行一次技術掃描，各策略共用
+            #    (全市場掃描時涵蓋全部上市股票，各策略不再套用掃描限制)
+            if full_scan:
+                scan = ScanContext.build_full(time_slot)
+            else:
+                scan = ScanContext.build(time_slot, MULTI_STRATEGY_SCAN_LIMIT)
+            with scan.stage("eps"):
+                eps_data = StockRecommender._load_eps_data()
+            
+            # 相對強度排名表一次計算，短線策略與極弱股警示共用 (有啟用相關設定時)
+            if RS_RANKING_ENABLED:
+                with scan.stage("strength"):
+                    scan.strength_table()
             
-            # 2. 獲取長線推薦
-            long_term_stocks = StockRecommender._long_term_strategy(long_term_count, time_slot)
+            # 先收集三種策略的候選股票，去除重複後一次批次取得名稱、現價與本益比
+            with scan.stage("quotes"):
+                candidate_ids = StockRecommender._collect_candidates(
+                    time_slot, scan, eps_data, long_term_count, weak_stock_count)
+                scan.quotes_for(candidate_ids)
             
-            # 3. 獲取極弱股警示
-            weak_stocks = StockRecommender.get_weak_valley_alerts(weak_stock_count)
+            with scan.stage("strategies"):
+                # 1. 獲取短線推薦
+                short_term_stocks = StockRecommender._short_term_strategy(short_term_count, time_slot, scan)
+                
+                # 2. 獲取長線推薦
+                long_term_stocks = StockRecommender._long_term_strategy(long_term_count, time_slot, scan, eps_data)
+                
+                # 3. 獲取極弱股警示
+                weak_stocks = StockRecommender.get_weak_valley_alerts(weak_stock_count, scan)
+            scan_report = scan.report()
             
             # 整合結果
             recommendations = {
@@ -351,16 +924,13 @@ class StockRecommender:
             }
             
             # 儲存推薦結果到緩存
-            try:
-                with open(cache_file, 'w', encoding='utf-8') as f:
-                    cache_data = {
-                        'timestamp': datetime.now().isoformat(),
-                        'recommendations': recommendations
-                    }
-                    json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            cache_data = {
+                'timestamp': datetime.now().isoformat(),
+                'recommendations': recommendations,
+                'scan_report': scan_report
+            }
+            if write_json(cache_file, cache_data):
                 print(f"[stock_recommender] ✅ 已緩存{time_slot}多策略推薦結果")
-            except Exception as e:
-                print(f"[stock_recommender] ⚠️ 寫入多策略推薦緩存失敗: {e}")
             
             return recommendations
         except Exception as e:
@@ -369,7 +939,7 @@ class StockRecommender:
             return {"short_term": [], "long_term": [], "weak_stocks": []}
 
     @staticmethod
-    def _short_term_strategy(count, time_slot):
+    def _short_term_strategy(count, time_slot, scan=None):
         """
         短線推薦策略 (RSI > 50、KD 金叉、MACD 翻多、布林突破)
         使用現有的 morning_strategy、noon_strategy 等作為短線策略的基礎
@@ -384,48 +954,45 @@ class StockRecommender:
         
         strategy_func = existing_strategies.get(time_slot)
         if strategy_func:
-            return strategy_func(count)
+            return strategy_func(count, scan)
         
         # 如果沒有對應的現有策略，使用通用短線策略
         # 掃描限制
-        scan_limit = 50
-        
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
+        scan_limit = GENERIC_SHORT_TERM_SCAN_LIMIT
         
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
         # 篩選符合短線條件的股票
+        matches = [(sid, data) for sid, data in tech_results.items() if is_short_term_pick(data)]
+        matches = StockRecommender._drop_laggards(matches, scan)
+        quotes = StockRecommender._quotes_for([sid for sid, _ in matches], scan)
+        
         candidates = []
-        for sid, data in tech_results.items():
-            # 短線條件: RSI > 50、KD 金叉、MACD 翻多、均線支撐
-            if data.get('RSI', 0) > 50 and 'KD黃金交叉' in data.get('desc', '') and data.get('score', 0) >= 3:
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 計算目標價和止損價
-                    target_price = round(current_price * 1.05, 2)  # 上漲5%
-                    stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+        for sid, data in matches:
+            try:
+                quote = quotes.get(sid)
+                
+                if quote is None:
+                    continue
                     
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'reason': data.get('desc', '技術指標強勢'),
-                        'target_price': target_price,
-                        'stop_loss': stop_loss,
-                        'current_price': current_price
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 短線分析失敗：{e}")
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 計算目標價和止損價
+                target_price = round(current_price * 1.05, 2)  # 上漲5%
+                stop_loss = round(current_price * 0.97, 2)     # 下跌3%
+                
+                candidates.append({
+                    'code': sid,
+                    'name': name,
+                    'reason': data.get('desc', '技術指標強勢'),
+                    'target_price': target_price,
+                    'stop_loss': stop_loss,
+                    'current_price': current_price
+                })
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 短線分析失敗：{e}")
         
         # 排序並限制數量
         candidates.sort(key=lambda x: x.get('current_price', 0) / x.get('stop_loss', 1), reverse=True)  # 風險報酬比排序
@@ -433,101 +1000,62 @@ class StockRecommender:
         return candidates[:count]
 
     @staticmethod
-    def _long_term_strategy(count, time_slot):
+    def _long_term_strategy(count, time_slot, scan=None, eps_data=None):
         """
         長線推薦策略 (EPS > 2、殖利率 ≥ 4%、本益比 < 15、法人買超、MACD 翻多)
         """
         # 掃描限制
-        scan_limit = 100
-        
-        # 獲取熱門股票
-        stock_ids = get_top_stocks(limit=scan_limit)
+        scan_limit = LONG_TERM_SCAN_LIMIT
         
-        # 獲取 EPS 和股息數據
-        try:
-            eps_data = get_eps_data(use_cache=True, cache_expiry_hours=72)
-        except Exception as e:
-            print(f"[stock_recommender] ⚠️ 獲取 EPS 數據失敗: {e}")
-            eps_data = {}
+        # 獲取 EPS 和股息數據 (多策略分析已取得時直接使用)
+        if eps_data is None:
+            eps_data = StockRecommender._load_eps_data()
         
-        # 分析技術指標
-        tech_results = analyze_technical_indicators(stock_ids)
+        # 取得熱門股票的技術指標 (有共用掃描結果時直接篩選)
+        tech_results = StockRecommender._scan_results(scan_limit, scan)
         
-        # 篩選符合長線條件的股票
-        candidates = []
+        # 篩選符合長線條件的股票: EPS>2、殖利率≥4%、技術指標良好，評分達標才納入候選
+        matches = []
         for sid, data in tech_results.items():
-            # 檢查基本面
-            eps_info = eps_data.get(sid, {})
-            eps = eps_info.get('eps', 0)
-            dividend = eps_info.get('dividend', 0)
-            
-            # 長線條件: EPS>2、殖利率≥4%、技術指標良好
-            long_term_score = 0
-            reasons = []
-            
-            # EPS 評分
-            if eps and eps > 5:
-                long_term_score += 2
-                reasons.append(f"EPS {eps} 元優異")
-            elif eps and eps > 2:
-                long_term_score += 1
-                reasons.append(f"EPS {eps} 元良好")
-            
-            # 股息率評分
-            if dividend and dividend >= 4:
-                long_term_score += 2
-                reasons.append(f"殖利率 {dividend}% 豐厚")
-            elif dividend and dividend >= 2.5:
-                long_term_score += 1
-                reasons.append(f"殖利率 {dividend}% 不錯")
-            
-            # 技術面評分
-            if data.get('score', 0) >= 4:
-                long_term_score += 2
-                reasons.append(data.get('desc', '技術指標強勢'))
-            elif data.get('score', 0) >= 2:
-                long_term_score += 1
-                reasons.append(data.get('desc', '技術指標尚可'))
-            
-            # 評分達標才納入候選
-            if long_term_score >= 3:
-                try:
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    history = ticker.history(period="1mo")
-                    
-                    if history.empty:
-                        continue
-                        
-                    name = info.get('shortName', sid)
-                    current_price = history['Close'].iloc[-1]
-                    
-                    # 獲取本益比
-                    pe_ratio = info.get('trailingPE')
-                    if pe_ratio and pe_ratio < 15:
-                        long_term_score += 1
-                        reasons.append(f"本益比 {pe_ratio:.1f} 合理")
-                    
-                    # 計算目標價和止損價
-                    target_price = round(current_price * 1.15, 2)  # 上漲15%
-                    stop_loss = round(current_price * 0.90, 2)     # 下跌10%
-                    
-                    candidates.append({
-                        'code': sid,
-                        'name': name,
-                        'reason': "、".join(reasons),
-                        'target_price': target_price,
-                        'stop_loss': stop_loss,
-                        'current_price': current_price,
-                        'score': long_term_score
-                    })
-                except Exception as e:
-                    print(f"[stock_recommender] ⚠️ {sid} 長線分析失敗：{e}")
+            score, reasons = long_term_score(data, eps_data.get(sid, {}))
+            if score >= 3:
+                matches.append((sid, score, reasons))
         
-        # 排序並限制數量
-        candidates.sort(key=lambda x: x.get('score', 0), reverse=True)
+        def build(match, quote):
+            sid, score, reasons = match
+            try:
+                if quote is None:
+                    return None
+                    
+                name = quote['name']
+                current_price = quote['current_price']
+                
+                # 獲取本益比
+                pe_ratio = quote['pe_ratio']
+                if pe_ratio and pe_ratio < 15:
+                    score += 1
+                    reasons = reasons + [f"本益比 {pe_ratio:.1f} 合理"]
+                
+                # 計算目標價和止損價
+                target_price = round(current_price * 1.15, 2)  # 上漲15%
+                stop_loss = round(current_price * 0.90, 2)     # 下跌10%
+                
+                return score, {
+                    'code': sid,
+                    'name': name,
+                    'reason': "、".join(reasons),
+                    'target_price': target_price,
+                    'stop_loss': stop_loss,
+                    'current_price': current_price,
+                    'score': score
+                }
+            except Exception as e:
+                print(f"[stock_recommender] ⚠️ {sid} 長線分析失敗：{e}")
+                return None
         
-        return candidates[:count]
+        # 依評分排序：本益比最多加 1 分，依預估評分順序查詢，前 count 名確定後即停止
+        return select_top(matches, count, lambda match: match[1], build,
+                          lambda ids: StockRecommender._quotes_for(ids, scan), max_bonus=1)
 
 
 def get_stock_recommendations(time_slot="morning", count=3):
@@ -552,18 +1080,19 @@ def get_stock_recommendations(time_slot="morning", count=3):
     return strategy_func(count)
 
 
-def get_multi_strategy_recommendations(time_slot="morning", count=None):
+def get_multi_strategy_recommendations(time_slot="morning", count=None, full_scan=None):
     """
     獲取多策略股票推薦的便捷函數
     
     Args:
         time_slot (str): 時段 ('morning', 'noon', 'afternoon', 'evening')
         count (int): 每種策略的推薦股票數量
+        full_scan (bool): 是否掃描全部上市股票，None 表示晚間時段依 EVENING_FULL_SCAN 設定
     
     Returns:
         dict: 包含三種策略的推薦股票字典
     """
-    return StockRecommender.get_multi_strategy_recommendations(time_slot, count)
+    return StockRecommender.get_multi_strategy_recommendations(time_slot, count, full_scan)
 
 
 def get_weak_stock_alerts(count=2):
@@ -4,92 +4,88 @@
 """
 print("[sentiment] ✅ 已載入 sentiment.py 模組")
 
-import yfinance as yf
+import os
+import threading
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from modules.data.price_history import get_price_history, yahoo_download
+from modules.tracing import span, count as count_event
+from modules.cache_store import read_json, write_json
 
-def get_market_sentiment_score():
+# 監控的主要指數
+MARKET_INDICES = {
+    "^TWII": "台股加權",
+    "^N225": "日經",
+    "^HSI": "恆生",
+    "^GSPC": "標普500",
+    "^IXIC": "那斯達克",
+}
+
+# 市場情緒快取設置
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+REGIME_CACHE_FILE = os.path.join(CACHE_DIR, 'market_regime.json')
+
+# 評分只使用前一交易日以前的收盤 (下載區間不含今天)，輸入只在換日與美股收盤資料確定後改變
+REGIME_REFRESH_TIMES = [(0, 0), (5, 30)]
+# 所有指數都讀取失敗時，隔多久再重新嘗試(秒)
+REGIME_RETRY_INTERVAL = int(os.getenv("REGIME_RETRY_INTERVAL", "600"))
+
+
+def next_regime_refresh(now=None):
     """
-    獲取整體市場情緒評分
-    
+    取得市場情緒下一次需要重新計算的時間 (換日或美股收盤資料確定)
+
+    參數:
+    - now: 目前時間，None 表示 datetime.now()
+
     返回:
-    - 市場情緒評分 (0-10)
+    - datetime
     """
-    # 監控的主要指數
-    indices = {
-        "^TWII": "台股加權",
-        "^N225": "日經",
-        "^HSI": "恆生",
-        "^GSPC": "標普500",
-        "^IXIC": "那斯達克",
-    }
-
-    today = datetime.today()
-    start_date = today - timedelta(days=5)
+    now = now or datetime.now()
+    for hour, minute in REGIME_REFRESH_TIMES:
+        refresh_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if refresh_at > now:
+            return refresh_at
+    hour, minute = REGIME_REFRESH_TIMES[0]
+    return (now + timedelta(days=1)).replace(hour=hour, minute=minute, second=0, microsecond=0)
 
-    score = 0
-    max_score = len(indices) * 2  # 每個指數最高可得2分
-    valid_indices = 0  # 追踪成功讀取的指數數量
 
-    # 分析每個指數的漲跌
-    for symbol, name in indices.items():
-        try:
-            df = yf.download(symbol, start=start_date.strftime('%Y-%m-%d'), end=today.strftime('%Y-%m-%d'), progress=False)
-            
-            if df.empty or len(df) < 2:
-                print(f"[sentiment] ⚠️ {symbol} 資料不足")
-                continue
-                
-            closes = df["Close"].dropna()
-            
-            if len(closes) < 2:
-                print(f"[sentiment] ⚠️ {symbol} 收盤價資料不足")
-                continue
-                
-            # 修正：安全地取得資料，使用 iloc[0] 而非直接 float() 轉換
-            last_close = closes.iloc[-1]
-            prev_close = closes.iloc[-2]
-            
-            # 如果返回的是 Series，取第一個元素
-            if isinstance(last_close, pd.Series):
-                last_close = last_close.iloc[0]
-            if isinstance(prev_close, pd.Series):
-                prev_close = prev_close.iloc[0]
-            
-            pct_change = (last_close - prev_close) / prev_close
-            valid_indices += 1  # 成功讀取一個指數
+def score_index_changes(changes):
+    """
+    依各指數漲跌幅計算市場情緒評分
 
-            # 根據漲跌幅度給分
-            if pct_change > 0.01:  # 漲幅超過1%
-                score += 2
-            elif pct_change > 0:   # 小幅上漲
-                score += 1
+    參數:
+    - changes: 字典 {指數代碼: 漲跌幅}，無法讀取的指數不列入
 
-        except Exception as e:
-            print(f"[sentiment] ❌ 無法讀取 {symbol}：{e}")
-            continue
+    返回:
+    - 市場情緒評分 (0-10)
+    """
+    score = 0
+    for pct_change in changes.values():
+        # 根據漲跌幅度給分 (每個指數最高可得2分)
+        if pct_change > 0.01:  # 漲幅超過1%
+            score += 2
+        elif pct_change > 0:   # 小幅上漲
+            score += 1
 
     # 轉換為0-10的評分，並處理沒有任何有效指數的情況
-    if valid_indices > 0:
-        normalized_score = round((score / (valid_indices * 2)) * 10, 1)
-    else:
-        normalized_score = 5.0  # 如果沒有有效指數，給出中性評分
-    
-    print(f"[sentiment] ✅ 市場情緒評分：{normalized_score}/10")
-    
-    return normalized_score
+    if changes:
+        return round((score / (len(changes) * 2)) * 10, 1)
+    return 5.0  # 如果沒有有效指數，給出中性評分
 
-def get_market_sentiment_adjustments():
+
+def sentiment_weights(score):
     """
-    根據市場情緒提供各指標的權重調整
-    
+    根據市場情緒評分提供各指標的權重調整
+
+    參數:
+    - score: 市場情緒評分 (0-10)
+
     返回:
     - 權重調整系數字典
     """
-    # 獲取當前市場情緒評分
-    score = get_market_sentiment_score()
-
     # 根據情緒分數提供不同的權重調整
     if score >= 8:  # 非常樂觀
         return {
@@ -128,6 +124,180 @@ def get_market_sentiment_adjustments():
             "roe": 1.1,
         }
 
+
+class MarketRegime:
+    """
+    市場情緒服務
+
+    - 5 個主要指數以一次 yf.download 批次下載，計算評分與權重表
+    - 結果保存在記憶體與 cache/market_regime.json，到下一個換日或美股收盤時間點前不重新下載
+    - 同一行程內的技術分析、多重分析與報告都直接讀取記憶體中的結果
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的市場情緒服務
+
+        返回:
+        - MarketRegime: 實例
+        """
+        with MarketRegime._instance_lock:
+            if MarketRegime._instance is None:
+                MarketRegime._instance = MarketRegime()
+            return MarketRegime._instance
+
+    def __init__(self, cache_file=REGIME_CACHE_FILE):
+        """
+        初始化市場情緒服務
+
+        參數:
+        - cache_file: 快取檔路徑
+        """
+        self.cache_file = cache_file
+        self._lock = threading.RLock()
+        self._regime = None
+
+    def _is_valid(self, regime, now=None):
+        """判斷快取的市場情緒是否仍可使用"""
+        now = now or datetime.now()
+        return regime is not None and datetime.fromisoformat(regime["expires_at"]) > now
+
+    def _load_cache(self):
+        """從快取檔載入市場情緒"""
+        return read_json(self.cache_file)
+
+    def _save_cache(self, regime):
+        """寫入快取檔"""
+        write_json(self.cache_file, regime)
+
+    def _download_changes(self):
+        """
+        一次下載全部指數並計算最近一日漲跌幅
+
+        返回:
+        - 字典 {指數代碼: 漲跌幅}
+        """
+        today = datetime.today()
+        start_date = today - timedelta(days=5)
+        symbols = list(MARKET_INDICES)
+
+        count_event("yahoo.download")
+        with span("sentiment.market_regime", indices=len(symbols)):
+            df = yahoo_download(symbols, start=start_date.strftime('%Y-%m-%d'), end=today.strftime('%Y-%m-%d'))
+
+        changes = {}
+        for symbol in symbols:
+            try:
+                if isinstance(df.columns, pd.MultiIndex):
+                    if symbol not in df.columns.get_level_values(0):
+                        print(f"[sentiment] ⚠️ {symbol} 資料不足")
+                        continue
+                    closes = df[symbol]["Close"]
+                else:
+                    closes = df["Close"]
+
+                # 如果返回的是 DataFrame，取第一欄
+                if isinstance(closes, pd.DataFrame):
+                    closes = closes.iloc[:, 0]
+                closes = closes.dropna()
+
+                if len(closes) < 2:
+                    print(f"[sentiment] ⚠️ {symbol} 收盤價資料不足")
+                    continue
+
+                last_close = float(closes.iloc[-1])
+                prev_close = float(closes.iloc[-2])
+                changes[symbol] = (last_close - prev_close) / prev_close
+            except Exception as e:
+                print(f"[sentiment] ❌ 無法讀取 {symbol}：{e}")
+        return changes
+
+    def get(self, refresh=False):
+        """
+        取得市場情緒 (快取有效時不重新下載)
+
+        參數:
+        - refresh: 是否忽略快取重新計算
+
+        返回:
+        - 字典 {"score", "changes", "computed_at", "expires_at"}
+        """
+        with self._lock:
+            if not refresh and self._is_valid(self._regime):
+                return self._regime
+
+            if not refresh:
+                cached = self._load_cache()
+                if self._is_valid(cached):
+                    self._regime = cached
+                    return cached
+
+            try:
+                changes = self._download_changes()
+            except Exception as e:
+                print(f"[sentiment] ❌ 無法讀取市場指數：{e}")
+                changes = {}
+
+            now = datetime.now()
+            score = score_index_changes(changes)
+            if changes:
+                expires_at = next_regime_refresh(now)
+            else:
+                expires_at = now + timedelta(seconds=REGIME_RETRY_INTERVAL)
+
+            self._regime = {
+                "score": score,
+                "changes": changes,
+                "computed_at": now.isoformat(),
+                "expires_at": expires_at.isoformat(),
+            }
+            self._save_cache(self._regime)
+            print(f"[sentiment] ✅ 市場情緒評分：{score}/10 ({len(changes)}/{len(MARKET_INDICES)} 個指數，"
+                  f"有效至 {expires_at:%m-%d %H:%M})")
+            return self._regime
+
+    def score(self):
+        """
+        取得市場情緒評分
+
+        返回:
+        - 市場情緒評分 (0-10)
+        """
+        return self.get()["score"]
+
+    def weights(self):
+        """
+        取得依市場情緒調整的指標權重
+
+        返回:
+        - 權重調整系數字典
+        """
+        return sentiment_weights(self.score())
+
+
+def get_market_sentiment_score():
+    """
+    獲取整體市場情緒評分 (同一交易時段內直接讀取記憶體或快取)
+    
+    返回:
+    - 市場情緒評分 (0-10)
+    """
+    return MarketRegime.get_instance().score()
+
+def get_market_sentiment_adjustments():
+    """
+    根據市場情緒提供各指標的權重調整
+    
+    返回:
+    - 權重調整系數字典
+    """
+    return MarketRegime.get_instance().weights()
+
 def analyze_relative_strength(stock_code):
     """
     分析個股相對於大盤的強弱
@@ -140,15 +310,13 @@ def analyze_relative_strength(stock_code):
     """
     try:
         # 取得最近20天的股價數據
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="30d")
+        history = get_price_history(stock_code, period="30d")
         
         if history.empty or len(history) < 20:
             return 0, "資料不足無法分析相對強度"
             
         # 取得同期台股加權指數數據
-        twii = yf.Ticker("^TWII")
-        twii_history = twii.history(period="30d")
+        twii_history = get_price_history("^TWII", period="30d")
         
         if twii_history.empty or len(twii_history) < 20:
             return 0, "無法取得台股加權指數數據"
@@ -205,8 +373,7 @@ def analyze_fund_flow(stock_code, days=5):
     - 資金流向強度, 流向描述
     """
     try:
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="30d")
+        history = get_price_history(stock_code, period="30d")
         
         if history.empty or len(history) < days + 5:
             return 0, "資料不足無法分析資金流向"
@@ -254,27 +421,123 @@ def analyze_fund_flow(stock_code, days=5):
         print(f"[sentiment] ⚠️ {stock_code} 資金流向分析失敗：{e}")
         return 0, "無法分析資金流向"
 
-def calculate_ema(prices, days):
+def _nth_from_last(values, valid, n):
     """
-    計算指數移動平均線，增加更多安全檢查及錯誤處理
+    取每欄倒數第 n 個有效值 (n=1 為最後一個有效值)
+
+    參數:
+    - values: (日期 × 股票) 的 numpy 陣列
+    - valid: 有效值遮罩
+    - n: 倒數位置
+
+    返回:
+    - 每欄一個值的陣列，有效值不足 n 個時為 NaN
     """
-    try:
-        if not isinstance(prices, np.ndarray):
-            prices = np.array(prices, dtype=np.float64)
-        
-        if len(prices) < days:
-            return np.mean(prices)
-        
-        prices = np.nan_to_num(prices, nan=np.nanmean(prices))
-        
-        alpha = 2.0 / (days + 1.0)
-        ema = np.zeros_like(prices)
-        ema[0] = prices[0]
-        
-        for i in range(1, len(prices)):
-            ema[i] = alpha * prices[i] + (1.0 - alpha) * ema[i-1]
-        
-        return float(ema[-1])
-    except Exception as e:
-        print(f"[multi_analysis] ⚠️ EMA 計算錯誤：{e}")
-        return 0.0
+    return _mean_from_last(values, valid, n, n)
+
+
+def _mean_from_last(values, valid, first, last):
+    """取每欄倒數第 first~last 個有效K線的平均值 (含兩端)"""
+    rank_from_last = np.cumsum(valid[::-1], axis=0)[::-1] * valid
+    window = (rank_from_last >= first) & (rank_from_last <= last)
+    total = np.where(window, np.nan_to_num(values), 0.0).sum(axis=0)
+    count = window.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def compute_strength_table(panel, benchmark_close, lookback=20, flow_days=5):
+    """
+    以價格寬表一次計算所有股票相對大盤的強度與資金流向，並依相對強度排名
+
+    與 analyze_relative_strength、analyze_fund_flow 的單檔算法相同：
+    相對強度 = 個股近 lookback 根K線漲幅 - 大盤同期漲幅；
+    資金流向 = 最近 flow_days 根與前 flow_days 根K線的平均成交量變化
+
+    參數:
+    - panel: indicators.build_price_panel 產生的寬表 (需要 Close、Volume)
+    - benchmark_close: 大盤 (^TWII) 收盤價 Series
+    - lookback: 相對強度的K線數
+    - flow_days: 資金流向的比較天數
+
+    返回:
+    - DataFrame (index=股票代碼，依相對強度由強到弱排序)，欄位:
+      stock_change、relative_strength、rs_percentile (0~100)、volume_change、flow_strength (-2~2)
+    """
+    columns = ["stock_change", "relative_strength", "rs_percentile", "volume_change", "flow_strength"]
+    close = panel.get("Close")
+    if close is None or close.empty:
+        return pd.DataFrame(columns=columns)
+
+    close_values = close.to_numpy(dtype=float)
+    valid = ~np.isnan(close_values)
+    bars = valid.sum(axis=0)
+
+    # 相對強度 (大盤資料不足時無法計算)
+    benchmark_close = pd.Series(benchmark_close, dtype=float).dropna()
+    last_close = _nth_from_last(close_values, valid, 1)
+    base_close = _nth_from_last(close_values, valid, lookback)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stock_change = np.where(bars >= lookback, (last_close / base_close - 1) * 100, np.nan)
+    if len(benchmark_close) >= lookback:
+        market_change = (benchmark_close.iloc[-1] / benchmark_close.iloc[-lookback] - 1) * 100
+        relative_strength = stock_change - market_change
+    else:
+        relative_strength = np.full(len(close.columns), np.nan)
+
+    # 資金流向 (以有收盤價的K線計算成交量)
+    volume = panel.get("Volume")
+    if volume is not None and not volume.empty:
+        volume_values = volume.reindex(index=close.index, columns=close.columns).to_numpy(dtype=float)
+        recent_vol = _mean_from_last(volume_values, valid, 1, flow_days)
+        prev_vol = _mean_from_last(volume_values, valid, flow_days + 1, 2 * flow_days)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            volume_change = np.where((bars >= flow_days + 5) & (prev_vol > 0),
+                                     (recent_vol / prev_vol - 1) * 100, np.nan)
+    else:
+        volume_change = np.full(len(close.columns), np.nan)
+
+    flow_strength = np.select(
+        [volume_change > 30, volume_change > 10, volume_change > -10, volume_change > -30],
+        [2, 1, 0, -1],
+        default=-2,
+    )
+    flow_strength = np.where(np.isnan(volume_change), 0, flow_strength)
+
+    table = pd.DataFrame({
+        "stock_change": stock_change,
+        "relative_strength": relative_strength,
+        "volume_change": volume_change,
+        "flow_strength": flow_strength.astype(int),
+    }, index=close.columns.astype(str))
+    table.index.name = "證券代號"
+    table["rs_percentile"] = table["relative_strength"].rank(pct=True) * 100
+    table = table.sort_values("relative_strength", ascending=False, kind="stable")
+    return table[columns]
+
+
+def get_market_strength_table(stock_ids, lookback=20, flow_days=5):
+    """
+    取得多檔股票的相對強度與資金流向排名表 (股價與大盤資料由共用存放區批次取得)
+
+    參數:
+    - stock_ids: 股票代碼列表
+    - lookback: 相對強度的K線數
+    - flow_days: 資金流向的比較天數
+
+    返回:
+    - compute_strength_table 產生的排名表
+    """
+    from modules.analysis.indicators import build_price_panel
+    from modules.data.price_history import get_price_histories
+
+    price_frames = get_price_histories(stock_ids, period="30d")
+    twii_history = get_price_history("^TWII", period="30d")  # 台灣加權指數
+    benchmark_close = twii_history["Close"] if "Close" in twii_history.columns else pd.Series(dtype=float)
+    if isinstance(benchmark_close, pd.DataFrame):
+        benchmark_close = benchmark_close.iloc[:, 0]
+
+    table = compute_strength_table(build_price_panel(price_frames, fields=("Close", "Volume")),
+                                   benchmark_close, lookback=lookback, flow_days=flow_days)
+    print(f"[sentiment] ✅ 相對強度排名：{len(table)} 檔")
+    return table
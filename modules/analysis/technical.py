@@ -3,219 +3,132 @@
 """
 print("[technical] ✅ 已載入最新版")
 
-import yfinance as yf
+import os
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 from modules.analysis.sentiment import get_market_sentiment_adjustments
+from modules.analysis.indicators import build_price_panel, compute_signals, ema, macd, score_signal_table
+from modules.analysis.indicator_state import IndicatorStateBook
+from modules.data.price_history import clean_stock_id, get_price_histories, get_price_history
+from modules.data.price_archive import last_settled_time
+from modules.data.market_snapshot import MarketSnapshot
+from modules.tracing import span, traced
 
+# 是否預設只由已保存的指標狀態評分 (盤中重複掃描時不需重新讀取歷史資料)
+TA_FROM_STATE = os.getenv("TA_FROM_STATE", "false").lower() in ('true', 'yes', '1', 'on')
 
-def analyze_technical_indicators(stock_ids):
+
+@traced()
+def analyze_technical_indicators(stock_ids, from_state=None, parallel=None, timings=None):
     """
     對多檔股票進行技術指標分析
     
     參數:
     - stock_ids: 股票代碼列表
+    - from_state: 是否只由已保存的指標狀態評分，None 表示依 TA_FROM_STATE 設定
+    - parallel: 是否以多行程計算指標 (全市場掃描)，None 表示依 TA_PARALLEL 設定
+    - timings: 字典，傳入時記錄各階段耗時(秒) (state_bars、history、indicators、state、scoring)
     
     返回:
     - 分析結果字典 {stock_id: {"score": score, "desc": desc, "label": label, "suggestion": suggestion, "is_weak": bool}}
     """
-    # 首先產生技術指標
-    raw_df = generate_ta_signals(stock_ids)
-    if raw_df.empty:
+    if timings is None:
+        timings = {}
+    print("[technical] ⏳ 開始計算技術指標...")
+    if from_state is None:
+        from_state = TA_FROM_STATE
+
+    clean_ids = [clean_stock_id(stock_id) for stock_id in stock_ids]
+    book = IndicatorStateBook.get_instance()
+    tables = []
+
+    if from_state:
+        # 先以收盤行情快照為狀態加入最新一根K線，再由指標狀態直接評分；
+        # 沒有狀態或狀態未更新到最近收盤日的股票才讀取歷史資料
+        as_of = None
+        with span("technical.state_bars") as stage:
+            try:
+                as_of, bars = MarketSnapshot.get_instance().get_daily_bars(clean_ids)
+                book.apply_bars(bars)
+            except Exception as e:
+                print(f"[technical] ⚠️ 無法取得收盤行情，改以歷史資料補齊過期的指標狀態: {e}")
+        timings["state_bars"] = stage["duration"]
+        as_of = as_of or last_settled_time().strftime('%Y-%m-%d')
+
+        state_table = book.signal_table(clean_ids, as_of=as_of)
+        tables.append(state_table)
+        clean_ids = [sid for sid in clean_ids if sid not in state_table.index]
+        print(f"[technical] ✅ 由指標狀態評分：{len(state_table)} 檔，需讀取歷史資料：{len(clean_ids)} 檔")
+
+    if clean_ids:
+        # 產生技術指標 (向量化訊號表)，並順便更新指標狀態供下次使用
+        with span("technical.history", stocks=len(clean_ids)) as stage:
+            price_frames = fetch_price_frames(clean_ids)
+        timings["history"] = stage["duration"]
+
+        with span("technical.indicators", stocks=len(price_frames)) as stage:
+            tables.append(compute_signals(build_price_panel(price_frames), parallel=parallel))
+        timings["indicators"] = stage["duration"]
+
+        # 狀態檔於執行結束時寫入一次 (IndicatorStateBook 註冊的 atexit)
+        with span("technical.state") as stage:
+            book.sync_frames(price_frames)
+        timings["state"] = stage["duration"]
+
+    tables = [table for table in tables if not table.empty]
+    if not tables:
         return {}
+    signal_table = pd.concat(tables) if len(tables) > 1 else tables[0]
 
-    # 取得市場情緒調整因子
-    weights = get_market_sentiment_adjustments()
-    results = {}
-
-    # 為每檔股票計算指標得分
-    for _, row in raw_df.iterrows():
-        sid = row["證券代號"]
-        score = 0
-        desc = []
-
-        # MACD
-        # 修正：確保處理的是標量值而非序列
-        if isinstance(row["MACD"], (int, float)) and row["MACD"] == 1:
-            score += 1 * weights.get("MACD", 1.0)
-            desc.append("MACD黃金交叉")
-
-        # KD
-        # 修正：安全處理 K 和 D 值可能是 Series 的情況
-        k_value = row["K"] if isinstance(row["K"], (int, float)) else (row["K"].iloc[-1] if isinstance(row["K"], pd.Series) and not row["K"].empty else 0)
-        d_value = row["D"] if isinstance(row["D"], (int, float)) else (row["D"].iloc[-1] if isinstance(row["D"], pd.Series) and not row["D"].empty else 0)
-        
-        if k_value < 80 and k_value > d_value:
-            score += 1 * weights.get("KD", 1.0)
-            desc.append("KD黃金交叉")
-
-        # RSI
-        # 修正：安全處理 RSI 值可能是 Series 的情況
-        rsi_value = row["RSI"] if isinstance(row["RSI"], (int, float)) else (row["RSI"].iloc[-1] if isinstance(row["RSI"], pd.Series) and not row["RSI"].empty else 0)
-        
-        if rsi_value > 50:
-            score += 1 * weights.get("RSI", 1.0)
-            desc.append("RSI走強")
-
-        # 均線
-        # 修正：確保處理的是標量值而非序列
-        ma_value = row["均線"] if isinstance(row["均線"], (int, float)) else (row["均線"].iloc[-1] if isinstance(row["均線"], pd.Series) and not row["均線"].empty else 0)
-        
-        if ma_value == 1:
-            score += 1 * weights.get("MA", 1.0)
-            desc.append("站上均線")
-
-        # 布林通道
-        # 修正：確保處理的是標量值而非序列
-        bb_value = row["布林通道"] if isinstance(row["布林通道"], (int, float)) else (row["布林通道"].iloc[-1] if isinstance(row["布林通道"], pd.Series) and not row["布林通道"].empty else 0)
-        
-        if bb_value == 1:
-            score += 1 * weights.get("BB", 1.0)
-            desc.append("布林通道偏多")
-
-        # 根據綜合得分決定標籤和建議
-        label = "📌 觀察"
-        suggestion = "建議密切觀察"
-        
-        if score >= 7:
-            label = "✅ 推薦"
-            suggestion = "建議立即列入關注清單"
-        elif rsi_value < 30 and ma_value == 0:
-            label = "⚠️ 走弱"
-            suggestion = "不建議操作，短線偏空"
+    # 取得市場情緒調整因子，並一次為所有股票評分
+    with span("technical.scoring", stocks=len(signal_table)) as stage:
+        weights = get_market_sentiment_adjustments()
+        results = score_signal_table(signal_table, weights)
+    timings["scoring"] = stage["duration"]
+    return results
 
-        # 記錄分析結果
-        results[sid] = {
-            "score": round(score, 1),
-            "desc": "、".join(desc) if desc else "無明顯技術特徵",
-            "label": label,
-            "suggestion": suggestion,
-            "is_weak": (label == "⚠️ 走弱"),
-            "RSI": rsi_value  # 保存 RSI 值以便外部使用
-        }
 
-    return results
+def fetch_price_frames(stock_ids, group_size=None):
+    """
+    透過共用存放區取得技術指標所需的股價資料 (缺少的部分以多檔合併請求下載)
+    
+    參數:
+    - stock_ids: 股票代碼列表
+    - group_size: 每次請求的股票檔數，None 表示使用預設值
+    
+    返回:
+    - 字典: {stock_id: DataFrame}
+    """
+    clean_ids = [clean_stock_id(stock_id) for stock_id in stock_ids]
+    return get_price_histories(clean_ids, period="60d", group_size=group_size)
 
 
-def generate_ta_signals(stock_ids):
+def generate_ta_signals(stock_ids, price_frames=None, group_size=None, parallel=None):
     """
     產生多檔股票的技術指標資料
     
     參數:
     - stock_ids: 股票代碼列表
+    - price_frames: 已下載的股價資料 {stock_id: DataFrame}，None 表示批次下載
+    - group_size: 批次下載時每次請求的股票檔數，None 表示使用預設值
+    - parallel: 是否以多行程計算 (全市場掃描)，None 表示依 TA_PARALLEL 設定
     
     返回:
     - 包含技術指標的 DataFrame
     """
     print("[technical] ⏳ 開始計算技術指標...")
-    results = []
+    if price_frames is None:
+        price_frames = fetch_price_frames(stock_ids, group_size)
 
-    for stock_id in tqdm(stock_ids, desc="[technical] 計算技術指標"):
-        try:
-            # 清理股票代碼
-            clean_id = str(stock_id).replace("=\"", "").replace("\"", "").strip()
-            
-            # 下載股價數據
-            df = yf.download(f"{clean_id}.TW", period="60d", progress=False)
-            if df.empty or len(df) < 30:
-                continue
-                
-            df = df.dropna().copy()
-            df.reset_index(inplace=True)
-
-            # 計算 MACD
-            df["EMA12"] = df["Close"].ewm(span=12).mean()
-            df["EMA26"] = df["Close"].ewm(span=26).mean()
-            df["MACD"] = df["EMA12"] - df["EMA26"]
-            df["Signal"] = df["MACD"].ewm(span=9).mean()
-            
-            macd_signal = 0
-            # 修正：安全獲取最後一個值
-            if not df["MACD"].isna().all() and not df["Signal"].isna().all():
-                last_macd = safe_float(df["MACD"])
-                last_signal = safe_float(df["Signal"])
-                macd_signal = int(last_macd > last_signal)
-
-            # 計算 KD
-            low_min = df["Low"].rolling(window=9).min()
-            high_max = df["High"].rolling(window=9).max()
-            
-            # 修正：防止除以零的可能性
-            denom = high_max - low_min
-            rsv = pd.Series(np.zeros(len(df)))
-            valid_denom = ~(denom == 0)
-            
-            if valid_denom.any():
-                rsv[valid_denom] = (df["Close"][valid_denom] - low_min[valid_denom]) / denom[valid_denom] * 100
-            
-            df["K"] = rsv.ewm(com=2).mean()
-            df["D"] = df["K"].ewm(com=2).mean()
-            
-            k = safe_float(df["K"])
-            d = safe_float(df["D"])
-
-            # 計算 RSI
-            delta = df["Close"].diff()
-            gain = delta.copy()
-            loss = delta.copy()
-            gain[gain < 0] = 0
-            loss[loss > 0] = 0
-            loss = abs(loss)
-            
-            # 使用更安全的方法計算平均值
-            avg_gain = gain.rolling(window=14).mean()
-            avg_loss = loss.rolling(window=14).mean()
-            
-            # 修正：防止除以零
-            rs = pd.Series(np.zeros(len(df)))
-            valid_loss = avg_loss > 0
-            
-            if valid_loss.any():
-                rs[valid_loss] = avg_gain[valid_loss] / avg_loss[valid_loss]
-            
-            rsi = 100 - (100 / (1 + rs))
-            
-            rsi_val = safe_float(rsi)
+    # 依傳入順序建立 (日期 × 股票) 寬表，一次計算所有股票
+    ordered = {}
+    for stock_id in stock_ids:
+        clean_id = clean_stock_id(stock_id)
+        if clean_id in price_frames:
+            ordered[clean_id] = price_frames[clean_id]
 
-            # 計算移動平均線
-            ma5 = df["Close"].rolling(window=5).mean()
-            ma20 = df["Close"].rolling(window=20).mean()
-            
-            # 修正：安全獲取最後一個值
-            ma5_last = safe_float(ma5)
-            ma20_last = safe_float(ma20)
-            
-            # 短期均線是否突破長期均線
-            ma_score = int(ma5_last > ma20_last)
-
-            # 計算布林通道
-            mavg = df["Close"].rolling(window=20).mean()
-            std = df["Close"].rolling(window=20).std()
-            upper = mavg + 2 * std
-            
-            # 修正：安全獲取最後一個值
-            bb_signal = 0
-            if not upper.isna().all():
-                last_close = df["Close"].iloc[-1]
-                last_upper = upper.iloc[-1]
-                bb_signal = int(last_close > last_upper)
-
-            # 記錄指標結果
-            results.append({
-                "證券代號": clean_id,
-                "MACD": macd_signal,
-                "K": k,
-                "D": d,
-                "RSI": rsi_val,
-                "均線": ma_score,
-                "布林通道": bb_signal,
-            })
-
-        except Exception as e:
-            print(f"[technical] ⚠️ {stock_id} 技術指標計算失敗：{e}")
-
-    return pd.DataFrame(results)
+    signal_table = compute_signals(build_price_panel(ordered), parallel=parallel)
+    return signal_table.reset_index()
 
 
 def safe_float(series):
@@ -256,8 +169,7 @@ def generate_moving_averages(stock_code, periods=[5, 10, 20, 60]):
     - 包含收盤價和各移動平均線的 DataFrame
     """
     try:
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="120d")  # 獲取足夠長的歷史數據
+        history = get_price_history(stock_code, period="120d")  # 獲取足夠長的歷史數據
         
         if history.empty:
             return pd.DataFrame()
@@ -287,8 +199,7 @@ def calculate_rsi(stock_code, period=14):
     - 包含收盤價和 RSI 的 DataFrame
     """
     try:
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="60d")  # 獲取足夠長的歷史數據
+        history = get_price_history(stock_code, period="60d")  # 獲取足夠長的歷史數據
         
         if history.empty:
             return pd.DataFrame()
@@ -337,24 +248,19 @@ def calculate_macd(stock_code):
     - 包含收盤價和 MACD 相關指標的 DataFrame
     """
     try:
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="120d")  # 獲取足夠長的歷史數據
+        history = get_price_history(stock_code, period="120d")  # 獲取足夠長的歷史數據
         
         if history.empty:
             return pd.DataFrame()
             
         df = history[['Close']].copy()
         
-        # 計算 EMA
-        df['EMA12'] = df['Close'].ewm(span=12, adjust=False).mean()
-        df['EMA26'] = df['Close'].ewm(span=26, adjust=False).mean()
-        
-        # 計算 MACD 線和訊號線
-        df['MACD'] = df['EMA12'] - df['EMA26']
-        df['Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
+        # 計算 EMA (與 MACD 使用同一個 indicators 核心)
+        df['EMA12'] = ema(df['Close'], 12)
+        df['EMA26'] = ema(df['Close'], 26)
         
-        # 計算 Histogram
-        df['Histogram'] = df['MACD'] - df['Signal']
+        # 計算 MACD 線、訊號線和 Histogram
+        df['MACD'], df['Signal'], df['Histogram'] = macd(df['Close'])
         
         return df
         
@@ -0,0 +1,418 @@
+"""
+快取存放模組 - 統一的 JSON 快取讀寫：寫入時先寫暫存檔再原子替換 (不會讀到寫一半的檔案)，
+輸出緊湊格式並可選擇 gzip 壓縮；讀取以 mmap 一次解析，並依檔案 mtime/大小在行程內記憶，
+同一次執行重複讀取不必再解析
+
+另提供以快取鍵存取的兩層快取 (TwoTierCache)：記憶體 LRU 在前、磁碟 JSON 在後，
+每個鍵各自的有效期限，並累計命中/未命中/淘汰次數供監控
+"""
+print("[cache_store] ✅ 已載入最新版")
+
+import os
+import json
+import gzip
+import mmap
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# 是否以 gzip 壓縮寫入 (讀取時依檔頭自動判斷，壓縮與未壓縮的檔案可混用)
+CACHE_COMPRESS = os.getenv("CACHE_COMPRESS", "false").lower() in ('true', 'yes', '1', 'on')
+
+# 行程內記憶的檔案數上限
+CACHE_STORE_MEMO_ENTRIES = int(os.getenv("CACHE_STORE_MEMO_ENTRIES", "64"))
+
+# 兩層快取的記憶體層最多保留的鍵數
+CACHE_MEMO_MAX_ENTRIES = int(os.getenv("CACHE_MEMO_MAX_ENTRIES", "256"))
+
+# 兩層快取的預設目錄
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache')
+
+# gzip 檔頭
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def file_signature(path):
+    """
+    取得檔案的 (mtime_ns, 大小)，用於判斷內容是否變動
+
+    參數:
+    - path: 檔案路徑
+
+    返回:
+    - (mtime_ns, size)，檔案不存在時返回 None
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class CacheStore:
+    """
+    JSON 快取存放區
+
+    - write：序列化為緊湊 JSON (可 gzip)，寫入同目錄的暫存檔後以 os.replace 原子替換
+    - read：以 mmap 讀取並解析，依 (mtime_ns, 大小) 記憶結果，檔案未變動時直接返回記憶的物件
+    - 記憶的物件在行程內共用，呼叫端不可就地修改 (需要修改時請先複製)
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的快取存放區
+
+        返回:
+        - CacheStore: 實例
+        """
+        with CacheStore._instance_lock:
+            if CacheStore._instance is None:
+                CacheStore._instance = CacheStore()
+            return CacheStore._instance
+
+    def __init__(self, compress=CACHE_COMPRESS, memo_entries=CACHE_STORE_MEMO_ENTRIES):
+        """
+        初始化快取存放區
+
+        參數:
+        - compress: 預設是否以 gzip 壓縮寫入
+        - memo_entries: 行程內記憶的檔案數上限
+        """
+        self.compress = compress
+        self.memo_entries = memo_entries
+        self._memo = OrderedDict()  # 絕對路徑 -> (檔案簽章, 物件)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    def _remember(self, path, signature, data):
+        """記憶解析結果並在超過上限時淘汰最久未使用者"""
+        with self._lock:
+            self._memo[path] = (signature, data)
+            self._memo.move_to_end(path)
+            while len(self._memo) > self.memo_entries:
+                self._memo.popitem(last=False)
+
+    def read(self, path, default=None):
+        """
+        讀取 JSON 快取檔
+
+        參數:
+        - path: 檔案路徑
+        - default: 檔案不存在或無法解析時返回的值
+
+        返回:
+        - 解析後的物件 (行程內共用，不可就地修改)
+        """
+        path = os.path.abspath(path)
+        signature = file_signature(path)
+        if signature is None:
+            return default
+
+        with self._lock:
+            memo = self._memo.get(path)
+            if memo is not None and memo[0] == signature:
+                self._memo.move_to_end(path)
+                self.stats["hits"] += 1
+                return memo[1]
+            self.stats["misses"] += 1
+
+        try:
+            with open(path, 'rb') as f:
+                if signature[1] == 0:
+                    raw = b''
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        raw = gzip.decompress(mm) if mm[:2] == GZIP_MAGIC else mm[:]
+            data = json.loads(raw)
+        except (OSError, ValueError, EOFError) as e:
+            print(f"[cache_store] ⚠️ 讀取快取失敗 {os.path.basename(path)}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            return default
+
+        self._remember(path, signature, data)
+        return data
+
+    def write(self, path, data, compress=None):
+        """
+        原子寫入 JSON 快取檔 (併發的讀取者只會看到舊檔或完整的新檔)
+
+        參數:
+        - path: 檔案路徑
+        - data: 可序列化為 JSON 的物件
+        - compress: 是否以 gzip 壓縮，None 表示使用預設值
+
+        返回:
+        - bool: 是否寫入成功
+        """
+        path = os.path.abspath(path)
+        if compress is None:
+            compress = self.compress
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            if compress:
+                raw = gzip.compress(raw, compresslevel=5)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_file, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_file, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[cache_store] ⚠️ 寫入快取失敗 {os.path.basename(path)}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            self.stats["writes"] += 1
+            # 寫入者的物件可能仍被修改，不直接記憶；下次讀取時重新解析一次
+            self._memo.pop(path, None)
+        return True
+
+    def remove(self, path):
+        """
+        刪除快取檔並清除記憶
+
+        參數:
+        - path: 檔案路徑
+
+        返回:
+        - bool: 是否有刪除檔案
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._memo.pop(path, None)
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def clear(self):
+        """清除行程內記憶"""
+        with self._lock:
+            self._memo.clear()
+
+
+def read_json(path, default=None):
+    """
+    讀取 JSON 快取檔 (便捷函數)
+
+    參數:
+    - path: 檔案路徑
+    - default: 檔案不存在或無法解析時返回的值
+
+    返回:
+    - 解析後的物件 (行程內共用，不可就地修改)
+    """
+    return CacheStore.get_instance().read(path, default)
+
+
+def write_json(path, data, compress=None):
+    """
+    原子寫入 JSON 快取檔 (便捷函數)
+
+    參數:
+    - path: 檔案路徑
+    - data: 可序列化為 JSON 的物件
+    - compress: 是否以 gzip 壓縮，None 表示使用 CACHE_COMPRESS
+
+    返回:
+    - bool: 是否寫入成功
+    """
+    return CacheStore.get_instance().write(path, data, compress)
+
+
+def remove_json(path):
+    """
+    刪除快取檔並清除記憶 (便捷函數)
+
+    參數:
+    - path: 檔案路徑
+
+    返回:
+    - bool: 是否有刪除檔案
+    """
+    return CacheStore.get_instance().remove(path)
+
+
+class TwoTierCache:
+    """
+    以快取鍵存取的兩層快取
+
+    - 第一層：記憶體 LRU (鍵 -> 資料、到期時間、檔案簽章)，超過上限時淘汰最久未使用的鍵
+    - 第二層：<cache_dir>/<鍵>.json，格式為 {"timestamp", "expiry", "data"} (與既有快取檔相容)
+    - 每次讀取只以 stat 比對檔案 mtime/大小，檔案未變動時不重新解析；其他行程改寫後自動重新載入
+    - 每個鍵有各自的有效期限 (寫入時指定)，過期即視為未命中
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的兩層快取 (目錄為 cache/)
+
+        返回:
+        - TwoTierCache: 實例
+        """
+        with TwoTierCache._instance_lock:
+            if TwoTierCache._instance is None:
+                TwoTierCache._instance = TwoTierCache()
+            return TwoTierCache._instance
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=CACHE_MEMO_MAX_ENTRIES, store=None):
+        """
+        初始化兩層快取
+
+        參數:
+        - cache_dir: 磁碟層目錄
+        - max_entries: 記憶體層最多保留的鍵數
+        - store: 磁碟讀寫使用的 CacheStore，None 表示全局共用實例
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.store = store or CacheStore.get_instance()
+        self._entries = OrderedDict()  # 鍵 -> {"data", "expires_at", "signature"}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "writes": 0}
+
+    def path(self, key):
+        """取得快取鍵的磁碟檔案路徑"""
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _put(self, key, entry):
+        """寫入記憶體層並在超過上限時淘汰最久未使用者 (呼叫端需持有鎖)"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    @staticmethod
+    def _expires_at(cache_data):
+        """由快取檔的 expiry 欄位取得到期時間 (epoch 秒)，沒有設定時返回 None"""
+        expiry = cache_data.get("expiry")
+        return datetime.fromisoformat(expiry).timestamp() if expiry else None
+
+    def get(self, key, default=None):
+        """
+        讀取快取鍵
+
+        參數:
+        - key: 快取鍵
+        - default: 不存在、已過期或無法解析時返回的值
+
+        返回:
+        - 快取的資料 (行程內共用，不可就地修改)
+        """
+        path = self.path(key)
+        signature = file_signature(path)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["signature"] == signature:
+                if entry["expires_at"] is not None and now > entry["expires_at"]:
+                    del self._entries[key]
+                    self.counters["expired"] += 1
+                    return default
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry["data"]
+            if entry is not None:
+                # 檔案已被改寫或刪除，記憶體中的資料不再有效
+                del self._entries[key]
+            if signature is None:
+                self.counters["misses"] += 1
+                return default
+
+        cache_data = self.store.read(path)
+        try:
+            if not isinstance(cache_data, dict):
+                raise ValueError("格式不正確")
+            expires_at = self._expires_at(cache_data)
+        except ValueError as e:
+            print(f"[cache_store] ⚠️ 快取檔無法使用 ({key}): {e}")
+            with self._lock:
+                self.counters["misses"] += 1
+            return default
+
+        data = cache_data.get("data", default)
+        with self._lock:
+            if expires_at is not None and now > expires_at:
+                self.counters["expired"] += 1
+                return default
+            self.counters["disk_hits"] += 1
+            self._put(key, {"data": data, "expires_at": expires_at, "signature": signature})
+        return data
+
+    def set(self, key, data, ttl=24 * 3600):
+        """
+        寫入快取鍵 (原子寫入磁碟層，下次讀取時載入記憶體層)
+
+        參數:
+        - key: 快取鍵
+        - data: 可序列化為 JSON 的資料
+        - ttl: 有效秒數，None 表示不過期
+
+        返回:
+        - bool: 是否寫入成功
+        """
+        now = datetime.now()
+        cache_data = {
+            "timestamp": now.isoformat(),
+            "expiry": (now + timedelta(seconds=ttl)).isoformat() if ttl is not None else None,
+            "data": data
+        }
+        if not self.store.write(self.path(key), cache_data):
+            return False
+        with self._lock:
+            # 寫入者的物件可能仍被修改，不直接放入記憶體層
+            self._entries.pop(key, None)
+            self.counters["writes"] += 1
+        return True
+
+    def invalidate(self, key):
+        """
+        刪除快取鍵 (記憶體層與磁碟層)
+
+        參數:
+        - key: 快取鍵
+
+        返回:
+        - bool: 是否有刪除磁碟檔案
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        return self.store.remove(self.path(key))
+
+    def clear(self):
+        """清除記憶體層 (磁碟檔案保留)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        取得命中統計 (供監控使用)
+
+        返回:
+        - 字典 {"hits", "disk_hits", "misses", "expired", "evictions", "writes", "entries", "max_entries", "hit_rate"}
+        """
+        with self._lock:
+            stats = dict(self.counters, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"] + stats["expired"]
+        stats["hit_rate"] = round((stats["hits"] + stats["disk_hits"]) / lookups * 100, 2) if lookups else 0.0
+        return stats
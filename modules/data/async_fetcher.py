@@ -0,0 +1,194 @@
+"""
+非同步抓取引擎 - 以 asyncio 並行執行網路請求，依主機限制同時連線數，請求速率交由 rate_limiter 的令牌桶控制
+"""
+print("[async_fetcher] ✅ 已載入最新版")
+
+import os
+import time
+import asyncio
+import threading
+
+from modules.data.connection_manager import create_robust_session
+from modules.data.rate_limiter import RateLimiter
+
+# 各服務的預設同時連線數 (請求速率設定見 rate_limiter.SERVICE_RATES)
+# 可用環境變量覆寫，例如 FETCH_CONCURRENCY_GOODINFO=3
+DEFAULT_SERVICE_CONCURRENCY = {
+    'goodinfo': 2,
+    'yahoo_finance': 4,
+    'twse': 2,
+    'mops': 1,
+    'line': 2,
+}
+
+
+def get_service_concurrency(service):
+    """
+    取得服務的同時連線數上限 (環境變量優先)
+
+    參數:
+    - service: 服務名稱 (例如 'goodinfo'、'yahoo_finance')
+
+    返回:
+    - int: 同時連線數
+    """
+    default = DEFAULT_SERVICE_CONCURRENCY.get(service, 2)
+    return max(1, int(os.getenv(f"FETCH_CONCURRENCY_{service.upper()}", default)))
+
+
+class FetchEngine:
+    """
+    非同步抓取引擎
+
+    - 每個服務一個 Semaphore 限制同時連線數 (同一引擎的全部 map 呼叫共用)，送出前向共用的速率限制器預約令牌
+    - 每個服務共用一個 create_robust_session 建立的 session (見 get_service_session)，重複使用連線
+    - 阻塞式的 requests/yfinance 呼叫以 asyncio.to_thread 執行，呼叫端仍為同步介面
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的抓取引擎
+
+        返回:
+        - FetchEngine: 實例
+        """
+        with FetchEngine._instance_lock:
+            if FetchEngine._instance is None:
+                FetchEngine._instance = FetchEngine()
+            return FetchEngine._instance
+
+    def __init__(self):
+        """初始化抓取引擎"""
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._slots = {}
+        self.limiter = RateLimiter.get_instance()
+
+    def session(self, service, **kwargs):
+        """
+        取得服務共用的 session (第一次呼叫時以 create_robust_session 建立)
+
+        參數:
+        - service: 服務名稱
+        - kwargs: 傳給 create_robust_session 的參數 (只在第一次建立時生效)
+
+        返回:
+        - requests.Session 物件
+        """
+        with self._lock:
+            if service not in self._sessions:
+                self._sessions[service] = create_robust_session(**kwargs)
+            return self._sessions[service]
+
+    def _slot(self, service):
+        """取得服務共用的同時連線數限制 (跨執行緒與事件迴圈，同時執行的 map 呼叫合計不超過上限)"""
+        with self._lock:
+            if service not in self._slots:
+                self._slots[service] = threading.BoundedSemaphore(get_service_concurrency(service))
+            return self._slots[service]
+
+    def throttle(self, service, seconds):
+        """
+        暫停服務的請求一段時間 (例如收到 429 回應後)
+
+        參數:
+        - service: 服務名稱
+        - seconds: 暫停秒數
+        """
+        self.limiter.penalize(service, seconds)
+
+    async def _run_all(self, service, func, args_list, concurrency):
+        """
+        在同一個事件迴圈中並行執行全部工作
+        (concurrency 為本次呼叫的上限；服務的連線數上限由 _slot 在全部呼叫之間共用)
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        slot = self._slot(service)
+
+        def call(args):
+            with slot:
+                wait = self.limiter.reserve(service)
+                if wait > 0:
+                    time.sleep(wait)
+                # 引擎已取得令牌，工作內第一次送出請求時不再重複扣除
+                with self.limiter.prepaid(service):
+                    return func(*args)
+
+        async def run(args):
+            async with semaphore:
+                try:
+                    return await asyncio.to_thread(call, args)
+                except Exception as e:
+                    return e
+
+        return await asyncio.gather(*(run(args) for args in args_list))
+
+    def map(self, service, func, args_list, concurrency=None):
+        """
+        依服務限制並行執行多個阻塞式請求
+
+        參數:
+        - service: 服務名稱 (決定同時連線數與速率)
+        - func: 要執行的函數
+        - args_list: 每個工作的參數 tuple 列表
+        - concurrency: 同時執行數上限，None 表示使用服務設定
+
+        返回:
+        - 與 args_list 順序相同的結果列表，失敗的工作以例外物件表示
+        """
+        args_list = [args if isinstance(args, tuple) else (args,) for args in args_list]
+        if not args_list:
+            return []
+        limit = get_service_concurrency(service)
+        if concurrency is not None:
+            limit = min(limit, concurrency)
+        limit = max(1, limit)
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._run_all(service, func, args_list, limit))
+
+        # 已在事件迴圈中 (例如被非同步程式呼叫)：改在獨立執行緒中執行
+        result = []
+        worker = threading.Thread(
+            target=lambda: result.append(asyncio.run(self._run_all(service, func, args_list, limit)))
+        )
+        worker.start()
+        worker.join()
+        return result[0]
+
+
+def get_service_session(service, **kwargs):
+    """
+    取得全局抓取引擎中服務共用的 session (便捷函數)
+
+    參數:
+    - service: 服務名稱
+    - kwargs: 傳給 create_robust_session 的參數 (只在第一次建立時生效)
+
+    返回:
+    - requests.Session 物件
+    """
+    return FetchEngine.get_instance().session(service, **kwargs)
+
+
+def fetch_many(service, func, args_list, concurrency=None):
+    """
+    透過全局抓取引擎並行執行多個請求 (便捷函數)
+
+    參數:
+    - service: 服務名稱
+    - func: 要執行的函數
+    - args_list: 每個工作的參數 tuple 列表
+    - concurrency: 同時執行數上限
+
+    返回:
+    - 與 args_list 順序相同的結果列表，失敗的工作以例外物件表示
+    """
+    return FetchEngine.get_instance().map(service, func, args_list, concurrency=concurrency)
@@ -13,6 +13,11 @@ from urllib3.util.retry import Retry
 import json
 import traceback
 from datetime import datetime, timedelta
+from modules.data.rate_limiter import install_session_limiter
+from modules.data.http_cache import install_http_cache
+from modules.tracing import install_session_tracing
+from modules.data.endpoints import get_base_url
+from modules.cache_store import read_json, write_json
 
 # 確保日誌目錄存在
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'logs')
@@ -121,7 +126,8 @@ def create_robust_session(retries=3, backoff_factor=0.5,
     
     session.request = request_with_timeout
     
-    return session
+    # 每個請求送出前依網址所屬服務取得速率令牌，外層再以 HTTP 回應快取處理未變動的頁面
+    return install_http_cache(install_session_tracing(install_session_limiter(session)))
 
 def test_connection(url, service_name=None, timeout=5, retry_alternates=True):
     """
@@ -139,9 +145,9 @@ def test_connection(url, service_name=None, timeout=5, retry_alternates=True):
     """
     import urllib.parse
     
-    # 解析主機名
+    # 解析主機名 (替身伺服器的網址帶有連接埠)
     parsed_url = urllib.parse.urlparse(url)
-    host = parsed_url.netloc
+    host = parsed_url.hostname or parsed_url.netloc
     
     # 更新請求計數
     if service_name and service_name in CONNECTION_STATS:
@@ -183,7 +189,7 @@ def test_connection(url, service_name=None, timeout=5, retry_alternates=True):
                 return False, f"DNS 解析失敗 ({dns_error})，且沒有 {host} 的已知 IP 地址"
         
         # 確定端口
-        port = 443 if url.startswith('https') else 80
+        port = parsed_url.port or (443 if url.startswith('https') else 80)
         
         # 依次嘗試IP地址
         for ip_address in ip_addresses:
@@ -203,16 +209,16 @@ def test_connection(url, service_name=None, timeout=5, retry_alternates=True):
                     session = create_robust_session(retries=0, timeout=(timeout, timeout))
                     
                     # 修改Host頭，避免SNI檢測問題
-                    custom_headers = {'Host': host}
+                    custom_headers = {'Host': parsed_url.netloc}
                     
                     # 構建使用具體IP的URL
-                    protocol = "https" if port == 443 else "http"
+                    protocol = "https" if url.startswith('https') else "http"
                     if protocol == "https":
                         # HTTPS請求需要使用原始URL，因為證書綁定域名
                         response = session.get(url, headers=custom_headers, allow_redirects=False, verify=False)
                     else:
-                        # HTTP可以直接使用IP
-                        ip_url = f"{protocol}://{ip_address}"
+                        # HTTP可以直接使用IP (保留連接埠與路徑)
+                        ip_url = url.replace(parsed_url.netloc, f"{ip_address}:{port}", 1)
                         response = session.get(ip_url, headers=custom_headers, allow_redirects=False)
                     
                     if response.status_code >= 400:
@@ -306,7 +312,8 @@ def is_service_available(service_name):
 
 def wait_for_service(service_name):
     """
-    等待服務可用
+    等待服務可用 (只處理速率限制期間與連續失敗的退避；速率令牌由之後的請求本身取得，
+    例如 create_robust_session 的 session 或 fetch_many 的工作，不在此重複扣除)
     
     參數:
     - service_name: 服務名稱 ('yahoo_finance', 'mops', 'twse')
@@ -361,13 +368,12 @@ def save_connection_stats():
                 'rate_limited_until': stats['rate_limited_until'] and time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['rate_limited_until']))
             }
         
-        with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(stats_to_save, f, ensure_ascii=False, indent=2)
+        # 原子寫入，同時執行的排程不會讀到寫一半的統計檔
+        write_json(stats_file, stats_to_save)
             
         # 同時保存每日統計數據
         daily_stats_file = os.path.join(LOG_DIR, f"connection_stats_{datetime.now().strftime('%Y%m%d')}.json")
-        with open(daily_stats_file, 'w', encoding='utf-8') as f:
-            json.dump(stats_to_save, f, ensure_ascii=False, indent=2)
+        write_json(daily_stats_file, stats_to_save)
         
     except Exception as e:
         log_connection_event(f"無法保存連接統計數據: {e}", level='error')
@@ -377,12 +383,10 @@ def load_connection_stats():
     try:
         stats_file = os.path.join(LOG_DIR, 'connection_stats.json')
         
-        if not os.path.exists(stats_file):
+        stats_from_file = read_json(stats_file)
+        if not stats_from_file:
             return
         
-        with open(stats_file, 'r', encoding='utf-8') as f:
-            stats_from_file = json.load(f)
-        
         # 轉換時間字符串為時間戳
         for service, stats in stats_from_file.items():
             if service in CONNECTION_STATS:
@@ -479,9 +483,9 @@ def check_all_services():
     - dict: 服務狀態字典
     """
     services = {
-        'yahoo_finance': 'https://finance.yahoo.com',
-        'mops': 'https://mops.twse.com.tw',
-        'twse': 'https://www.twse.com.tw'
+        'yahoo_finance': get_base_url('yahoo_finance'),
+        'mops': get_base_url('mops'),
+        'twse': get_base_url('twse')
     }
     
     results = {}
@@ -0,0 +1,161 @@
+"""
+外部端點模組 - 集中管理證交所、ISIN、公開資訊觀測站、goodinfo、Yahoo Finance 與 LINE 的基礎網址，
+可用環境變量改指向本機替身伺服器 (benchmarks/stub_server.py)，讓效能與混沌測試完全離線執行
+"""
+print("[endpoints] ✅ 已載入最新版")
+
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# 各端點的正式基礎網址
+# 可用環境變量個別覆寫，例如 TWSE_BASE_URL=http://127.0.0.1:8765/twse
+DEFAULT_BASE_URLS = {
+    'twse': 'https://www.twse.com.tw',                 # MI_INDEX 全市場行情
+    'isin': 'https://isin.twse.com.tw',                # C_public.jsp 股票列表
+    'mops': 'https://mops.twse.com.tw',                # 公開資訊觀測站 EPS/股利
+    'goodinfo': 'https://goodinfo.tw',                 # StockInfo.asp 基本面
+    'yahoo_finance': 'https://finance.yahoo.com',      # 網頁 (連線測試)
+    'yahoo_query': 'https://query2.finance.yahoo.com', # chart/quote API
+    'line': 'https://api.line.me',                     # Messaging API
+}
+
+# 端點對應的速率限制服務 (未列出者與端點同名)
+ENDPOINT_SERVICES = {
+    'isin': 'twse',
+    'yahoo_query': 'yahoo_finance',
+}
+
+# 設定後全部端點改指向替身伺服器，各端點為 <STUB_BASE_URL>/<端點名稱>
+STUB_BASE_URL = os.getenv("STUB_BASE_URL", "").rstrip('/')
+
+_lock = threading.Lock()
+
+
+def _load_base_urls(stub_base=STUB_BASE_URL):
+    """
+    依環境變量建立基礎網址表 (個別覆寫優先於 STUB_BASE_URL)
+
+    參數:
+    - stub_base: 替身伺服器網址，空字串表示不使用
+
+    返回:
+    - (基礎網址字典, 已覆寫的端點集合)
+    """
+    urls = {}
+    overridden = set()
+    for name, default in DEFAULT_BASE_URLS.items():
+        url = os.getenv(f"{name.upper()}_BASE_URL", "").rstrip('/')
+        if not url and stub_base:
+            url = f"{stub_base}/{name}"
+        if url:
+            overridden.add(name)
+        urls[name] = url or default
+    return urls, overridden
+
+
+_base_urls, _overridden = _load_base_urls()
+
+
+def get_base_url(name):
+    """
+    取得端點的基礎網址
+
+    參數:
+    - name: 端點名稱 (DEFAULT_BASE_URLS 的鍵)
+
+    返回:
+    - 基礎網址 (結尾不含斜線)
+    """
+    return _base_urls[name]
+
+
+def endpoint_url(name, path=""):
+    """
+    組合端點的完整網址
+
+    參數:
+    - name: 端點名稱
+    - path: 路徑 (可包含查詢字串)，例如 "/exchangeReport/MI_INDEX?response=json"
+
+    返回:
+    - 完整網址
+    """
+    if path and not path.startswith('/'):
+        path = '/' + path
+    return get_base_url(name) + path
+
+
+def is_overridden(name):
+    """
+    檢查端點是否已改指向非正式網址 (替身伺服器)
+
+    參數:
+    - name: 端點名稱
+
+    返回:
+    - bool
+    """
+    return name in _overridden
+
+
+def host_port(name):
+    """
+    取得端點的主機與連接埠 (供連線測試使用)
+
+    參數:
+    - name: 端點名稱
+
+    返回:
+    - (主機, 連接埠)
+    """
+    parsed = urlparse(get_base_url(name))
+    return parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80)
+
+
+def service_for_url(url):
+    """
+    由已覆寫的基礎網址判斷網址所屬的速率限制服務 (正式網址由 rate_limiter 依主機判斷)
+
+    參數:
+    - url: 請求網址
+
+    返回:
+    - 服務名稱，不屬於任何已覆寫端點時返回 None
+    """
+    for name in _overridden:
+        base = _base_urls[name]
+        if url == base or url.startswith(base + '/') or url.startswith(base + '?'):
+            return ENDPOINT_SERVICES.get(name, name)
+    return None
+
+
+@contextmanager
+def override_base_urls(stub_base=None, **urls):
+    """
+    在區塊內暫時改指向其他基礎網址 (同一行程內啟動替身伺服器時使用)
+
+    參數:
+    - stub_base: 替身伺服器網址，全部端點改為 <stub_base>/<端點名稱>
+    - urls: 個別端點的基礎網址，例如 line="http://127.0.0.1:8765/line"
+    """
+    global _base_urls, _overridden
+    with _lock:
+        saved = (_base_urls, _overridden)
+        base_urls, overridden = dict(_base_urls), set(_overridden)
+        if stub_base:
+            for name in DEFAULT_BASE_URLS:
+                base_urls[name] = f"{stub_base.rstrip('/')}/{name}"
+                overridden.add(name)
+        for name, url in urls.items():
+            if name not in DEFAULT_BASE_URLS:
+                raise KeyError(f"未知的端點: {name}")
+            base_urls[name] = url.rstrip('/')
+            overridden.add(name)
+        _base_urls, _overridden = base_urls, overridden
+    try:
+        yield
+    finally:
+        with _lock:
+            _base_urls, _overridden = saved
@@ -3,38 +3,29 @@
 """
 print("[fetcher] ✅ 已載入最新版")
 
-import requests
-import pandas as pd
+from modules.data.market_snapshot import get_ranked_universe
+from modules.data.stock_master import get_stock_info
+from modules.tracing import traced
 
-def get_top_stocks(limit=100, filter_type=None):
+@traced()
+def get_top_stocks(limit=100, filter_type=None, refresh=False):
     """
     從台灣證交所取得當日成交量前 N 名股票代碼
     
     參數:
     - limit: 要獲取的股票數量
     - filter_type: 篩選類型 ('small_cap', 'large_cap', None)
+    - refresh: 是否強制重新下載當日行情 (預設同一交易日只下載、排序一次)
     
     返回:
     - 股票代碼列表
     """
     try:
-        url = "https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&date=&type=ALL"
-        res = requests.get(url, timeout=10)
-        data = res.json()
-
-        for table in data["tables"]:
-            df = pd.DataFrame(table["data"], columns=table["fields"])
-            if "證券代號" in df.columns and "成交金額" in df.columns:
-                break
-        else:
+        # 由當日行情快照依成交金額排序的股票清單直接切片
+        all_ids = get_ranked_universe(refresh=refresh)
+        if not all_ids:
             raise ValueError("無法找到有效的熱門股資料")
 
-        df["成交金額"] = pd.to_numeric(df["成交金額"].str.replace(",", ""), errors="coerce")
-        df = df.sort_values(by="成交金額", ascending=False)
-
-        df["證券代號"] = df["證券代號"].astype(str)
-        all_ids = df["證券代號"].tolist()
-
         if filter_type == "small_cap":
             return all_ids[50:50+limit]  # 中小型股（排除前50大）
         elif filter_type == "large_cap":
@@ -60,6 +51,24 @@ def fetch_top_100_volume_stocks():
     return get_top_stocks(limit=100)
 
 
+def get_stock_name(stock_id):
+    """
+    由股票基本資料表取得股票名稱 (不需查詢 Yahoo Finance)
+    
+    參數:
+    - stock_id: 股票代碼
+    
+    返回:
+    - 股票名稱，找不到時返回股票代碼
+    """
+    try:
+        info = get_stock_info(stock_id)
+    except Exception as e:
+        print(f"[fetcher] ⚠️ 股票基本資料讀取失敗：{e}")
+        info = None
+    return info["stock_name"] if info else str(stock_id)
+
+
 def get_latest_valid_trading_date():
     """
     獲取最近的有效交易日期
@@ -5,16 +5,15 @@ modules/data/finance_yahoo.py
 """
 
 import yfinance as yf
-import concurrent.futures
 from tqdm import tqdm
 import time
 import random
 import pandas as pd
 import numpy as np
 import os
-import json
 import requests
 from datetime import datetime, timedelta
+from modules.cache_store import read_json, write_json
 
 # 導入連接管理器
 try:
@@ -26,6 +25,10 @@ try:
         get_random_user_agent,
         log_connection_event
     )
+    from modules.data.async_fetcher import fetch_many
+    from modules.data.rate_limiter import acquire, penalize
+    from modules.data.endpoints import endpoint_url
+    from modules.data.price_history import open_ticker
 except ImportError:
     # 如果連接管理器不存在，使用簡易版本的功能
     def get_random_user_agent():
@@ -53,6 +56,26 @@ except ImportError:
     
     def log_connection_event(message, level='info'):
         print(f"[yahoo_finance] {message}")
+    
+    def acquire(service):
+        return 0.0
+    
+    def penalize(service, seconds):
+        time.sleep(seconds)
+    
+    def fetch_many(service, func, args_list, concurrency=None):
+        results = []
+        for args in args_list:
+            try:
+                results.append(func(*args))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def endpoint_url(name, path=""):
+        return "https://finance.yahoo.com" + path
+
+    open_ticker = yf.Ticker
 
 # 緩存目錄設置
 CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
@@ -105,7 +128,7 @@ def test_yahoo_finance_connection():
             return False
         
         success, message = test_connection(
-            "https://finance.yahoo.com/quote/AAPL", 
+            endpoint_url('yahoo_finance', "/quote/AAPL"),
             service_name='yahoo_finance',
             timeout=CONNECTION_TIMEOUT
         )
@@ -121,7 +144,8 @@ def test_yahoo_finance_connection():
         print(f"[finance_yahoo] ❌ Yahoo Finance API 連接測試失敗: {e}")
         return False
 
-def get_eps_data_alternative(use_cache=True, cache_expiry_hours=72, max_stocks=80, timeout=20, batch_size=5, batch_delay=None):
+def get_eps_data_alternative(use_cache=True, cache_expiry_hours=72, max_stocks=80, timeout=20, batch_size=5, batch_delay=None,
+                             use_scraper=True):
     """
     使用 yfinance 替代方案獲取 EPS 和股息數據，優化超時和並行處理
     
@@ -130,28 +154,24 @@ def get_eps_data_alternative(use_cache=True, cache_expiry_hours=72, max_stocks=8
     - cache_expiry_hours: 緩存有效時間（小時）
     - max_stocks: 最多處理的股票數量
     - timeout: 單個股票處理的超時時間(秒)
-    - batch_size: 批處理大小
-    - batch_delay: 批次間延遲時間(秒)，None表示使用環境變量或默認值
+    - batch_size: 同時請求數上限 (最多 3)
+    - batch_delay: 保留以相容舊呼叫，請求速率改由抓取引擎的令牌桶控制
+    - use_scraper: 是否先嘗試 scraper.get_eps_data (由 scraper 呼叫時必須為 False，避免互相遞迴)
     
     返回:
     - 字典: {stock_id: {"eps": value, "dividend": value}}
     """
-    # 如果未指定批次延遲，使用環境變量或默認值
-    if batch_delay is None:
-        batch_delay = BATCH_DELAY
-    
     # 檢查緩存 - 延長緩存有效期至72小時
     cache_file = os.path.join(CACHE_DIR, 'eps_data_cache.json')
     if use_cache and os.path.exists(cache_file):
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-                cache_time = datetime.fromisoformat(cache_data['timestamp'])
-                
-                # 檢查緩存是否過期
-                if datetime.now() - cache_time < timedelta(hours=cache_expiry_hours):
-                    print(f"[finance_yahoo] ✅ 使用緩存的 EPS 數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
-                    return cache_data['data']
+            cache_data = read_json(cache_file)
+            cache_time = datetime.fromisoformat(cache_data['timestamp'])
+            
+            # 檢查緩存是否過期
+            if datetime.now() - cache_time < timedelta(hours=cache_expiry_hours):
+                print(f"[finance_yahoo] ✅ 使用緩存的 EPS 數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
+                return cache_data['data']
         except Exception as e:
             print(f"[finance_yahoo] ⚠️ 讀取緩存失敗: {e}")
     
@@ -164,36 +184,32 @@ def get_eps_data_alternative(use_cache=True, cache_expiry_hours=72, max_stocks=8
         if use_cache and os.path.exists(cache_file):
             try:
                 print("[finance_yahoo] 嘗試使用過期緩存...")
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    cache_data = json.load(f)
-                    return cache_data['data']
+                cache_data = read_json(cache_file)
+                return cache_data['data']
             except Exception as e:
                 print(f"[finance_yahoo] ⚠️ 讀取過期緩存失敗: {e}")
     
-    # 嘗試使用已有的財務資料緩存而非重新抓取
-    try:
-        from modules.data.scraper import get_eps_data
-        print("[finance_yahoo] 嘗試使用 scraper 模組獲取 EPS 數據...")
-        eps_data = get_eps_data()
-        if eps_data:
-            print(f"[finance_yahoo] ✅ 成功獲取 {len(eps_data)} 檔股票的 EPS 數據")
+    # 嘗試使用已有的財務資料緩存而非重新抓取 (由 scraper 呼叫時略過，避免互相遞迴)
+    if use_scraper:
+        try:
+            from modules.data.scraper import get_eps_data
+            print("[finance_yahoo] 嘗試使用 scraper 模組獲取 EPS 數據...")
+            eps_data = get_eps_data()
+            if eps_data:
+                print(f"[finance_yahoo] ✅ 成功獲取 {len(eps_data)} 檔股票的 EPS 數據")
             
-            # 儲存結果到緩存
-            if use_cache and eps_data:
-                try:
-                    with open(cache_file, 'w', encoding='utf-8') as f:
-                        cache_data = {
-                            'timestamp': datetime.now().isoformat(),
-                            'data': eps_data
-                        }
-                        json.dump(cache_data, f, ensure_ascii=False, indent=2)
-                    print(f"[finance_yahoo] ✅ 已更新 EPS 數據緩存")
-                except Exception as e:
-                    print(f"[finance_yahoo] ⚠️ 寫入緩存失敗: {e}")
+                # 儲存結果到緩存
+                if use_cache and eps_data:
+                    cache_data = {
+                        'timestamp': datetime.now().isoformat(),
+                        'data': eps_data
+                    }
+                    if write_json(cache_file, cache_data):
+                        print(f"[finance_yahoo] ✅ 已更新 EPS 數據緩存")
                     
-            return eps_data
-    except Exception as e:
-        print(f"[finance_yahoo] ⚠️ scraper 模組獲取數據失敗: {e}")
+                return eps_data
+        except Exception as e:
+            print(f"[finance_yahoo] ⚠️ scraper 模組獲取數據失敗: {e}")
     
     # 如果連接測試失敗，直接使用備用數據
     if not connection_ok:
@@ -228,9 +244,8 @@ def get_eps_data_alternative(use_cache=True, cache_expiry_hours=72, max_stocks=8
     result = get_hardcoded_eps_data()
     print(f"[finance_yahoo] ✅ 載入了 {len(result)} 檔備用股票數據作為基礎")
     
-    # 調整批次大小，減少並發，增加間隔
-    actual_batch_size = min(3, batch_size)  # 限制最大3個並發
-    actual_batch_delay = max(8, batch_delay)  # 至少8秒延遲
+    # 同時請求數上限 (請求速率由抓取引擎的 yahoo_finance 令牌桶控制，不再使用固定的批次延遲)
+    actual_batch_size = min(3, batch_size)
     
     # 計算需要優先更新的股票清單
     stocks_to_update = [s for s in top_stocks if s not in result]
@@ -242,52 +257,35 @@ def get_eps_data_alternative(use_cache=True, cache_expiry_hours=72, max_stocks=8
     
     print(f"[finance_yahoo] 開始更新 {len(stocks_to_update)} 檔股票的財務數據...")
     
-    # 分批處理，減小批次大小並增加間隔
+    outcomes = fetch_many(
+        'yahoo_finance',
+        fetch_single_stock_data_with_retry,
+        [(stock_id, 2, timeout) for stock_id in stocks_to_update],
+        concurrency=actual_batch_size
+    )
+    
     processed_count = 0
-    for i in range(0, len(stocks_to_update), actual_batch_size):
-        batch = stocks_to_update[i:i+actual_batch_size]
-        print(f"[finance_yahoo] 處理批次 {i//actual_batch_size + 1}/{(len(stocks_to_update)-1)//actual_batch_size + 1} ({len(batch)} 檔股票)")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=actual_batch_size) as executor:
-            futures = {executor.submit(fetch_single_stock_data_with_retry, stock_id, 2, timeout): stock_id for stock_id in batch}
-            
-            for future in concurrent.futures.as_completed(futures):
-                stock_id = futures[future]
-                try:
-                    data = future.result()
-                    if data and (data["eps"] is not None or data["dividend"] is not None):
-                        result[stock_id] = data
-                        processed_count += 1
-                    else:
-                        # 設置默認值避免後續處理出錯
-                        if stock_id not in result:
-                            result[stock_id] = {"eps": None, "dividend": None}
-                except Exception as e:
-                    print(f"[finance_yahoo] ⚠️ 處理 {stock_id} 時出錯: {e}")
-                    # 設置默認值避免後續處理出錯
-                    if stock_id not in result:
-                        result[stock_id] = {"eps": None, "dividend": None}
-        
-        # 批次間添加更長的延遲，避免 API 限制
-        if i + actual_batch_size < len(stocks_to_update):
-            delay = actual_batch_delay + random.uniform(1.0, 3.0)
-            print(f"[finance_yahoo] 等待 {delay:.1f} 秒後處理下一批...")
-            time.sleep(delay)
+    for stock_id, data in zip(stocks_to_update, outcomes):
+        if isinstance(data, Exception):
+            print(f"[finance_yahoo] ⚠️ 處理 {stock_id} 時出錯: {data}")
+            data = None
+        if data and (data["eps"] is not None or data["dividend"] is not None):
+            result[stock_id] = data
+            processed_count += 1
+        elif stock_id not in result:
+            # 設置默認值避免後續處理出錯
+            result[stock_id] = {"eps": None, "dividend": None}
     
     print(f"[finance_yahoo] ✅ 成功更新 {processed_count} 檔股票的財務數據")
     
     # 儲存結果到緩存
     if use_cache and result:
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                cache_data = {
-                    'timestamp': datetime.now().isoformat(),
-                    'data': result
-                }
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        cache_data = {
+            'timestamp': datetime.now().isoformat(),
+            'data': result
+        }
+        if write_json(cache_file, cache_data):
             print(f"[finance_yahoo] ✅ 已更新 EPS 數據緩存")
-        except Exception as e:
-            print(f"[finance_yahoo] ⚠️ 寫入緩存失敗: {e}")
     
     return result
 
@@ -351,15 +349,11 @@ def fetch_single_stock_data_with_retry(stock_id, max_retries=2, timeout=20):
             # 每次重試增加延遲，且添加隨機抖動以避免請求同步
             if retry > 0:
                 # 計算等待時間 - 指數退避
-                if "Too Many Requests" in " ".join(encountered_errors) or "429" in " ".join(encountered_errors):
-                    # 對於速率限制錯誤，使用更長的等待時間
-                    delay = RATE_LIMIT_WAIT + random.uniform(0, 5.0)
-                else:
-                    # 一般錯誤的指數退避
+                # 速率限制錯誤已由令牌桶延後後續請求，不需另外等待；一般錯誤採指數退避
+                if not ("Too Many Requests" in encountered_errors[-1] or "429" in encountered_errors[-1]):
                     delay = ERROR_WAIT_BASE * (2 ** retry) + random.uniform(0.5, 2.0)
-                
-                print(f"[finance_yahoo] ⏳ {stock_id} 重試 ({retry+1}/{max_retries})，等待 {delay:.1f} 秒...")
-                time.sleep(delay)
+                    print(f"[finance_yahoo] ⏳ {stock_id} 重試 ({retry+1}/{max_retries})，等待 {delay:.1f} 秒...")
+                    time.sleep(delay)
             
             # 直接使用 yfinance 獲取數據，使用超時控制
             return fetch_single_stock_data(stock_id, timeout)
@@ -370,6 +364,7 @@ def fetch_single_stock_data_with_retry(stock_id, max_retries=2, timeout=20):
             
             if "Too Many Requests" in error_str or "429" in error_str:
                 print(f"[finance_yahoo] ⚠️ {stock_id} 遇到速率限制 (429 Too Many Requests)")
+                penalize('yahoo_finance', RATE_LIMIT_WAIT)
             elif "timed out" in error_str.lower():
                 print(f"[finance_yahoo] ⚠️ {stock_id} 請求超時")
             else:
@@ -399,7 +394,7 @@ def fetch_single_stock_data(stock_id, timeout=20):
     try:
         # 使用 yfinance 獲取股票數據，設置超時
         start_time = time.time()
-        ticker = yf.Ticker(f"{stock_id}.TW")
+        ticker = open_ticker(f"{stock_id}.TW")
         
         # 使用分階段獲取信息，確保在超時前盡可能取得更多數據
         info = None
@@ -412,6 +407,7 @@ def fetch_single_stock_data(stock_id, timeout=20):
             remaining_timeout = max(1, timeout - (time.time() - start_time))
             
             # 获取基本信息
+            acquire('yahoo_finance')
             info = ticker.info
             
             if info and isinstance(info, dict):
@@ -436,9 +432,11 @@ def fetch_single_stock_data(stock_id, timeout=20):
         # 第二階段：如果仍有足夠時間且沒有獲取到股息，嘗試獲取股息歷史
         if dividend_yield is None and (time.time() - start_time) < timeout * 0.7:
             try:
+                acquire('yahoo_finance')
                 dividends = ticker.dividends
                 if not dividends.empty:
                     latest_dividend = dividends.iloc[-1]
+                    acquire('yahoo_finance')
                     history = ticker.history(period="1mo")
                     if not history.empty:
                         latest_price = history['Close'].iloc[-1]
@@ -475,14 +473,13 @@ def get_dividend_data_alternative(use_cache=True, cache_expiry_hours=72):
     cache_file = os.path.join(CACHE_DIR, 'dividend_data_cache.json')
     if use_cache and os.path.exists(cache_file):
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-                cache_time = datetime.fromisoformat(cache_data['timestamp'])
-                
-                # 檢查緩存是否過期
-                if datetime.now() - cache_time < timedelta(hours=cache_expiry_hours):
-                    print(f"[finance_yahoo] ✅ 使用緩存的股息數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
-                    return cache_data['data']
+            cache_data = read_json(cache_file)
+            cache_time = datetime.fromisoformat(cache_data['timestamp'])
+            
+            # 檢查緩存是否過期
+            if datetime.now() - cache_time < timedelta(hours=cache_expiry_hours):
+                print(f"[finance_yahoo] ✅ 使用緩存的股息數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
+                return cache_data['data']
         except Exception as e:
             print(f"[finance_yahoo] ⚠️ 讀取股息緩存失敗: {e}")
     
@@ -494,16 +491,12 @@ def get_dividend_data_alternative(use_cache=True, cache_expiry_hours=72):
     
     # 儲存結果到緩存
     if use_cache and dividend_data:
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                cache_data = {
-                    'timestamp': datetime.now().isoformat(),
-                    'data': dividend_data
-                }
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        cache_data = {
+            'timestamp': datetime.now().isoformat(),
+            'data': dividend_data
+        }
+        if write_json(cache_file, cache_data):
             print(f"[finance_yahoo] ✅ 已更新股息數據緩存")
-        except Exception as e:
-            print(f"[finance_yahoo] ⚠️ 寫入股息緩存失敗: {e}")
     
     return dividend_data
 
@@ -539,19 +532,16 @@ def get_stock_info(stock_id, retry_on_rate_limit=True, timeout=15):
             # 每次重試增加延遲
             if retry > 0:
                 # 計算等待時間 - 指數退避
-                if "Too Many Requests" in " ".join(encountered_errors) or "429" in " ".join(encountered_errors):
-                    # 對於速率限制錯誤，使用更長的等待時間
-                    delay = RATE_LIMIT_WAIT + random.uniform(0, 5.0)
-                else:
-                    # 一般錯誤的指數退避
+                # 速率限制錯誤已由令牌桶延後後續請求，不需另外等待；一般錯誤採指數退避
+                if not ("Too Many Requests" in encountered_errors[-1] or "429" in encountered_errors[-1]):
                     delay = ERROR_WAIT_BASE * (2 ** retry) + random.uniform(0.5, 2.0)
-                
-                time.sleep(delay)
+                    time.sleep(delay)
             
-            ticker = yf.Ticker(f"{stock_id}.TW")
+            ticker = open_ticker(f"{stock_id}.TW")
             
             # 使用超時設置
             start_time = time.time()
+            acquire('yahoo_finance')
             info = ticker.info
             
             # 檢查是否獲得有效數據
@@ -570,6 +560,7 @@ def get_stock_info(stock_id, retry_on_rate_limit=True, timeout=15):
             
             if "Too Many Requests" in error_str or "429" in error_str:
                 print(f"[finance_yahoo] ⚠️ {stock_id} 遇到速率限制 (429 Too Many Requests)")
+                penalize('yahoo_finance', RATE_LIMIT_WAIT)
             else:
                 print(f"[finance_yahoo] ⚠️ {stock_id} 請求失敗: {e}")
             
@@ -604,19 +595,16 @@ def get_stock_price_history(stock_id, period="60d", retry_on_rate_limit=True, ti
             # 每次重試增加延遲
             if retry > 0:
                 # 計算等待時間 - 指數退避
-                if "Too Many Requests" in " ".join(encountered_errors) or "429" in " ".join(encountered_errors):
-                    # 對於速率限制錯誤，使用更長的等待時間
-                    delay = RATE_LIMIT_WAIT + random.uniform(0, 5.0)
-                else:
-                    # 一般錯誤的指數退避
+                # 速率限制錯誤已由令牌桶延後後續請求，不需另外等待；一般錯誤採指數退避
+                if not ("Too Many Requests" in encountered_errors[-1] or "429" in encountered_errors[-1]):
                     delay = ERROR_WAIT_BASE * (2 ** retry) + random.uniform(0.5, 2.0)
-                
-                time.sleep(delay)
+                    time.sleep(delay)
             
-            ticker = yf.Ticker(f"{stock_id}.TW")
+            ticker = open_ticker(f"{stock_id}.TW")
             
             # 使用超時設置
             start_time = time.time()
+            acquire('yahoo_finance')
             history = ticker.history(period=period)
             
             # 檢查是否獲得有效數據
@@ -635,6 +623,7 @@ def get_stock_price_history(stock_id, period="60d", retry_on_rate_limit=True, ti
             
             if "Too Many Requests" in error_str or "429" in error_str:
                 print(f"[finance_yahoo] ⚠️ {stock_id} 遇到速率限制 (429 Too Many Requests)")
+                penalize('yahoo_finance', RATE_LIMIT_WAIT)
             else:
                 print(f"[finance_yahoo] ⚠️ {stock_id} 請求失敗: {e}")
             
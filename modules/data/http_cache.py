@@ -0,0 +1,426 @@
+"""
+HTTP 回應快取模組 - 依請求內容 (方法+網址+請求主體) 快取回應，支援 ETag/Last-Modified 條件式請求，
+未變動的頁面只需一次 304 回應或完全不必連線
+"""
+print("[http_cache] ✅ 已載入最新版")
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+from email.utils import formatdate
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from modules.tracing import count as count_event
+
+# 快取設置
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+HTTP_CACHE_DIR = os.path.join(CACHE_DIR, 'http')
+os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+
+# 是否啟用 HTTP 回應快取
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "true").lower() in ('true', 'yes', '1', 'on')
+
+# 各端點的快取新鮮期 (秒)：(名稱, 網址路徑片段, 新鮮期, 回應檢查)
+# 只比對路徑，基礎網址改指向替身伺服器 (modules.data.endpoints) 時規則仍然適用
+# 新鮮期內直接使用快取；過期後帶 If-None-Match/If-Modified-Since 重新驗證
+# 可用環境變量覆寫，例如 HTTP_CACHE_TTL_ISIN=86400 (0 表示每次都重新驗證)
+# 回應檢查：狀態 200 但內容不完整的頁面 (查詢過於頻繁、截斷、防爬蟲頁) 不寫入快取
+# - min_length: 最小長度 (位元組)
+# - required: 必須包含的內容 (不分大小寫)
+# - rejected: 不可包含的內容 (不分大小寫)
+HTTP_CACHE_RULES = [
+    ('isin', '/isin/C_public.jsp', 7 * 24 * 3600,      # 股票列表約每月變動
+     {"min_length": 1000, "required": ["</table>"]}),
+    ('mops_eps', '/mops/web/ajax_t05st09', 12 * 3600,   # 每季財報
+     {"required": ["<table"], "rejected": ["查詢過於頻繁", "security reasons"]}),
+    ('mops_dividend', '/mops/web/ajax_t05st34', 12 * 3600,
+     {"required": ["<table"], "rejected": ["查詢過於頻繁", "security reasons"]}),
+    ('mi_index', '/exchangeReport/MI_INDEX', 600,       # 當日行情 (快照另有更新判斷)
+     {"required": ['"stat"', '"ok"']}),
+    ('goodinfo', '/tw/StockInfo.asp', 3600,
+     {"required": ["本益比"]}),
+]
+
+# 不保存的回應標頭 (內容已解壓，長度與傳輸方式不再適用)
+SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+
+def get_rule(url):
+    """
+    取得網址所屬端點的快取規則
+
+    參數:
+    - url: 請求網址
+
+    返回:
+    - (新鮮期秒數, 回應檢查字典)，不在快取規則內時返回 None
+    """
+    for name, fragment, ttl, validator in HTTP_CACHE_RULES:
+        if fragment in url:
+            return int(os.getenv(f"HTTP_CACHE_TTL_{name.upper()}", ttl)), validator
+    return None
+
+
+def get_freshness(url):
+    """
+    取得網址所屬端點的快取新鮮期
+
+    參數:
+    - url: 請求網址
+
+    返回:
+    - 新鮮期秒數，不在快取規則內時返回 None
+    """
+    rule = get_rule(url)
+    return rule[0] if rule else None
+
+
+def is_valid_body(validator, body):
+    """
+    依快取規則檢查回應內容是否完整，可寫入或沿用快取
+
+    參數:
+    - validator: 回應檢查字典 (min_length、required、rejected)
+    - body: 回應主體 bytes
+
+    返回:
+    - bool
+    """
+    if not body or len(body) < validator.get("min_length", 1):
+        return False
+    # bytes.lower() 只轉換 ASCII 字元，中文內容以 UTF-8 位元組比對
+    lowered = body.lower()
+    if any(marker.lower().encode('utf-8') not in lowered for marker in validator.get("required", ())):
+        return False
+    return not any(marker.lower().encode('utf-8') in lowered for marker in validator.get("rejected", ()))
+
+
+def no_cache_headers(headers=None):
+    """
+    加上 Cache-Control: no-cache 的請求標頭，重試時使用：略過新鮮期內的快取與條件式請求，
+    直接向端點重新取得內容
+
+    參數:
+    - headers: 原本的請求標頭
+
+    返回:
+    - 新的標頭字典
+    """
+    return {**(headers or {}), 'Cache-Control': 'no-cache'}
+
+
+def request_key(method, url, params=None, data=None, json_body=None):
+    """
+    計算請求的快取鍵 (方法 + 完整網址 + 請求主體的 SHA-256)
+
+    參數:
+    - method: HTTP 方法
+    - url: 請求網址
+    - params: 查詢參數
+    - data: 表單或原始主體
+    - json_body: JSON 主體
+
+    返回:
+    - (快取鍵, 完整網址)
+    """
+    prepared = requests.Request(method.upper(), url, params=params, data=data, json=json_body).prepare()
+    body = prepared.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    digest = hashlib.sha256()
+    digest.update(prepared.method.encode('ascii'))
+    digest.update(b'\n')
+    digest.update(prepared.url.encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(hashlib.sha256(body).digest())
+    return digest.hexdigest(), prepared.url
+
+
+class HttpCache:
+    """
+    HTTP 回應快取
+
+    - 回應主體以內容的 SHA-256 命名並以 zlib 壓縮存於 cache/http/bodies/，內容相同的回應只存一份
+    - 每個請求一個索引檔 (cache/http/entries/)，記錄狀態碼、標頭、驗證器與取得時間
+    - 新鮮期內直接返回快取；過期後以 ETag/Last-Modified 發出條件式請求，304 時沿用快取內容
+    - 重新驗證連線失敗時退回舊的快取內容
+    - 狀態 200 但未通過規則檢查的回應不寫入快取；請求帶 Cache-Control: no-cache 時不使用快取內容
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的 HTTP 快取
+
+        返回:
+        - HttpCache: 實例
+        """
+        with HttpCache._instance_lock:
+            if HttpCache._instance is None:
+                HttpCache._instance = HttpCache()
+            return HttpCache._instance
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR):
+        """
+        初始化 HTTP 快取
+
+        參數:
+        - cache_dir: 快取目錄
+        """
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.bodies_dir = os.path.join(cache_dir, 'bodies')
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "stale": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        """累計統計數字"""
+        with self._stats_lock:
+            self.stats[name] += 1
+        count_event(f"http_cache.{name}")
+
+    def _write_atomic(self, path, payload):
+        """以暫存檔寫入後替換，避免同時執行的排程讀到寫一半的檔案"""
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_file, path)
+
+    def load(self, key):
+        """
+        讀取快取項目
+
+        參數:
+        - key: 快取鍵
+
+        返回:
+        - (索引字典, 回應主體 bytes)，沒有快取或檔案損壞時返回 (None, None)
+        """
+        entry_file = os.path.join(self.entries_dir, key + '.json')
+        try:
+            with open(entry_file, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(os.path.join(self.bodies_dir, entry['body'] + '.zz'), 'rb') as f:
+                body = zlib.decompress(f.read())
+            return entry, body
+        except (OSError, ValueError, KeyError, zlib.error):
+            return None, None
+
+    def store(self, key, url, response):
+        """
+        保存回應
+
+        參數:
+        - key: 快取鍵
+        - url: 完整網址
+        - response: requests.Response 物件
+
+        返回:
+        - 索引字典
+        """
+        body = response.content
+        body_hash = hashlib.sha256(body).hexdigest()
+        body_file = os.path.join(self.bodies_dir, body_hash + '.zz')
+        if not os.path.exists(body_file):
+            self._write_atomic(body_file, zlib.compress(body, 6))
+
+        entry = {
+            "url": url,
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in SKIPPED_HEADERS},
+            "encoding": response.encoding,
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+            "body": body_hash,
+            "stored_at": time.time(),
+        }
+        self._write_entry(key, entry)
+        return entry
+
+    def _write_entry(self, key, entry):
+        """寫入索引檔"""
+        payload = json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._write_atomic(os.path.join(self.entries_dir, key + '.json'), payload)
+
+    def touch(self, key, entry, response):
+        """
+        重新驗證成功 (304) 後更新取得時間與驗證器
+
+        參數:
+        - key: 快取鍵
+        - entry: 索引字典
+        - response: 304 回應
+        """
+        entry["stored_at"] = time.time()
+        entry["etag"] = response.headers.get('ETag') or entry.get("etag")
+        entry["last_modified"] = response.headers.get('Last-Modified') or entry.get("last_modified")
+        self._write_entry(key, entry)
+
+    def invalidate(self, key):
+        """
+        刪除快取項目 (回應主體由 prune 清理)
+
+        參數:
+        - key: 快取鍵
+        """
+        try:
+            os.remove(os.path.join(self.entries_dir, key + '.json'))
+        except OSError:
+            pass
+
+    @staticmethod
+    def build_response(entry, body, request=None):
+        """
+        由快取內容建立 requests.Response 物件 (response.from_cache 為 True)
+
+        參數:
+        - entry: 索引字典
+        - body: 回應主體
+        - request: 原始請求物件 (可選)
+
+        返回:
+        - requests.Response 物件
+        """
+        response = requests.Response()
+        response.status_code = entry.get("status", 200)
+        response.reason = "OK"
+        response._content = body
+        response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        response.url = entry.get("url")
+        response.encoding = entry.get("encoding")
+        response.request = request
+        response.from_cache = True
+        return response
+
+    def prune(self, max_age_days=30):
+        """
+        刪除過久未更新的快取項目與不再被引用的回應主體
+
+        參數:
+        - max_age_days: 保留天數
+
+        返回:
+        - 刪除的檔案數
+        """
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        referenced = set()
+        for name in os.listdir(self.entries_dir):
+            path = os.path.join(self.entries_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if entry.get("stored_at", 0) >= cutoff:
+                    referenced.add(entry.get("body"))
+                    continue
+            except (OSError, ValueError):
+                pass
+            os.remove(path)
+            removed += 1
+        for name in os.listdir(self.bodies_dir):
+            if name.endswith('.zz') and name[:-3] not in referenced:
+                os.remove(os.path.join(self.bodies_dir, name))
+                removed += 1
+        return removed
+
+    def request(self, send, method, url, **kwargs):
+        """
+        經過快取送出請求
+
+        參數:
+        - send: 實際送出請求的函數 (session.request)
+        - method: HTTP 方法
+        - url: 請求網址
+        - kwargs: 其他 requests 參數
+
+        返回:
+        - requests.Response 物件
+        """
+        rule = get_rule(url)
+        if rule is None or kwargs.get('stream') or method.upper() not in ('GET', 'POST'):
+            return send(method, url, **kwargs)
+        ttl, validator = rule
+
+        key, full_url = request_key(method, url, kwargs.get('params'), kwargs.get('data'), kwargs.get('json'))
+        entry, body = self.load(key)
+        if entry is not None and not is_valid_body(validator, body):
+            # 規則加入前寫入的不完整頁面
+            self.invalidate(key)
+            entry, body = None, None
+
+        # 呼叫端重試時帶 no-cache：不使用快取內容，直接重新取得 (連線失敗時仍可退回舊內容)
+        cache_control = CaseInsensitiveDict(kwargs.get('headers') or {}).get('Cache-Control', '')
+        refresh = 'no-cache' in str(cache_control).lower()
+
+        if entry is not None and not refresh and time.time() - entry["stored_at"] < ttl:
+            self._count("hits")
+            return self.build_response(entry, body)
+
+        if entry is not None and not refresh:
+            # 過期：帶驗證器發出條件式請求
+            headers = dict(kwargs.get('headers') or {})
+            if entry.get("etag"):
+                headers['If-None-Match'] = entry["etag"]
+            if entry.get("last_modified"):
+                headers['If-Modified-Since'] = entry["last_modified"]
+            elif not entry.get("etag"):
+                headers['If-Modified-Since'] = formatdate(entry["stored_at"], usegmt=True)
+            kwargs['headers'] = headers
+
+        try:
+            response = send(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if entry is None:
+                raise
+            print(f"[http_cache] ⚠️ 重新驗證失敗，使用舊的快取內容: {e}")
+            self._count("stale")
+            return self.build_response(entry, body)
+
+        if response.status_code == 304 and entry is not None:
+            self._count("revalidated")
+            self.touch(key, entry, response)
+            return self.build_response(entry, body, response.request)
+
+        self._count("misses")
+        if response.status_code == 200 and response.content:
+            if not is_valid_body(validator, response.content):
+                self._count("rejected")
+                return response
+            try:
+                self.store(key, full_url, response)
+            except OSError as e:
+                print(f"[http_cache] ⚠️ 寫入回應快取失敗: {e}")
+        return response
+
+
+def install_http_cache(session):
+    """
+    包裝 session.request，依端點快取規則讀寫 HTTP 回應快取
+    (應在速率限制之外安裝，新鮮期內的請求不佔用令牌)
+
+    參數:
+    - session: requests.Session 物件
+
+    返回:
+    - 同一個 session
+    """
+    if not HTTP_CACHE_ENABLED:
+        return session
+
+    original_request = session.request
+    cache = HttpCache.get_instance()
+
+    def request_with_cache(method, url, **kwargs):
+        return cache.request(original_request, method, url, **kwargs)
+
+    session.request = request_with_cache
+    return session
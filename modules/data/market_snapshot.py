@@ -0,0 +1,312 @@
+"""
+市場行情快照模組 - 解析證交所 MI_INDEX 全部股票收盤行情，建立以股票代碼為索引的報價表
+"""
+print("[market_snapshot] ✅ 已載入最新版")
+
+import os
+import json
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from modules.data.price_archive import last_settled_time
+from modules.data.connection_manager import create_robust_session
+from modules.data.endpoints import endpoint_url
+from modules.cache_store import read_json, write_json
+
+# 快照設置
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, 'market_snapshot.json')
+MI_INDEX_PATH = "/exchangeReport/MI_INDEX?response=json&date=&type=ALL"  # 基礎網址見 endpoints (twse)
+
+# 收盤後證交所尚未公布當日行情時，隔多久再重新嘗試(秒)
+SNAPSHOT_RETRY_INTERVAL = int(os.getenv("SNAPSHOT_RETRY_INTERVAL", "1800"))
+
+# 證交所欄位 -> 報價表欄位
+QUOTE_FIELDS = {
+    "證券名稱": "name",
+    "開盤價": "open",
+    "最高價": "high",
+    "最低價": "low",
+    "收盤價": "close",
+    "成交股數": "volume",
+    "成交金額": "turnover",
+    "本益比": "pe",
+}
+NUMERIC_FIELDS = ["open", "high", "low", "close", "volume", "turnover", "pe"]
+
+
+def find_quote_table(data):
+    """
+    從 MI_INDEX 回應中找出個股收盤行情表 (同時支援新版 tables 與舊版 fieldsN/dataN 格式)
+
+    參數:
+    - data: MI_INDEX 的 JSON 回應
+
+    返回:
+    - DataFrame (證交所原始欄位)
+    """
+    tables = list(data.get("tables", []))
+    for key in data:
+        if key.startswith("fields") and key.replace("fields", "data", 1) in data:
+            tables.append({"fields": data[key], "data": data[key.replace("fields", "data", 1)]})
+
+    for table in tables:
+        fields = table.get("fields") or []
+        if "證券代號" in fields and "成交金額" in fields:
+            return pd.DataFrame(table.get("data") or [], columns=fields)
+    raise ValueError("無法找到有效的熱門股資料")
+
+
+def parse_quote_table(df):
+    """
+    將證交所原始行情表轉換為報價表
+
+    參數:
+    - df: find_quote_table 取得的 DataFrame
+
+    返回:
+    - 報價表 DataFrame (index=證券代號, columns=name/open/high/low/close/volume/turnover/pe)
+    """
+    quotes = pd.DataFrame(index=df["證券代號"].astype(str).str.strip())
+    quotes.index.name = "證券代號"
+    for source, column in QUOTE_FIELDS.items():
+        if source not in df.columns:
+            quotes[column] = np.nan if column in NUMERIC_FIELDS else ""
+            continue
+        values = df[source].astype(str).str.strip()
+        if column in NUMERIC_FIELDS:
+            # 千分位逗號移除，"--" 等無成交的值轉為 NaN
+            values = pd.to_numeric(values.str.replace(",", "").to_numpy(), errors="coerce")
+        else:
+            values = values.to_numpy()
+        quotes[column] = values
+
+    # 本益比 0 表示虧損或不適用
+    quotes.loc[quotes["pe"] <= 0, "pe"] = np.nan
+    return quotes[~quotes.index.duplicated(keep="first")]
+
+
+class MarketSnapshot:
+    """
+    每日市場行情快照
+
+    - 一次請求取得全部上市股票的名稱、開高低收、成交量與成交金額
+    - 記憶體與 cache/market_snapshot.json 各保留一份，同一交易日內不重複下載
+    - 收盤資料確定 (14:00) 後才會更新為當日行情
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的行情快照實例
+
+        返回:
+        - MarketSnapshot: 實例
+        """
+        with MarketSnapshot._instance_lock:
+            if MarketSnapshot._instance is None:
+                MarketSnapshot._instance = MarketSnapshot()
+            return MarketSnapshot._instance
+
+    def __init__(self, cache_file=SNAPSHOT_FILE):
+        """
+        初始化行情快照
+
+        參數:
+        - cache_file: 快照快取檔路徑
+        """
+        self.cache_file = cache_file
+        self._lock = threading.RLock()
+        self._quotes = None
+        self._meta = {}
+        self._ranked_ids = []        # 依成交金額由大到小排序的股票代碼
+        self._ranked_turnover = None  # 對應的成交金額 (numpy array)
+        self._session = None
+
+    def _set(self, quotes, meta):
+        """設定目前的快照，並建立依成交金額排序的股票清單"""
+        ranked = quotes["turnover"].sort_values(ascending=False, kind="stable")
+        self._quotes, self._meta = quotes, meta
+        self._ranked_ids = ranked.index.astype(str).tolist()
+        self._ranked_turnover = ranked.to_numpy(dtype=float)
+
+    def _is_fresh(self, meta, now=None):
+        """判斷快照是否仍可使用"""
+        if not meta.get("fetched_at"):
+            return False
+        now = now or datetime.now()
+        fetched_at = datetime.fromisoformat(meta["fetched_at"])
+        settled = last_settled_time(now)
+        if fetched_at < settled:
+            return False
+        # 已過收盤但取得的仍是前一交易日行情時，隔一段時間再嘗試
+        if meta.get("data_date") != settled.strftime("%Y%m%d"):
+            return (now - fetched_at).total_seconds() < SNAPSHOT_RETRY_INTERVAL
+        return True
+
+    def _load_cache(self):
+        """從快取檔載入快照"""
+        try:
+            cached = read_json(self.cache_file)
+            if cached is not None:
+                quotes = pd.DataFrame.from_dict(cached["quotes"], orient="index")
+                quotes.index.name = "證券代號"
+                return quotes, cached.get("meta", {})
+        except Exception as e:
+            print(f"[market_snapshot] ⚠️ 讀取行情快取失敗: {e}")
+        return None, {}
+
+    def _save_cache(self, quotes, meta):
+        """寫入快取檔"""
+        write_json(self.cache_file,
+                   {"meta": meta, "quotes": json.loads(quotes.to_json(orient="index", force_ascii=False))})
+
+    def _download(self):
+        """下載並解析 MI_INDEX 全部行情 (session 已含速率限制與 HTTP 回應快取)"""
+        if self._session is None:
+            self._session = create_robust_session()
+        res = self._session.get(endpoint_url('twse', MI_INDEX_PATH), timeout=10)
+        data = res.json()
+        quotes = parse_quote_table(find_quote_table(data))
+        meta = {"data_date": data.get("date"), "fetched_at": datetime.now().isoformat()}
+        print(f"[market_snapshot] ✅ 已取得 {meta['data_date']} 行情：{len(quotes)} 檔")
+        return quotes, meta
+
+    def get_quotes(self, refresh=False):
+        """
+        取得當日行情報價表
+
+        參數:
+        - refresh: 是否忽略快取強制重新下載
+
+        返回:
+        - 報價表 DataFrame (index=證券代號)，下載失敗且無快取時拋出例外
+        """
+        with self._lock:
+            if not refresh and self._quotes is not None and self._is_fresh(self._meta):
+                return self._quotes
+
+            if not refresh:
+                quotes, meta = self._load_cache()
+                if quotes is not None and self._is_fresh(meta):
+                    self._set(quotes, meta)
+                    return quotes
+
+            try:
+                quotes, meta = self._download()
+            except Exception:
+                # 下載失敗時退回任何可用的舊快照
+                if self._quotes is None:
+                    quotes, meta = self._load_cache()
+                    if quotes is not None:
+                        self._set(quotes, meta)
+                if self._quotes is not None:
+                    print(f"[market_snapshot] ⚠️ 行情下載失敗，使用 {self._meta.get('data_date')} 的快照")
+                    return self._quotes
+                raise
+
+            self._set(quotes, meta)
+            self._save_cache(quotes, meta)
+            return quotes
+
+    def get_ranked_ids(self, refresh=False):
+        """
+        取得依成交金額由大到小排序的全部股票代碼 (同一交易日只排序一次)
+
+        參數:
+        - refresh: 是否強制重新下載行情
+
+        返回:
+        - 股票代碼列表 (共用物件，請勿修改；需要子集時以切片取得)
+        """
+        with self._lock:
+            self.get_quotes(refresh=refresh)
+            return self._ranked_ids
+
+    def get_quote(self, stock_id):
+        """
+        取得單一股票的行情
+
+        參數:
+        - stock_id: 股票代碼
+
+        返回:
+        - 字典 (name/open/high/low/close/volume/turnover/pe)，沒有資料時返回 None
+        """
+        quotes = self.get_quotes()
+        stock_id = str(stock_id).strip()
+        if stock_id not in quotes.index:
+            return None
+        return quotes.loc[stock_id].to_dict()
+
+    def get_daily_bars(self, stock_ids=None):
+        """
+        取得快照當日的K線 (供指標狀態直接加入最新一根K線)
+
+        參數:
+        - stock_ids: 股票代碼列表，None 表示全部股票
+
+        返回:
+        - (日期 YYYY-MM-DD, {stock_id: (date, high, low, close)})，當日無成交的股票不會出現
+        """
+        with self._lock:
+            quotes = self.get_quotes()
+            data_date = self._meta.get("data_date")
+        if not data_date:
+            return None, {}
+        date = datetime.strptime(str(data_date), "%Y%m%d").strftime("%Y-%m-%d")
+
+        if stock_ids is not None:
+            quotes = quotes.reindex([str(sid).strip() for sid in stock_ids])
+        quotes = quotes.dropna(subset=["high", "low", "close"])
+        bars = {
+            sid: (date, high, low, close)
+            for sid, high, low, close in zip(quotes.index, quotes["high"], quotes["low"], quotes["close"])
+        }
+        return date, bars
+
+
+def get_market_quotes(refresh=False):
+    """
+    取得當日全部上市股票的行情報價表 (便捷函數)
+
+    參數:
+    - refresh: 是否強制重新下載
+
+    返回:
+    - 報價表 DataFrame (index=證券代號)
+    """
+    return MarketSnapshot.get_instance().get_quotes(refresh=refresh)
+
+
+def get_ranked_universe(refresh=False):
+    """
+    取得依成交金額排序的全部上市股票代碼 (便捷函數)
+
+    參數:
+    - refresh: 是否強制重新下載 (盤中需要最新排名時使用)
+
+    返回:
+    - 股票代碼列表
+    """
+    return MarketSnapshot.get_instance().get_ranked_ids(refresh=refresh)
+
+
+def get_market_quote(stock_id):
+    """
+    取得單一股票的當日行情 (便捷函數)
+
+    參數:
+    - stock_id: 股票代碼
+
+    返回:
+    - 行情字典，沒有資料時返回 None
+    """
+    return MarketSnapshot.get_instance().get_quote(stock_id)
@@ -0,0 +1,342 @@
+"""
+本地股價資料庫模組 - 每檔股票一個欄式 .npy 檔，以記憶體映射讀取，每日只增量下載新K線
+"""
+print("[price_archive] ✅ 已載入最新版")
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+from modules.data.price_history import (
+    OHLCV_COLUMNS,
+    clean_stock_id,
+    download_price_batch,
+    slice_period,
+    to_yahoo_symbol,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，索引檔只在行程內合併
+    fcntl = None
+
+# 資料庫目錄設置 (位於既有的 cache 目錄下)
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+ARCHIVE_DIR = os.path.join(CACHE_DIR, 'prices')
+os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+# 全局配置參數 - 從環境變量獲取或使用默認值
+ARCHIVE_ENABLED = os.getenv("PRICE_ARCHIVE_ENABLED", "true").lower() in ('true', 'yes', '1', 'on')
+MARKET_OPEN = (9, 0)      # 台股開盤時間
+DATA_SETTLED = (14, 0)    # 收盤後資料確定的時間 (收盤 13:30，保留緩衝)
+ADJUST_TOLERANCE = 1e-4   # 重疊K線收盤價差異超過此比例時視為除權息調整
+
+# 欄式儲存的欄位順序：第 0 列為日期 (距 1970-01-01 的天數)，其餘為 OHLCV
+ARCHIVE_FIELDS = ["Date"] + OHLCV_COLUMNS
+
+
+def _symbol_filename(symbol):
+    """將 Yahoo 代號轉為安全的檔名 (例如 ^TWII -> _TWII)"""
+    return symbol.replace("^", "_").replace("/", "_")
+
+
+def last_settled_time(now=None):
+    """
+    取得最近一次「收盤資料已確定」的時間點 (最近一個交易日的 14:00)
+
+    參數:
+    - now: 目前時間，None 表示 datetime.now()
+
+    返回:
+    - datetime
+    """
+    now = now or datetime.now()
+    settled = now.replace(hour=DATA_SETTLED[0], minute=DATA_SETTLED[1], second=0, microsecond=0)
+    if now < settled:
+        settled -= timedelta(days=1)
+    # 週末沒有新資料，回退到週五
+    while settled.weekday() >= 5:
+        settled -= timedelta(days=1)
+    return settled
+
+
+def is_trading_session(now=None):
+    """
+    判斷目前是否為盤中 (平日 9:00 ~ 資料確定前)，盤中最後一根K線仍會變動
+
+    參數:
+    - now: 目前時間，None 表示 datetime.now()
+
+    返回:
+    - bool
+    """
+    now = now or datetime.now()
+    if now.weekday() >= 5:
+        return False
+    return MARKET_OPEN <= (now.hour, now.minute) < DATA_SETTLED
+
+
+class PriceArchive:
+    """
+    本地股價資料庫
+
+    - 每檔股票一個 .npy 檔，內容為 (欄位 × K線) 的 float64 陣列，每個欄位在檔案中連續存放
+    - 讀取時使用 np.load(mmap_mode='r') 記憶體映射，不需解析整個檔案
+    - 索引檔 index.json 記錄每檔股票已涵蓋的起始日與最後更新時間，寫入時在檔案鎖內與磁碟上的
+      索引合併 (同時執行的排程各自更新的股票都會保留)
+    - 已有資料時只下載最後一根K線之後的資料，暖機後每檔只需下載 1~2 根K線
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的資料庫實例
+
+        返回:
+        - PriceArchive: 實例
+        """
+        with PriceArchive._instance_lock:
+            if PriceArchive._instance is None:
+                PriceArchive._instance = PriceArchive()
+            return PriceArchive._instance
+
+    def __init__(self, root=ARCHIVE_DIR):
+        """
+        初始化資料庫
+
+        參數:
+        - root: 資料庫目錄
+        """
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._index_file = os.path.join(self.root, 'index.json')
+        self._lock_file = self._index_file + '.lock'
+        self._lock = threading.RLock()
+        self._index_mtime = None
+        self._index = self._load_index()
+        self._changed = set()  # 本行程更新過、尚未寫入索引檔的股票
+
+    def _load_index(self):
+        """載入索引檔"""
+        try:
+            if os.path.exists(self._index_file):
+                self._index_mtime = os.path.getmtime(self._index_file)
+                with open(self._index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"[price_archive] ⚠️ 讀取索引檔失敗: {e}")
+        return {}
+
+    def _refresh_index(self):
+        """索引檔被其他行程更新過時重新載入 (保留本行程尚未寫入的項目)"""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self._index_file)
+            except OSError:
+                return
+            if mtime == self._index_mtime:
+                return
+            index = self._load_index()
+            index.update({symbol: self._index[symbol] for symbol in self._changed if symbol in self._index})
+            self._index = index
+
+    @contextmanager
+    def _locked_index(self):
+        """取得跨行程的索引檔鎖 (沒有 fcntl 時只使用行程內的鎖)"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_file, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save_index(self):
+        """
+        在檔案鎖內重新讀取索引檔，合併本行程更新的股票後以暫存檔加改名的方式寫入
+        (同一檔股票兩邊都有更新時保留 updated_at 較新者)
+        """
+        with self._locked_index():
+            if not self._changed:
+                return
+            self._index_mtime = None
+            index = self._load_index()
+            for symbol in self._changed:
+                entry = self._index.get(symbol)
+                current = index.get(symbol)
+                if entry is None:
+                    continue
+                if current is None or current.get("updated_at", "") <= entry.get("updated_at", ""):
+                    index[symbol] = entry
+
+            tmp_file = f"{self._index_file}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_file, self._index_file)
+                self._index_mtime = os.path.getmtime(self._index_file)
+                self._changed.clear()
+            except Exception as e:
+                print(f"[price_archive] ⚠️ 寫入索引檔失敗: {e}")
+            self._index = index
+
+    def _path(self, symbol):
+        """取得股票資料檔路徑"""
+        return os.path.join(self.root, f"{_symbol_filename(symbol)}.npy")
+
+    def read(self, symbol):
+        """
+        以記憶體映射讀取單一股票的全部資料
+
+        參數:
+        - symbol: Yahoo 代號
+
+        返回:
+        - 股價 DataFrame (index=日期)，沒有資料時返回 None
+        """
+        path = self._path(symbol)
+        if not os.path.exists(path):
+            return None
+        try:
+            data = np.load(path, mmap_mode='r')
+            if data.ndim != 2 or data.shape[0] != len(ARCHIVE_FIELDS) or data.shape[1] == 0:
+                return None
+            index = pd.to_datetime(np.asarray(data[0]), unit='D')
+            return pd.DataFrame(
+                {field: data[i + 1] for i, field in enumerate(OHLCV_COLUMNS)},
+                index=index
+            )
+        except Exception as e:
+            print(f"[price_archive] ⚠️ 讀取 {symbol} 資料檔失敗: {e}")
+            return None
+
+    def write(self, symbol, df, covered_from=None):
+        """
+        寫入單一股票的全部資料 (暫存檔加改名，確保原子性)
+
+        參數:
+        - symbol: Yahoo 代號
+        - df: 股價 DataFrame (index=日期)
+        - covered_from: 資料涵蓋的起始日 (YYYY-MM-DD)，None 表示沿用原索引
+        """
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        dates = (df.index.normalize() - pd.Timestamp("1970-01-01")).days.to_numpy(dtype=np.float64)
+        columns = [dates] + [
+            df[field].to_numpy(dtype=np.float64) if field in df.columns else np.full(len(df), np.nan)
+            for field in OHLCV_COLUMNS
+        ]
+        data = np.vstack(columns)
+
+        path = self._path(symbol)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        np.save(tmp_path, data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            entry = self._index.setdefault(symbol, {})
+            if covered_from is not None:
+                entry["covered_from"] = covered_from
+            entry["updated_at"] = datetime.now().isoformat()
+            entry["last_date"] = df.index[-1].strftime('%Y-%m-%d') if len(df) else None
+            self._changed.add(symbol)
+
+    def _plan(self, symbol, days, now):
+        """
+        判斷單一股票需要的下載方式
+
+        返回:
+        - ("fresh", df) 資料已是最新
+        - ("append", df) 只需下載最後一根K線之後的資料
+        - ("full", None) 需要下載完整區間
+        """
+        df = self.read(symbol)
+        entry = self._index.get(symbol, {})
+        cutoff = (now - timedelta(days=days)).strftime('%Y-%m-%d')
+        if df is None or df.empty or entry.get("covered_from", "9999-12-31") > cutoff:
+            return "full", None
+
+        updated_at = datetime.fromisoformat(entry["updated_at"]) if entry.get("updated_at") else None
+        if updated_at is not None and updated_at >= last_settled_time(now) and not is_trading_session(now):
+            return "fresh", df
+        return "append", df
+
+    def load_many(self, stock_ids, days, group_size=None):
+        """
+        取得多檔股票最近 days 天的日K資料，缺少的部分才向 Yahoo Finance 下載
+
+        參數:
+        - stock_ids: 股票代碼列表
+        - days: 日曆天數
+        - group_size: 批次下載時每次請求的股票檔數
+
+        返回:
+        - 字典: {stock_id: DataFrame}
+        """
+        now = datetime.now()
+        self._refresh_index()
+        result = {}
+        full_ids = []
+        append_groups = {}  # 起始日 -> [(clean_id, symbol, 既有資料)]
+
+        for stock_id in stock_ids:
+            clean_id = clean_stock_id(stock_id)
+            symbol = to_yahoo_symbol(clean_id)
+            action, df = self._plan(symbol, days, now)
+            if action == "fresh":
+                result[clean_id] = df
+            elif action == "append":
+                start = df.index[-1].strftime('%Y-%m-%d')
+                append_groups.setdefault(start, []).append((clean_id, symbol, df))
+            else:
+                full_ids.append(clean_id)
+
+        # 增量下載：從最後一根K線當日開始 (含當日，以更新盤中未定的K線)
+        for start, items in append_groups.items():
+            frames = download_price_batch([item[0] for item in items], start=start, group_size=group_size)
+            for clean_id, symbol, old_df in items:
+                new_df = frames.get(clean_id)
+                if new_df is None or new_df.empty:
+                    # 沒有新資料 (例如休市或下載失敗)，沿用既有資料，下次再嘗試
+                    result[clean_id] = old_df
+                    continue
+
+                # 重疊K線的收盤價不同，代表 Yahoo 已做除權息調整，需重抓完整區間
+                overlap = old_df.index[-1]
+                if overlap in new_df.index:
+                    old_close = old_df["Close"].iloc[-1]
+                    new_close = new_df.loc[overlap, "Close"]
+                    if old_close and abs(new_close / old_close - 1) > ADJUST_TOLERANCE and new_df.index[-1] > overlap:
+                        full_ids.append(clean_id)
+                        continue
+
+                merged = pd.concat([old_df[old_df.index < new_df.index[0]], new_df.reindex(columns=OHLCV_COLUMNS)])
+                self.write(symbol, merged)
+                result[clean_id] = merged
+
+        # 完整下載：首次下載或需要更長區間
+        if full_ids:
+            frames = download_price_batch(full_ids, period=f"{days}d", group_size=group_size)
+            covered_from = (now - timedelta(days=days)).strftime('%Y-%m-%d')
+            for clean_id in full_ids:
+                df = frames.get(clean_id)
+                if df is None or df.empty:
+                    continue
+                self.write(to_yahoo_symbol(clean_id), df, covered_from=covered_from)
+                result[clean_id] = df
+
+        if append_groups or full_ids:
+            self._save_index()
+
+        print(f"[price_archive] ✅ 本地資料庫：{len(result)} 檔 (增量 {sum(len(v) for v in append_groups.values())} 檔，完整下載 {len(full_ids)} 檔)")
+        return {clean_id: slice_period(df, days) for clean_id, df in result.items()}
@@ -0,0 +1,541 @@
+"""
+股價歷史資料模組 - 以多檔合併請求批次下載 OHLCV，再拆分為個股 DataFrame
+並提供行程內共用的股價歷史存放區，避免同一次執行重複下載同一檔股票
+"""
+print("[price_history] ✅ 已載入最新版")
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import yfinance as yf
+from modules.data.rate_limiter import acquire
+from modules.data.endpoints import endpoint_url, is_overridden
+from modules.tracing import span, count as count_event
+
+# 全局配置參數 - 從環境變量獲取或使用默認值
+BATCH_GROUP_SIZE = int(os.getenv("PRICE_BATCH_GROUP_SIZE", "50"))      # 每次合併請求的股票檔數
+PRICE_STORE_TTL = int(os.getenv("PRICE_STORE_TTL", "900"))              # 存放區資料有效時間(秒)
+PRICE_STORE_MAX_ENTRIES = int(os.getenv("PRICE_STORE_MAX_ENTRIES", "2000"))  # 存放區最多保留的股票數
+YAHOO_API_THREADS = int(os.getenv("YAHOO_API_THREADS", "8"))             # 直接呼叫 chart API 時的並行請求數
+
+# 拆分後保留的欄位
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def clean_stock_id(stock_id):
+    """
+    清理股票代碼 (移除證交所 CSV 常見的 =\"...\" 包裝)
+
+    參數:
+    - stock_id: 原始股票代碼
+
+    返回:
+    - 清理後的股票代碼字符串
+    """
+    return str(stock_id).replace("=\"", "").replace("\"", "").strip()
+
+
+def to_yahoo_symbol(stock_id):
+    """
+    將台股代碼轉換為 Yahoo Finance 代號
+
+    參數:
+    - stock_id: 股票代碼 (例如 "2330") 或指數代號 (例如 "^TWII")
+
+    返回:
+    - Yahoo Finance 代號 (例如 "2330.TW")
+    """
+    stock_id = clean_stock_id(stock_id)
+    if stock_id.startswith("^") or "." in stock_id:
+        return stock_id
+    return f"{stock_id}.TW"
+
+
+def split_batch_frame(df, symbols):
+    """
+    將多檔合併下載的結果拆分為個股 DataFrame
+
+    參數:
+    - df: yf.download 的回傳結果
+    - symbols: 本次請求的 Yahoo 代號列表
+
+    返回:
+    - 字典: {symbol: DataFrame(Open, High, Low, Close, Volume)}
+    """
+    frames = {}
+    if df is None or df.empty:
+        return frames
+
+    if isinstance(df.columns, pd.MultiIndex):
+        # group_by="ticker" 時第一層為代號，但保險起見兩層都檢查
+        level = 0 if any(s in df.columns.get_level_values(0) for s in symbols) else 1
+        available = set(df.columns.get_level_values(level))
+        for symbol in symbols:
+            if symbol not in available:
+                continue
+            sub = df.xs(symbol, axis=1, level=level)
+            frames[symbol] = sub
+    elif len(symbols) == 1:
+        frames[symbols[0]] = df
+
+    result = {}
+    for symbol, sub in frames.items():
+        columns = [c for c in OHLCV_COLUMNS if c in sub.columns]
+        sub = sub[columns].dropna(how="all")
+        if not sub.empty:
+            result[symbol] = sub.copy()
+    return result
+
+
+def _get_api_session():
+    """取得呼叫 Yahoo chart/quote API 的共用 session (抓取引擎的 yahoo_finance session，含速率限制、重試與追蹤)"""
+    # 延遲導入，避免與 connection_manager 循環導入
+    from modules.data.async_fetcher import get_service_session
+    return get_service_session('yahoo_finance', retries=2, backoff_factor=0.3, timeout=(5, 15))
+
+
+def parse_chart_response(data, interval="1d"):
+    """
+    解析 Yahoo v8 chart API 的回應
+
+    參數:
+    - data: 回應 JSON
+    - interval: K線週期 (日K以上的時間索引會正規化為交易日)
+
+    返回:
+    - DataFrame(Open, High, Low, Close, Volume)，沒有資料時返回空的 DataFrame
+    """
+    results = (data.get("chart") or {}).get("result") or []
+    if not results or not results[0].get("timestamp"):
+        return pd.DataFrame()
+    result = results[0]
+    quote = (result.get("indicators") or {}).get("quote") or [{}]
+    index = pd.to_datetime(result["timestamp"], unit="s", utc=True)
+    index = index.tz_convert((result.get("meta") or {}).get("exchangeTimezoneName") or "Asia/Taipei").tz_localize(None)
+    if interval.endswith(("d", "wk", "mo")):
+        index = index.normalize()
+    df = pd.DataFrame({column: quote[0].get(column.lower()) for column in OHLCV_COLUMNS}, index=index, dtype=float)
+    return df.dropna(how="all")
+
+
+def fetch_chart_frame(symbol, period="60d", interval="1d", start=None, end=None):
+    """
+    直接呼叫 Yahoo v8 chart API 取得單一代號的歷史資料 (基礎網址見 endpoints 的 yahoo_query)
+
+    參數:
+    - symbol: Yahoo 代號
+    - period: 歷史時間長度 (設定 start 時忽略)
+    - interval: K 線週期
+    - start: 起始日期 (可選)
+    - end: 結束日期 (可選，不含當日)
+
+    返回:
+    - DataFrame(Open, High, Low, Close, Volume)
+    """
+    params = {"interval": interval, "includePrePost": "false"}
+    if start is not None:
+        params["period1"] = int(pd.Timestamp(start).timestamp())
+        params["period2"] = int(pd.Timestamp(end).timestamp()) if end is not None else int(time.time())
+    else:
+        params["range"] = period
+    res = _get_api_session().get(endpoint_url('yahoo_query', f"/v8/finance/chart/{symbol}"), params=params)
+    res.raise_for_status()
+    return parse_chart_response(res.json(), interval)
+
+
+def fetch_quote_info(symbol):
+    """
+    直接呼叫 Yahoo v7 quote API 取得基本資訊 (欄位名稱與 yf.Ticker(...).info 相同者可直接取用)
+
+    參數:
+    - symbol: Yahoo 代號
+
+    返回:
+    - 資訊字典
+    """
+    res = _get_api_session().get(endpoint_url('yahoo_query', "/v7/finance/quote"), params={"symbols": symbol})
+    res.raise_for_status()
+    results = (res.json().get("quoteResponse") or {}).get("result") or []
+    return dict(results[0]) if results else {}
+
+
+def yahoo_download(symbols, period="60d", interval="1d", start=None, end=None):
+    """
+    多檔下載股價歷史：預設使用 yf.download；yahoo_query 基礎網址改指向替身伺服器時改為並行呼叫 chart API
+    (yfinance 的網址與 cookie 流程寫死在套件內，無法改指向)
+
+    參數:
+    - symbols: Yahoo 代號列表
+    - period: 歷史時間長度 (設定 start 時忽略)
+    - interval: K 線週期
+    - start: 起始日期 (可選)
+    - end: 結束日期 (可選，不含當日)
+
+    速率令牌在此取得：yf.download 每檔代號各送出一個請求，一次扣除 len(symbols) 個令牌；
+    chart API 的每個請求則由速率限制 session 各自取得，不另外扣除
+
+    返回:
+    - 與 yf.download(group_by="ticker") 相同格式的 DataFrame (第一層欄位為代號)
+    """
+    if not is_overridden('yahoo_query'):
+        acquire('yahoo_finance', len(symbols))
+        if start is not None:
+            return yf.download(symbols, start=start, end=end, interval=interval,
+                               group_by="ticker", threads=True, progress=False)
+        return yf.download(symbols, period=period, interval=interval,
+                           group_by="ticker", threads=True, progress=False)
+
+    def fetch(symbol):
+        try:
+            return symbol, fetch_chart_frame(symbol, period=period, interval=interval, start=start, end=end)
+        except Exception as e:
+            return symbol, e
+
+    frames = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(YAHOO_API_THREADS, len(symbols)))) as executor:
+        for symbol, frame in executor.map(fetch, symbols):
+            if isinstance(frame, Exception):
+                failed.append(f"{symbol}: {frame}")
+            elif not frame.empty:
+                frames[symbol] = frame
+    if failed:
+        print(f"[price_history] ⚠️ chart API 失敗 {len(failed)} 檔，例如 {failed[0]}")
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis=1)
+
+
+class ChartTicker:
+    """以 chart/quote API 取代 yf.Ticker，只提供程式使用到的 info 與 history"""
+
+    def __init__(self, symbol):
+        self.ticker = symbol
+
+    @property
+    def info(self):
+        return fetch_quote_info(self.ticker)
+
+    def history(self, period="1mo", interval="1d", start=None, end=None, **kwargs):
+        return fetch_chart_frame(self.ticker, period=period, interval=interval, start=start, end=end)
+
+
+def open_ticker(symbol):
+    """
+    取得單一代號的 Ticker 物件 (yahoo_query 改指向替身伺服器時返回 ChartTicker)
+
+    參數:
+    - symbol: Yahoo 代號
+
+    返回:
+    - yf.Ticker 或 ChartTicker
+    """
+    if is_overridden('yahoo_query'):
+        return ChartTicker(symbol)
+    return yf.Ticker(symbol)
+
+
+def download_price_batch(stock_ids, period="60d", interval="1d", group_size=None, start=None, end=None):
+    """
+    以多檔合併請求批次下載股價歷史
+
+    參數:
+    - stock_ids: 股票代碼列表
+    - period: 歷史時間長度 (設定 start 時忽略)
+    - interval: K 線週期
+    - group_size: 每次請求的股票檔數，None 表示使用 PRICE_BATCH_GROUP_SIZE
+    - start: 起始日期 (可選)
+    - end: 結束日期 (可選，不含當日)
+
+    返回:
+    - 字典: {stock_id: DataFrame(Open, High, Low, Close, Volume)}，以傳入的代碼為鍵
+    """
+    if group_size is None or group_size <= 0:
+        group_size = BATCH_GROUP_SIZE
+
+    # 去除重複代碼並保留原始順序
+    symbol_map = {}
+    for stock_id in stock_ids:
+        clean_id = clean_stock_id(stock_id)
+        symbol_map.setdefault(to_yahoo_symbol(clean_id), clean_id)
+    symbols = list(symbol_map.keys())
+
+    result = {}
+    for i in range(0, len(symbols), group_size):
+        group = symbols[i:i + group_size]
+        count_event("yahoo.download")
+        try:
+            with span("price_history.download", stocks=len(group)):
+                df = yahoo_download(group, period=period, interval=interval, start=start, end=end)
+        except Exception as e:
+            print(f"[price_history] ⚠️ 批次下載失敗 ({len(group)} 檔)：{e}")
+            continue
+
+        for symbol, frame in split_batch_frame(df, group).items():
+            result[symbol_map[symbol]] = frame
+
+    print(f"[price_history] ✅ 批次下載完成：{len(result)}/{len(symbols)} 檔 (每批 {group_size} 檔)")
+    return result
+
+
+def period_to_days(period):
+    """
+    將 yfinance 的 period 字串轉換為日曆天數
+
+    參數:
+    - period: 例如 "5d"、"60d"、"1mo"、"1y"
+
+    返回:
+    - 天數 (int)
+    """
+    match = re.fullmatch(r"(\d+)(d|wk|mo|y)", str(period).strip())
+    if not match:
+        raise ValueError(f"不支援的 period 格式: {period}")
+    value, unit = int(match.group(1)), match.group(2)
+    return value * {"d": 1, "wk": 7, "mo": 30, "y": 365}[unit]
+
+
+def slice_period(df, days):
+    """
+    從較長的歷史資料中取出最近 days 天的部分 (以最後一根K線為基準)
+
+    參數:
+    - df: 股價 DataFrame
+    - days: 日曆天數
+
+    返回:
+    - 切片後的 DataFrame
+    """
+    if df is None or df.empty:
+        return pd.DataFrame() if df is None else df
+    cutoff = df.index[-1] - pd.Timedelta(days=days)
+    return df[df.index > cutoff]
+
+
+class PriceHistoryStore:
+    """
+    行程內共用的股價歷史存放區
+
+    - 以 (Yahoo 代號, K線週期) 為鍵，只保留抓過的最長區間，較短的 period 直接由記憶體切片
+    - 資料超過 TTL 即重新下載，超過數量上限時淘汰最久未使用的股票 (LRU)
+    - 同時快取 yf.Ticker(...).info，避免同一次執行重複呼叫
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的存放區實例
+
+        返回:
+        - PriceHistoryStore: 實例
+        """
+        with PriceHistoryStore._instance_lock:
+            if PriceHistoryStore._instance is None:
+                PriceHistoryStore._instance = PriceHistoryStore()
+            return PriceHistoryStore._instance
+
+    def __init__(self, ttl=PRICE_STORE_TTL, max_entries=PRICE_STORE_MAX_ENTRIES):
+        """
+        初始化存放區
+
+        參數:
+        - ttl: 資料有效時間(秒)
+        - max_entries: 最多保留的項目數
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (symbol, interval) -> {"frame", "days", "fetched_at"}
+        self._info = OrderedDict()     # symbol -> {"info", "fetched_at"}
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _get_fresh(self, cache, key, now):
+        """取出未過期的項目並標記為最近使用"""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if now - entry["fetched_at"] > self.ttl:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return entry
+
+    def _put(self, cache, key, entry):
+        """寫入項目並在超過上限時淘汰最久未使用者"""
+        cache[key] = entry
+        cache.move_to_end(key)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _fetch(self, stock_ids, days, interval, group_size):
+        """
+        下載存放區缺少的資料：日K優先經由本地股價資料庫增量更新，其餘直接批次下載
+
+        參數:
+        - stock_ids: 股票代碼列表
+        - days: 日曆天數
+        - interval: K線週期
+        - group_size: 批次下載時每次請求的股票檔數
+
+        返回:
+        - 字典: {stock_id: DataFrame}
+        """
+        if interval == "1d":
+            # 延遲導入，避免與 price_archive 循環導入
+            from modules.data.price_archive import ARCHIVE_ENABLED, PriceArchive
+            if ARCHIVE_ENABLED:
+                try:
+                    return PriceArchive.get_instance().load_many(stock_ids, days, group_size=group_size)
+                except Exception as e:
+                    print(f"[price_history] ⚠️ 本地股價資料庫讀取失敗，改為直接下載：{e}")
+        return download_price_batch(stock_ids, period=f"{days}d", interval=interval, group_size=group_size)
+
+    def get_many(self, stock_ids, period="60d", interval="1d", group_size=None):
+        """
+        取得多檔股票的歷史資料，缺少的部分以批次請求下載
+
+        參數:
+        - stock_ids: 股票代碼列表
+        - period: 歷史時間長度
+        - interval: K線週期
+        - group_size: 批次下載時每次請求的股票檔數
+
+        返回:
+        - 字典: {stock_id: DataFrame}，無資料的股票不會出現在結果中
+        """
+        days = period_to_days(period)
+        now = time.time()
+        result = {}
+        missing = {}  # 需下載的天數 -> 股票代碼列表
+
+        with self._lock:
+            for stock_id in stock_ids:
+                clean_id = clean_stock_id(stock_id)
+                key = (to_yahoo_symbol(clean_id), interval)
+                entry = self._get_fresh(self._entries, key, now)
+                if entry is not None and entry["days"] >= days:
+                    self.stats["hits"] += 1
+                    if not entry["frame"].empty:
+                        result[clean_id] = slice_period(entry["frame"], days)
+                    continue
+
+                # 需要更長的區間時，以原有與新需求中較長者重新下載
+                self.stats["misses"] += 1
+                fetch_days = max(days, entry["days"]) if entry is not None else days
+                missing.setdefault(fetch_days, []).append(clean_id)
+
+        for fetch_days, ids in missing.items():
+            frames = self._fetch(ids, fetch_days, interval, group_size)
+            fetched_at = time.time()
+            with self._lock:
+                for clean_id in ids:
+                    # 無資料的股票也記錄下來，避免同一次執行反覆請求
+                    frame = frames.get(clean_id, pd.DataFrame())
+                    key = (to_yahoo_symbol(clean_id), interval)
+                    self._put(self._entries, key, {"frame": frame, "days": fetch_days, "fetched_at": fetched_at})
+                    if not frame.empty:
+                        result[clean_id] = slice_period(frame, days)
+
+        return result
+
+    def get_history(self, stock_id, period="60d", interval="1d"):
+        """
+        取得單一股票的歷史資料
+
+        參數:
+        - stock_id: 股票代碼或指數代號 (例如 "^TWII")
+        - period: 歷史時間長度
+        - interval: K線週期
+
+        返回:
+        - 股價 DataFrame，無資料時返回空的 DataFrame
+        """
+        clean_id = clean_stock_id(stock_id)
+        return self.get_many([clean_id], period=period, interval=interval).get(clean_id, pd.DataFrame())
+
+    def get_info(self, stock_id):
+        """
+        取得股票基本資訊 (yf.Ticker(...).info)，同一次執行內重複呼叫直接由記憶體返回
+
+        參數:
+        - stock_id: 股票代碼
+
+        返回:
+        - 資訊字典
+        """
+        symbol = to_yahoo_symbol(stock_id)
+        with self._lock:
+            entry = self._get_fresh(self._info, symbol, time.time())
+            if entry is not None:
+                self.stats["hits"] += 1
+                return entry["info"]
+            self.stats["misses"] += 1
+
+        # 失敗時直接拋出，由呼叫端處理 (不快取錯誤)；替身伺服器的 quote 請求由 session 取得令牌
+        if not is_overridden('yahoo_query'):
+            acquire('yahoo_finance')
+        count_event("yahoo.info")
+        with span("price_history.info"):
+            info = open_ticker(symbol).info or {}
+        with self._lock:
+            self._put(self._info, symbol, {"info": info, "fetched_at": time.time()})
+        return info
+
+    def clear(self):
+        """清空存放區"""
+        with self._lock:
+            self._entries.clear()
+            self._info.clear()
+
+
+def get_price_history(stock_id, period="60d", interval="1d"):
+    """
+    透過共用存放區取得單一股票的歷史資料 (便捷函數)
+
+    參數:
+    - stock_id: 股票代碼或指數代號
+    - period: 歷史時間長度
+    - interval: K線週期
+
+    返回:
+    - 股價 DataFrame
+    """
+    return PriceHistoryStore.get_instance().get_history(stock_id, period=period, interval=interval)
+
+
+def get_price_histories(stock_ids, period="60d", interval="1d", group_size=None):
+    """
+    透過共用存放區取得多檔股票的歷史資料 (便捷函數)
+
+    參數:
+    - stock_ids: 股票代碼列表
+    - period: 歷史時間長度
+    - interval: K線週期
+    - group_size: 批次下載時每次請求的股票檔數
+
+    返回:
+    - 字典: {stock_id: DataFrame}
+    """
+    return PriceHistoryStore.get_instance().get_many(stock_ids, period=period, interval=interval, group_size=group_size)
+
+
+def get_ticker_info(stock_id):
+    """
+    透過共用存放區取得股票基本資訊 (便捷函數)
+
+    參數:
+    - stock_id: 股票代碼
+
+    返回:
+    - 資訊字典
+    """
+    return PriceHistoryStore.get_instance().get_info(stock_id)
@@ -0,0 +1,296 @@
+"""
+請求速率限制模組 - 每個服務一個令牌桶，透過狀態檔與檔案鎖在多個執行緒與同時執行的排程之間共用
+"""
+print("[rate_limiter] ✅ 已載入最新版")
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from modules.data import endpoints
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只在行程內共用
+    fcntl = None
+
+# 狀態檔設置
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+STATE_FILE = os.path.join(CACHE_DIR, 'rate_limiter_state.json')
+
+# 是否透過狀態檔在多個行程之間共用令牌桶
+RATE_LIMITER_SHARED = os.getenv("RATE_LIMITER_SHARED", "true").lower() in ('true', 'yes', '1', 'on')
+
+# 各服務的預設速率：(每秒請求數, 可累積的突發請求數)
+# 可用環境變量覆寫，例如 RATE_LIMIT_YAHOO_FINANCE=1.5、RATE_BURST_YAHOO_FINANCE=3
+SERVICE_RATES = {
+    'yahoo_finance': (2.0, 4),
+    'twse': (1.0, 3),
+    'mops': (0.5, 1),
+    'goodinfo': (1.0, 2),
+    'line': (5.0, 5),
+}
+
+# 網址主機對應的服務 (依序比對，較精確的放前面)
+HOST_SERVICES = [
+    ('mops.twse.com.tw', 'mops'),
+    ('twse.com.tw', 'twse'),
+    ('yahoo.com', 'yahoo_finance'),
+    ('goodinfo.tw', 'goodinfo'),
+    ('line.me', 'line'),
+]
+
+
+def get_service_rate(service):
+    """
+    取得服務的速率設定 (環境變量優先)
+
+    參數:
+    - service: 服務名稱
+
+    返回:
+    - (每秒請求數, 突發請求數)
+    """
+    rate, burst = SERVICE_RATES.get(service, (1.0, 1))
+    key = service.upper()
+    rate = float(os.getenv(f"RATE_LIMIT_{key}", rate))
+    burst = int(os.getenv(f"RATE_BURST_{key}", burst))
+    return max(rate, 1e-6), max(burst, 1)
+
+
+def service_for_url(url):
+    """
+    由網址判斷所屬服務
+
+    參數:
+    - url: 請求網址
+
+    返回:
+    - 服務名稱，不屬於任何已知服務時返回 None
+    """
+    # 改指向替身伺服器的端點依基礎網址判斷 (主機相同，只能由路徑區分)
+    service = endpoints.service_for_url(url)
+    if service:
+        return service
+    host = urlparse(url).netloc.lower()
+    for suffix, service in HOST_SERVICES:
+        if host == suffix or host.endswith('.' + suffix):
+            return service
+    return None
+
+
+class RateLimiter:
+    """
+    請求速率限制器
+
+    - 以預約方式計算每個請求的送出時間：先扣令牌，令牌不足時返回需要等待的秒數
+    - 令牌桶狀態存於 cache/rate_limiter_state.json，以 fcntl.flock 保護讀寫，
+      同時執行的排程共用同一組令牌桶
+    - 收到 429 時以 penalize 清空令牌桶，之後所有請求自動延後，不需各自長時間 sleep
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的速率限制器
+
+        返回:
+        - RateLimiter: 實例
+        """
+        with RateLimiter._instance_lock:
+            if RateLimiter._instance is None:
+                RateLimiter._instance = RateLimiter()
+            return RateLimiter._instance
+
+    def __init__(self, state_file=STATE_FILE, shared=RATE_LIMITER_SHARED):
+        """
+        初始化速率限制器
+
+        參數:
+        - state_file: 狀態檔路徑
+        - shared: 是否透過狀態檔跨行程共用
+        """
+        self.state_file = state_file
+        self.lock_file = state_file + '.lock'
+        self.shared = shared and fcntl is not None
+        self._lock = threading.Lock()
+        self._state = {}
+        self._local = threading.local()
+
+    @contextmanager
+    def _locked_state(self):
+        """取得 (跨行程) 鎖定並返回可修改的狀態，離開時寫回"""
+        with self._lock:
+            if not self.shared:
+                yield self._state
+                return
+
+            with open(self.lock_file, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    try:
+                        with open(self.state_file, 'r', encoding='utf-8') as f:
+                            state = json.load(f)
+                    except (OSError, ValueError):
+                        state = {}
+                    yield state
+                    tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+                    with open(tmp_file, 'w', encoding='utf-8') as f:
+                        json.dump(state, f, separators=(',', ':'))
+                    os.replace(tmp_file, self.state_file)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refill(self, state, service, now):
+        """補充令牌並返回服務的令牌桶狀態"""
+        rate, burst = get_service_rate(service)
+        bucket = state.get(service) or {"tokens": float(burst), "updated": now}
+        elapsed = max(0.0, now - bucket["updated"])
+        bucket["tokens"] = min(float(burst), bucket["tokens"] + elapsed * rate)
+        bucket["updated"] = now
+        state[service] = bucket
+        return bucket, rate
+
+    def reserve(self, service, count=1):
+        """
+        預約令牌 (不等待)
+
+        參數:
+        - service: 服務名稱
+        - count: 令牌數量 (一次呼叫會送出多個請求時，例如 yf.download 每檔一個請求)
+
+        返回:
+        - float: 呼叫端需要等待的秒數
+        """
+        credits = getattr(self._local, 'prepaid', {})
+        if credits.get(service, 0) > 0:
+            credits[service] -= 1
+            count -= 1
+            if count <= 0:
+                return 0.0
+
+        try:
+            with self._locked_state() as state:
+                bucket, rate = self._refill(state, service, time.time())
+                bucket["tokens"] -= count
+                return 0.0 if bucket["tokens"] >= 0 else -bucket["tokens"] / rate
+        except OSError as e:
+            # 狀態檔無法使用時改為只在行程內共用
+            print(f"[rate_limiter] ⚠️ 無法使用狀態檔，改為行程內限制: {e}")
+            self.shared = False
+            return self.reserve(service, count)
+
+    def acquire(self, service, count=1):
+        """
+        取得令牌，必要時等待
+
+        參數:
+        - service: 服務名稱
+        - count: 令牌數量
+
+        返回:
+        - float: 實際等待的秒數
+        """
+        if not service:
+            return 0.0
+        wait = self.reserve(service, count)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def acquire_url(self, url):
+        """
+        依網址所屬服務取得令牌 (不屬於已知服務時不限制)
+
+        參數:
+        - url: 請求網址
+
+        返回:
+        - float: 實際等待的秒數
+        """
+        return self.acquire(service_for_url(url))
+
+    def penalize(self, service, seconds):
+        """
+        清空服務的令牌桶並延後後續請求 (收到 429 時呼叫)
+
+        參數:
+        - service: 服務名稱
+        - seconds: 延後的秒數
+        """
+        with self._locked_state() as state:
+            bucket, rate = self._refill(state, service, time.time())
+            bucket["tokens"] = min(bucket["tokens"], 0.0) - seconds * rate
+        print(f"[rate_limiter] ⚠️ {service} 速率受限，後續請求延後 {seconds:.1f} 秒")
+
+    @contextmanager
+    def prepaid(self, service):
+        """
+        標記目前執行緒已為服務預先取得一個令牌 (例如抓取引擎已取得)，
+        區塊內第一次 acquire 不再重複扣除
+
+        參數:
+        - service: 服務名稱
+        """
+        credits = getattr(self._local, 'prepaid', None)
+        if credits is None:
+            credits = self._local.prepaid = {}
+        before = credits.get(service, 0)
+        credits[service] = before + 1
+        try:
+            yield
+        finally:
+            credits[service] = min(credits[service], before)
+
+
+def acquire(service, count=1):
+    """
+    透過全局速率限制器取得令牌 (便捷函數)
+
+    參數:
+    - service: 服務名稱
+    - count: 令牌數量
+
+    返回:
+    - float: 實際等待的秒數
+    """
+    return RateLimiter.get_instance().acquire(service, count)
+
+
+def penalize(service, seconds):
+    """
+    透過全局速率限制器延後服務的後續請求 (便捷函數)
+
+    參數:
+    - service: 服務名稱
+    - seconds: 延後的秒數
+    """
+    RateLimiter.get_instance().penalize(service, seconds)
+
+
+def install_session_limiter(session):
+    """
+    包裝 session.request，每個請求送出前依網址所屬服務取得令牌
+
+    參數:
+    - session: requests.Session 物件
+
+    返回:
+    - 同一個 session
+    """
+    original_request = session.request
+    limiter = RateLimiter.get_instance()
+
+    def request_with_limiter(method, url, **kwargs):
+        limiter.acquire_url(url)
+        return original_request(method, url, **kwargs)
+
+    session.request = request_with_limiter
+    return session
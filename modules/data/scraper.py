@@ -12,13 +12,19 @@ from bs4 import BeautifulSoup
 import io
 import time
 import os
-import json
 import random
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import socket
+from modules.data.async_fetcher import fetch_many, get_service_session
+from modules.data.rate_limiter import install_session_limiter
+from modules.data.http_cache import install_http_cache, no_cache_headers
+from modules.tracing import install_session_tracing, traced
+from modules.data.stock_master import StockMaster
+from modules.data.endpoints import endpoint_url, host_port
+from modules.cache_store import read_json, write_json
 
 # 緩存目錄設置
 CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
@@ -59,7 +65,9 @@ def create_retry_session(retries=MAX_RETRIES, backoff_factor=0.5,
         **kwargs
     )
     
-    return session
+    # 每個請求送出前依網址所屬服務 (twse/mops/goodinfo) 取得速率令牌，
+    # 外層再以 HTTP 回應快取處理未變動的頁面 (快取命中時不佔用令牌)
+    return install_http_cache(install_session_tracing(install_session_limiter(session)))
 
 def get_latest_season():
     """
@@ -92,6 +100,7 @@ data_fetch_status = {
     "failed_sources": []
 }
 
+@traced()
 def get_eps_data(use_cache=True, cache_expiry_hours=72):
     """
     抓取所有上市公司的 EPS 和股息資料，增加多來源獲取和強化錯誤處理
@@ -109,14 +118,13 @@ def get_eps_data(use_cache=True, cache_expiry_hours=72):
     cache_file = os.path.join(CACHE_DIR, 'eps_data_cache.json')
     if use_cache and os.path.exists(cache_file):
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-                cache_time = datetime.datetime.fromisoformat(cache_data['timestamp'])
-                
-                # 檢查緩存是否過期（延長至72小時）
-                if datetime.datetime.now() - cache_time < datetime.timedelta(hours=cache_expiry_hours):
-                    print(f"[scraper] ✅ 使用緩存的 EPS 和股息數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
-                    return cache_data['data']
+            cache_data = read_json(cache_file)
+            cache_time = datetime.datetime.fromisoformat(cache_data['timestamp'])
+            
+            # 檢查緩存是否過期（延長至72小時）
+            if datetime.datetime.now() - cache_time < datetime.timedelta(hours=cache_expiry_hours):
+                print(f"[scraper] ✅ 使用緩存的 EPS 和股息數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
+                return cache_data['data']
         except Exception as e:
             print(f"[scraper] ⚠️ 讀取緩存失敗: {e}")
     
@@ -173,26 +181,19 @@ def get_eps_data(use_cache=True, cache_expiry_hours=72):
     data_fetch_status["last_fetch_source"] = successful_source
     
     # 記錄數據獲取狀態
-    try:
-        status_file = os.path.join(CACHE_DIR, 'data_fetch_status.json')
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump(data_fetch_status, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"[scraper] ⚠️ 無法保存數據獲取狀態: {e}")
+    status_file = os.path.join(CACHE_DIR, 'data_fetch_status.json')
+    if not write_json(status_file, data_fetch_status):
+        print(f"[scraper] ⚠️ 無法保存數據獲取狀態")
     
     # 儲存結果到緩存
     if use_cache and results:
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                cache_data = {
-                    'timestamp': datetime.datetime.now().isoformat(),
-                    'source': successful_source,
-                    'data': results
-                }
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        cache_data = {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'source': successful_source,
+            'data': results
+        }
+        if write_json(cache_file, cache_data):
             print(f"[scraper] ✅ 已更新 EPS 和股息數據緩存")
-        except Exception as e:
-            print(f"[scraper] ⚠️ 寫入緩存失敗: {e}")
     
     return results
 
@@ -202,7 +203,7 @@ def get_eps_data_from_mops():
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36",
         "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
-        "Referer": "https://mops.twse.com.tw/mops/web/t05st09_1"
+        "Referer": endpoint_url('mops', "/mops/web/t05st09_1")
     }
 
     print(f"[scraper] 嘗試獲取 {year} 年第 {season} 季的 EPS 數據...")
@@ -218,16 +219,15 @@ def get_eps_data_from_mops():
     # 檢查連接是否可用
     try:
         socket_timeout = 5  # 使用非常短的超時測試連接
-        host = "mops.twse.com.tw"
-        port = 443
+        host, port = host_port('mops')
         
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(socket_timeout)
-        result = sock.connect_ex((host, port))
+        status = sock.connect_ex((host, port))
         sock.close()
         
-        if result != 0:
-            print(f"[scraper] ⚠️ 無法連接到 {host}:{port}，狀態碼: {result}")
+        if status != 0:
+            print(f"[scraper] ⚠️ 無法連接到 {host}:{port}，狀態碼: {status}")
             return {}
     except Exception as e:
         print(f"[scraper] ⚠️ 連接測試失敗: {e}")
@@ -236,7 +236,7 @@ def get_eps_data_from_mops():
     # 成功連接後，嘗試獲取數據
     try:
         # 嘗試獲取每股盈餘資料，設置更短的超時
-        eps_url = "https://mops.twse.com.tw/mops/web/ajax_t05st09_1"
+        eps_url = endpoint_url('mops', "/mops/web/ajax_t05st09_1")
         eps_data = {
             "encodeURIComponent": "1",
             "step": "1",
@@ -255,7 +255,7 @@ def get_eps_data_from_mops():
                 eps_res = session.post(
                     eps_url,
                     data=eps_data,
-                    headers=headers,
+                    headers=headers if attempt == 0 else no_cache_headers(headers),  # 重試時不沿用快取
                     timeout=(5, 10)  # 連接超時5秒，讀取超時10秒
                 )
                 
@@ -290,9 +290,9 @@ def get_eps_data_from_mops():
             try:
                 # 嘗試獲取股息資料，減少超時時間
                 div_res = session.post(
-                    "https://mops.twse.com.tw/mops/web/ajax_t05st34",
+                    endpoint_url('mops', "/mops/web/ajax_t05st34"),
                     data={"encodeURIComponent": "1", "step": "1", "firstin": "1", "off": "1", "TYPEK": "sii"},
-                    headers=headers, 
+                    headers=headers if attempt == 0 else no_cache_headers(headers),
                     timeout=(5, 10)  # 減少超時時間
                 )
                 
@@ -352,7 +352,8 @@ def get_eps_data_from_yahoo():
         from modules.data.finance_yahoo import get_eps_data_alternative
         
         # 使用縮短超時的設置來調用此函數，並指定更小的處理批次來避免速率限制
-        return get_eps_data_alternative(max_stocks=40, timeout=15, batch_size=3, batch_delay=2.0)
+        # use_scraper=False：此函數本身就是 get_eps_data 的資料來源，不可再回頭呼叫 get_eps_data
+        return get_eps_data_alternative(max_stocks=40, timeout=15, batch_size=3, batch_delay=2.0, use_scraper=False)
     except Exception as e:
         print(f"[scraper] ❌ 使用 Yahoo Finance 獲取數據失敗：{e}")
         return {}
@@ -364,13 +365,12 @@ def get_backup_eps_data():
         backup_cache_file = os.path.join(CACHE_DIR, 'backup_eps_data_cache.json')
         if os.path.exists(backup_cache_file):
             try:
-                with open(backup_cache_file, 'r', encoding='utf-8') as f:
-                    backup_data = json.load(f)
-                    # 顯示緩存年齡
-                    cache_time = datetime.datetime.fromisoformat(backup_data['timestamp'])
-                    age_hours = (datetime.datetime.now() - cache_time).total_seconds() / 3600
-                    print(f"[scraper] ℹ️ 使用備用緩存的 EPS 數據 (年齡：{age_hours:.1f}小時)")
-                    return backup_data['data']
+                backup_data = read_json(backup_cache_file)
+                # 顯示緩存年齡
+                cache_time = datetime.datetime.fromisoformat(backup_data['timestamp'])
+                age_hours = (datetime.datetime.now() - cache_time).total_seconds() / 3600
+                print(f"[scraper] ℹ️ 使用備用緩存的 EPS 數據 (年齡：{age_hours:.1f}小時)")
+                return backup_data['data']
             except Exception as e:
                 print(f"[scraper] ⚠️ 讀取備用緩存失敗: {e}")
         
@@ -419,6 +419,14 @@ def get_hardcoded_eps_data():
     }
 
 
+def _update_stock_master(stocks, timestamp):
+    """將有效的股票列表同步到股票基本資料索引表 (備用列表不同步)"""
+    try:
+        StockMaster.get_instance().update(stocks, timestamp)
+    except Exception as e:
+        print(f"[scraper] ⚠️ 更新股票基本資料表失敗: {e}")
+
+@traced()
 def get_all_valid_twse_stocks(limit=None, use_cache=True, cache_expiry_hours=48):
     """
     從證交所獲取所有有效的上市股票，增加緩存機制
@@ -435,24 +443,24 @@ def get_all_valid_twse_stocks(limit=None, use_cache=True, cache_expiry_hours=48)
     cache_file = os.path.join(CACHE_DIR, 'twse_stocks_cache.json')
     if use_cache and os.path.exists(cache_file):
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-                cache_time = datetime.datetime.fromisoformat(cache_data['timestamp'])
+            cache_data = read_json(cache_file)
+            cache_time = datetime.datetime.fromisoformat(cache_data['timestamp'])
+            
+            # 檢查緩存是否過期
+            if datetime.datetime.now() - cache_time < datetime.timedelta(hours=cache_expiry_hours):
+                print(f"[scraper] ✅ 使用緩存的股票列表 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
+                _update_stock_master(cache_data['data'], cache_time)
                 
-                # 檢查緩存是否過期
-                if datetime.datetime.now() - cache_time < datetime.timedelta(hours=cache_expiry_hours):
-                    print(f"[scraper] ✅ 使用緩存的股票列表 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
-                    
-                    # 在返回緩存結果前增加限制檢查
-                    if limit is not None and isinstance(limit, int) and limit > 0:
-                        print(f"[scraper] 限制返回 {limit} 檔股票")
-                        return cache_data['data'][:limit]
-                    
-                    return cache_data['data']
+                # 在返回緩存結果前增加限制檢查
+                if limit is not None and isinstance(limit, int) and limit > 0:
+                    print(f"[scraper] 限制返回 {limit} 檔股票")
+                    return cache_data['data'][:limit]
+                
+                return cache_data['data']
         except Exception as e:
             print(f"[scraper] ⚠️ 讀取股票列表緩存失敗: {e}")
     
-    url = "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2"
+    url = endpoint_url('isin', "/isin/C_public.jsp?strMode=2")
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36",
         "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7"
@@ -466,7 +474,8 @@ def get_all_valid_twse_stocks(limit=None, use_cache=True, cache_expiry_hours=48)
         max_attempts = 2
         for attempt in range(max_attempts):
             try:
-                response = session.get(url, headers=headers, timeout=(5, 15))
+                response = session.get(url, headers=headers if attempt == 0 else no_cache_headers(headers),
+                                       timeout=(5, 15))
                 response.encoding = 'big5'
                 
                 if response.status_code == 200 and len(response.text) > 1000:
@@ -527,19 +536,18 @@ def get_all_valid_twse_stocks(limit=None, use_cache=True, cache_expiry_hours=48)
                 })
 
             print(f"[scraper] ✅ 成功獲取 {len(all_stocks)} 檔上市股票列表")
+            fetched_at = datetime.datetime.now()
+            if all_stocks:
+                _update_stock_master(all_stocks, fetched_at)
             
             # 儲存結果到緩存
             if use_cache and all_stocks:
-                try:
-                    with open(cache_file, 'w', encoding='utf-8') as f:
-                        cache_data = {
-                            'timestamp': datetime.datetime.now().isoformat(),
-                            'data': all_stocks
-                        }
-                        json.dump(cache_data, f, ensure_ascii=False, indent=2)
+                cache_data = {
+                    'timestamp': fetched_at.isoformat(),
+                    'data': all_stocks
+                }
+                if write_json(cache_file, cache_data):
                     print(f"[scraper] ✅ 已更新股票列表緩存")
-                except Exception as e:
-                    print(f"[scraper] ⚠️ 寫入股票列表緩存失敗: {e}")
             
             # 在返回結果前增加限制檢查
             if limit is not None and isinstance(limit, int) and limit > 0:
@@ -610,6 +618,7 @@ def get_backup_stock_list():
     return backup_stocks
 
 
+@traced()
 def get_dividend_data(use_cache=True, cache_expiry_hours=72):
     """
     僅獲取股息資料，增加緩存有效期
@@ -625,14 +634,13 @@ def get_dividend_data(use_cache=True, cache_expiry_hours=72):
     cache_file = os.path.join(CACHE_DIR, 'dividend_data_cache.json')
     if use_cache and os.path.exists(cache_file):
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-                cache_time = datetime.datetime.fromisoformat(cache_data['timestamp'])
-                
-                # 檢查緩存是否過期，延長到72小時
-                if datetime.datetime.now() - cache_time < datetime.timedelta(hours=cache_expiry_hours):
-                    print(f"[scraper] ✅ 使用緩存的股息數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
-                    return cache_data['data']
+            cache_data = read_json(cache_file)
+            cache_time = datetime.datetime.fromisoformat(cache_data['timestamp'])
+            
+            # 檢查緩存是否過期，延長到72小時
+            if datetime.datetime.now() - cache_time < datetime.timedelta(hours=cache_expiry_hours):
+                print(f"[scraper] ✅ 使用緩存的股息數據 (更新於 {cache_time.strftime('%Y-%m-%d %H:%M')})")
+                return cache_data['data']
         except Exception as e:
             print(f"[scraper] ⚠️ 讀取股息緩存失敗: {e}")
     
@@ -644,16 +652,12 @@ def get_dividend_data(use_cache=True, cache_expiry_hours=72):
     
     # 儲存結果到緩存
     if use_cache and dividend_data:
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                cache_data = {
-                    'timestamp': datetime.datetime.now().isoformat(),
-                    'data': dividend_data
-                }
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        cache_data = {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'data': dividend_data
+        }
+        if write_json(cache_file, cache_data):
             print(f"[scraper] ✅ 已更新股息數據緩存")
-        except Exception as e:
-            print(f"[scraper] ⚠️ 寫入股息緩存失敗: {e}")
     
     return dividend_data
 
@@ -670,8 +674,10 @@ def get_all_valid_twse_stocks_with_type(use_cache=True):
     """
     from modules.data.fetcher import is_etf
     
-    # 獲取原始股票列表
-    raw = get_all_valid_twse_stocks(use_cache)
+    # 由股票基本資料表取得原始股票列表 (每個行程只載入一次)
+    master = StockMaster.get_instance()
+    master.load(refresh=not use_cache)
+    raw = master.all()
     stocks = []
     
     for item in raw:
@@ -695,6 +701,7 @@ def get_all_valid_twse_stocks_with_type(use_cache=True):
         
     return stocks
 
+@traced()
 def fetch_fundamental_data(stock_ids, max_stocks=20):
     """
     獲取基本面數據（PE, PB, ROE, 法人持股等），增加平行處理和超時控制
@@ -707,7 +714,7 @@ def fetch_fundamental_data(stock_ids, max_stocks=20):
     - 包含基本面資訊的 DataFrame
     """
     print(f"[scraper] ⏳ 開始擷取法人與本益比資料 (最多處理 {max_stocks} 檔)...")
-    base_url = "https://goodinfo.tw/tw/StockInfo.asp?STOCK_ID="
+    base_url = endpoint_url('goodinfo', "/tw/StockInfo.asp?STOCK_ID=")
     
     # 隨機化 User-Agent 以避免被封鎖
     user_agents = [
@@ -720,7 +727,7 @@ def fetch_fundamental_data(stock_ids, max_stocks=20):
     headers = {
         "User-Agent": random.choice(user_agents),
         "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
-        "Referer": "https://goodinfo.tw/tw/index.asp"
+        "Referer": endpoint_url('goodinfo', "/tw/index.asp")
     }
     
     result = []
@@ -730,34 +737,21 @@ def fetch_fundamental_data(stock_ids, max_stocks=20):
         print(f"[scraper] ⚠️ 限制處理數量為 {max_stocks} 檔股票 (原 {len(stock_ids)} 檔)")
         stock_ids = stock_ids[:max_stocks]
 
-    # 使用優化的重試設置，但減少重試次數
-    session = create_retry_session(retries=1, backoff_factor=0.5)
+    # 使用抓取引擎中 goodinfo 共用的 session (重複使用連線)，減少重試次數
+    session = get_service_session("goodinfo", retries=1, backoff_factor=0.5, timeout=(5, 10))
     
-    # 並行處理股票，但增加限流控制，減少並行數
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        futures = []
-        
-        for i, stock_id in enumerate(stock_ids):
-            # 每2個請求添加延遲以避免過快請求
-            if i > 0 and i % 2 == 0:
-                time.sleep(BATCH_DELAY)
-            
-            futures.append(executor.submit(
-                fetch_single_stock_fundamental, 
-                stock_id, 
-                session, 
-                base_url, 
-                headers
-            ))
-        
-        # 處理完成的任務
-        for future in as_completed(futures):
-            try:
-                data = future.result()
-                if data:
-                    result.append(data)
-            except Exception as e:
-                print(f"[scraper] ⚠️ 基本面數據獲取任務失敗: {e}")
+    # 交由抓取引擎依 goodinfo 的連線數與速率限制並行處理 (取代固定的批次延遲)
+    outcomes = fetch_many(
+        "goodinfo",
+        fetch_single_stock_fundamental,
+        [(stock_id, session, base_url, headers) for stock_id in stock_ids]
+    )
+    
+    for data in outcomes:
+        if isinstance(data, Exception):
+            print(f"[scraper] ⚠️ 基本面數據獲取任務失敗: {data}")
+        elif data:
+            result.append(data)
 
     print(f"[scraper] ✅ 成功獲取 {len(result)} 檔股票的基本面數據")
     return pd.DataFrame(result)
@@ -772,7 +766,8 @@ def fetch_single_stock_fundamental(stock_id, session, base_url, headers):
         max_attempts = 1  # 減少重試次數，提高效率
         for attempt in range(max_attempts):
             try:
-                resp = session.get(url, headers=headers, timeout=(5, 10))
+                resp = session.get(url, headers=headers if attempt == 0 else no_cache_headers(headers),
+                                   timeout=(5, 10))
                 if resp.status_code == 200:
                     break
                 time.sleep(1)
@@ -0,0 +1,258 @@
+"""
+股票基本資料模組 - 上市股票代碼、名稱、市場別與產業別的記憶體索引表，
+每個行程只載入一次 (由二進位快照讀取)，依代碼、產業與市場別查詢皆為字典查找
+"""
+print("[stock_master] ✅ 已載入最新版")
+
+import os
+import pickle
+import threading
+from datetime import datetime, timedelta
+
+# 快照設置
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '../../cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, 'stock_master.pkl')
+
+# 快照有效時間 (小時)，與股票列表緩存一致
+STOCK_MASTER_EXPIRY_HOURS = int(os.getenv("STOCK_MASTER_EXPIRY_HOURS", "48"))
+
+# 快照中每筆資料的欄位順序
+RECORD_FIELDS = ("stock_id", "stock_name", "market_type", "industry")
+
+
+class StockMaster:
+    """
+    股票基本資料索引表
+
+    - 主索引：股票代碼 -> 基本資料字典
+    - 次索引：產業別 -> 股票代碼列表、市場別 -> 股票代碼列表
+    - 以 pickle 快照 (cache/stock_master.pkl) 保存精簡的 tuple 列表，載入時不需解析 JSON 或 HTML
+    - 快照過期時透過 scraper.get_all_valid_twse_stocks 重新取得；下載失敗時沿用過期快照
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的股票基本資料表
+
+        返回:
+        - StockMaster: 實例
+        """
+        with StockMaster._instance_lock:
+            if StockMaster._instance is None:
+                StockMaster._instance = StockMaster()
+            return StockMaster._instance
+
+    def __init__(self, snapshot_file=SNAPSHOT_FILE):
+        """
+        初始化股票基本資料表
+
+        參數:
+        - snapshot_file: 快照檔路徑
+        """
+        self.snapshot_file = snapshot_file
+        self._lock = threading.RLock()
+        self._timestamp = None
+        self._records = None
+        self._by_id = {}
+        self._by_industry = {}
+        self._by_market = {}
+
+    def _index(self, records, timestamp):
+        """建立主索引與次索引"""
+        by_id, by_industry, by_market = {}, {}, {}
+        for record in records:
+            stock_id = record["stock_id"]
+            if stock_id in by_id:
+                continue
+            by_id[stock_id] = record
+            by_industry.setdefault(record.get("industry") or "", []).append(stock_id)
+            by_market.setdefault(record.get("market_type") or "", []).append(stock_id)
+
+        self._records = list(by_id.values())
+        self._by_id, self._by_industry, self._by_market = by_id, by_industry, by_market
+        self._timestamp = timestamp
+
+    def _is_fresh(self, timestamp):
+        """判斷快照是否在有效時間內"""
+        return timestamp is not None and datetime.now() - timestamp < timedelta(hours=STOCK_MASTER_EXPIRY_HOURS)
+
+    def _load_snapshot(self):
+        """讀取快照檔"""
+        try:
+            if os.path.exists(self.snapshot_file):
+                with open(self.snapshot_file, 'rb') as f:
+                    snapshot = pickle.load(f)
+                records = [dict(zip(RECORD_FIELDS, row)) for row in snapshot["records"]]
+                return records, datetime.fromisoformat(snapshot["timestamp"])
+        except Exception as e:
+            print(f"[stock_master] ⚠️ 讀取股票基本資料快照失敗: {e}")
+        return None, None
+
+    def _save_snapshot(self, records, timestamp):
+        """寫入快照檔"""
+        tmp_file = f"{self.snapshot_file}.{os.getpid()}.tmp"
+        try:
+            snapshot = {
+                "timestamp": timestamp.isoformat(),
+                "records": [tuple(record.get(field, "") for field in RECORD_FIELDS) for record in records],
+            }
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.snapshot_file)
+        except Exception as e:
+            print(f"[stock_master] ⚠️ 寫入股票基本資料快照失敗: {e}")
+
+    def update(self, records, timestamp=None):
+        """
+        以新取得的股票列表更新索引與快照 (scraper 取得有效股票列表時呼叫)
+
+        參數:
+        - records: 股票資訊列表 [{"stock_id", "stock_name", "market_type", "industry"}]
+        - timestamp: 資料取得時間，None 表示現在
+        """
+        timestamp = timestamp or datetime.now()
+        with self._lock:
+            if self._records is not None and timestamp == self._timestamp:
+                return
+            self._index(records, timestamp)
+            self._save_snapshot(self._records, timestamp)
+
+    def load(self, refresh=False):
+        """
+        載入股票基本資料 (每個行程只載入一次)
+
+        參數:
+        - refresh: 是否忽略快照重新取得
+        """
+        with self._lock:
+            if self._records is not None and not refresh:
+                return
+
+            records, timestamp = (None, None) if refresh else self._load_snapshot()
+            if records and self._is_fresh(timestamp):
+                self._index(records, timestamp)
+                return
+
+            # 快照不存在或過期：由 scraper 取得 (成功時 scraper 會呼叫 update 寫入快照)
+            from modules.data.scraper import get_all_valid_twse_stocks
+            self._records = None
+            fetched = get_all_valid_twse_stocks(use_cache=not refresh)
+            if self._records is not None:
+                return
+
+            # 只取得備用列表：優先沿用過期快照
+            if records:
+                print(f"[stock_master] ⚠️ 無法更新股票基本資料，使用 {timestamp:%Y-%m-%d} 的快照")
+                self._index(records, timestamp)
+            else:
+                self._index(fetched, None)
+
+    def get(self, stock_id):
+        """
+        取得單一股票的基本資料
+
+        參數:
+        - stock_id: 股票代碼
+
+        返回:
+        - 字典 {"stock_id", "stock_name", "market_type", "industry"}，找不到時返回 None
+        """
+        self.load()
+        return self._by_id.get(str(stock_id).strip())
+
+    def all(self):
+        """
+        取得全部股票的基本資料
+
+        返回:
+        - 股票資訊列表 (共用物件，請勿修改)
+        """
+        self.load()
+        return self._records
+
+    def by_industry(self, industry):
+        """
+        取得產業別的全部股票代碼
+
+        參數:
+        - industry: 產業別 (例如 '半導體業')
+
+        返回:
+        - 股票代碼列表
+        """
+        self.load()
+        return list(self._by_industry.get(industry, []))
+
+    def by_market(self, market_type):
+        """
+        取得市場別的全部股票代碼
+
+        參數:
+        - market_type: 市場別 (例如 '上市')
+
+        返回:
+        - 股票代碼列表
+        """
+        self.load()
+        return list(self._by_market.get(market_type, []))
+
+    def industries(self):
+        """
+        取得全部產業別
+
+        返回:
+        - 產業別列表
+        """
+        self.load()
+        return [industry for industry in self._by_industry if industry]
+
+    def __contains__(self, stock_id):
+        self.load()
+        return str(stock_id).strip() in self._by_id
+
+    def __len__(self):
+        self.load()
+        return len(self._by_id)
+
+
+def get_stock_master():
+    """
+    獲取全局共用的股票基本資料表 (便捷函數)
+
+    返回:
+    - StockMaster: 實例
+    """
+    return StockMaster.get_instance()
+
+
+def get_stock_info(stock_id):
+    """
+    取得單一股票的基本資料 (便捷函數)
+
+    參數:
+    - stock_id: 股票代碼
+
+    返回:
+    - 基本資料字典，找不到時返回 None
+    """
+    return StockMaster.get_instance().get(stock_id)
+
+
+def get_stock_industry(stock_id):
+    """
+    取得股票的產業別 (便捷函數)
+
+    參數:
+    - stock_id: 股票代碼
+
+    返回:
+    - 產業別，找不到時返回 None
+    """
+    info = StockMaster.get_instance().get(stock_id)
+    return info["industry"] if info else None
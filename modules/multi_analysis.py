@@ -8,9 +8,256 @@ import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-import yfinance as yf
+import os
 import time
+import queue
 import threading
+from modules.data.price_history import get_price_histories, get_price_history, get_ticker_info
+from modules.analysis.indicators import macd
+from modules.analysis.sentiment import get_market_strength_table
+from modules.data.rate_limiter import penalize
+
+# 各分析維度的權重
+WEIGHTS = {
+    'technical': 0.35,  # 技術面分析權重
+    'fundamental': 0.30,  # 基本面分析權重
+    'industry': 0.15,    # 產業趨勢權重
+    'market_sentiment': 0.20  # 市場情緒權重
+}
+
+# 各維度名稱 (用於錯誤訊息)
+DIMENSION_NAMES = {
+    'technical': '技術分析',
+    'fundamental': '基本面分析',
+    'industry': '產業分析',
+    'market_sentiment': '市場情緒分析',
+}
+
+# 並行分析的執行緒數與單一分析維度的時間上限(秒) (同原本每個維度最多等待 10 秒)
+MULTI_ANALYSIS_WORKERS = int(os.getenv("MULTI_ANALYSIS_WORKERS", "8"))
+STOCK_VALUE_DEADLINE = float(os.getenv("STOCK_VALUE_DEADLINE", "10"))
+
+# 共用資料 (市場情緒、EPS 表、加權指數走勢、股票基本資料) 的取得時限與保留時間(秒)
+SHARED_INPUTS_TIMEOUT = float(os.getenv("SHARED_INPUTS_TIMEOUT", "30"))
+SHARED_INPUTS_TTL = float(os.getenv("SHARED_INPUTS_TTL", "1800"))
+SHARED_INPUTS_RETRY_INTERVAL = float(os.getenv("SHARED_INPUTS_RETRY_INTERVAL", "300"))  # 取得失敗後多久再嘗試
+
+# 共用資料取得失敗時的替代值：各股票改以缺少該資料的方式評分，不再逐檔重新取得
+SHARED_INPUT_FALLBACKS = {
+    "market_score": 5.0,              # 中性評分 (同 score_index_changes 無資料時)
+    "eps_data": {},                   # 無 EPS/股息資料
+    "twii_history": pd.DataFrame(),   # 不計算相對強度
+    "stock_master": None,
+}
+
+_shared_inputs = {}  # 資料名稱 -> (到期時間, 值)
+_shared_inputs_lock = threading.Lock()
+
+
+def _run_tasks(tasks, timeout, workers=MULTI_ANALYSIS_WORKERS, name="multi_analysis"):
+    """
+    以本次呼叫專用的 daemon 執行緒並行執行工作，最多等待 timeout 秒
+
+    逾時仍在執行的工作無法中斷，但只佔用本次呼叫的執行緒：之後的呼叫不會排在它們後面，
+    daemon 執行緒也不會阻擋程式結束
+
+    參數:
+    - tasks: 工作列表 [(鍵, 函數, 參數 tuple)]
+    - timeout: 等待時間上限(秒)
+    - workers: 執行緒數上限
+    - name: 執行緒名稱前綴
+
+    返回:
+    - 字典 {鍵: 函數返回值}，只包含時限內完成的工作
+    """
+    if not tasks:
+        return {}
+    pending = queue.SimpleQueue()
+    for task in tasks:
+        pending.put(task)
+
+    results = {}
+    lock = threading.Lock()
+    all_done = threading.Event()
+    expired = threading.Event()
+    remaining = [len(tasks)]
+
+    def worker():
+        while not expired.is_set():
+            try:
+                key, func, args = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                value = func(*args)
+            except Exception as e:
+                value = e
+            with lock:
+                if not expired.is_set() and not isinstance(value, Exception):
+                    results[key] = value
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    all_done.set()
+
+    for i in range(min(workers, len(tasks))):
+        threading.Thread(target=worker, name=f"{name}-{i}", daemon=True).start()
+
+    all_done.wait(timeout)
+    with lock:
+        # 逾時後尚未開始的工作不再執行，執行中的工作結束後結果不再採用
+        expired.set()
+        return dict(results)
+
+
+def _run_dimension(dimension, func, *args):
+    """執行單一分析維度，錯誤時返回 0 分與錯誤說明"""
+    try:
+        score, analysis = func(*args)
+        return {"completed": True, "score": score, "analysis": analysis}
+    except Exception as e:
+        name = DIMENSION_NAMES[dimension]
+        print(f"[multi_analysis] ⚠️ {name}失敗：{e}")
+        return {"completed": True, "score": 0, "analysis": f"{name}失敗: {str(e)}"}
+
+
+def _load_market_score():
+    from modules.analysis.sentiment import get_market_sentiment_score
+    return get_market_sentiment_score()
+
+
+def _load_eps_data():
+    from modules.data.scraper import get_eps_data
+    return get_eps_data()
+
+
+def _load_twii_history():
+    return get_price_history("^TWII", period="30d")  # 台灣加權指數
+
+
+def _load_stock_master():
+    from modules.data.stock_master import get_stock_master
+    get_stock_master().load()
+    return True
+
+
+SHARED_INPUT_LOADERS = {
+    "market_score": _load_market_score,
+    "eps_data": _load_eps_data,
+    "twii_history": _load_twii_history,
+    "stock_master": _load_stock_master,
+}
+
+
+def get_shared_inputs(timeout=SHARED_INPUTS_TIMEOUT):
+    """
+    取得各股票共用的分析資料 (市場情緒、EPS 表、加權指數走勢、股票基本資料)
+
+    - 成功取得的資料保留 SHARED_INPUTS_TTL 秒，期間的分析不再重新取得
+    - 在各股票的分析時限之外先行取得，缺少的項目並行載入，最多等待 timeout 秒
+    - 取得失敗或逾時的項目以 SHARED_INPUT_FALLBACKS 替代，SHARED_INPUTS_RETRY_INTERVAL 秒後再嘗試
+
+    參數:
+    - timeout: 載入缺少項目的等待時間上限(秒)
+
+    返回:
+    - 字典 {資料名稱: 值}
+    """
+    with _shared_inputs_lock:
+        now = time.monotonic()
+        shared = {name: value for name, (expires_at, value) in _shared_inputs.items() if now < expires_at}
+        missing = [name for name in SHARED_INPUT_LOADERS if name not in shared]
+        if missing:
+            tasks = [(name, SHARED_INPUT_LOADERS[name], ()) for name in missing]
+            loaded = _run_tasks(tasks, timeout, workers=len(tasks), name="shared_inputs")
+            for name in missing:
+                if loaded.get(name) is not None:
+                    shared[name] = loaded[name]
+                    ttl = SHARED_INPUTS_TTL
+                else:
+                    print(f"[multi_analysis] ⚠️ 共用資料 {name} 取得失敗或逾時，改以缺少該資料的方式評分")
+                    shared[name] = SHARED_INPUT_FALLBACKS[name]
+                    ttl = SHARED_INPUTS_RETRY_INTERVAL
+                _shared_inputs[name] = (time.monotonic() + ttl, shared[name])
+        return shared
+
+
+def _summarize(result):
+    """依權重合併各維度結果，返回 (綜合評分, 分析詳情)"""
+    total_score = sum(result[dimension]["score"] * weight for dimension, weight in WEIGHTS.items())
+    analysis = {dimension: result[dimension]["analysis"] for dimension in WEIGHTS}
+    return total_score, analysis
+
+
+def _batch_strength_table(stock_codes):
+    """
+    批次預先取得 60 天股價歷史後計算相對強度排名表
+
+    參數:
+    - stock_codes: 股票代碼列表
+
+    返回:
+    - get_market_strength_table 產生的排名表
+    """
+    get_price_histories(stock_codes, period="60d")
+    return get_market_strength_table(stock_codes)
+
+
+def analyze_stock_values(stock_codes, deadline=60):
+    """
+    批次評估多檔股票的價值：四個分析維度並行執行，
+    市場情緒、EPS 表、加權指數走勢與股票基本資料只取得一次 (見 get_shared_inputs)，
+    個股相對強度與資金流向由 get_market_strength_table 一次計算
+
+    參數:
+    - stock_codes: 股票代碼列表
+    - deadline: 共用資料取得後，各維度分析的時間上限(秒)，逾時仍未完成的維度以「分析超時」計 0 分
+
+    返回:
+    - 字典 {股票代碼: (綜合評分, 分析詳情)}，逾時時返回已完成部分的結果
+    """
+    stock_codes = list(dict.fromkeys(stock_codes))
+    print(f"[multi_analysis] ⏳ 批次分析 {len(stock_codes)} 檔股票價值 (時限 {deadline} 秒)...")
+
+    # 共用資料不計入分析時限
+    shared = get_shared_inputs()
+
+    # 股價歷史一次批次取得 60 天 (技術面所需最長區間)，之後相對強度 (30 天) 與各維度分析都由共用存放區切片取得；
+    # 相對強度與資金流向一次計算全部股票，逾時或失敗時由各股票自行計算
+    started = time.time()
+    strength_table = _run_tasks([("strength", _batch_strength_table, (stock_codes,))], deadline).get("strength")
+    deadline = max(0, deadline - (time.time() - started))
+    strength_rows = {}
+    if strength_table is not None:
+        strength_rows = {code: row for code, row in zip(strength_table.index, strength_table.to_dict("records"))}
+
+    tasks = []
+    for code in stock_codes:
+        tasks.append(((code, "technical"), _run_dimension, ("technical", analyze_technical, code)))
+        tasks.append(((code, "industry"), _run_dimension, ("industry", analyze_industry, code)))
+        tasks.append(((code, "fundamental"), _run_dimension,
+                      ("fundamental", analyze_fundamental, code, shared["eps_data"])))
+        tasks.append(((code, "market_sentiment"), _run_dimension,
+                      ("market_sentiment", analyze_market_sentiment, code,
+                       shared["market_score"], shared["twii_history"], strength_rows.get(code))))
+    completed = _run_tasks(tasks, deadline)
+
+    # 各維度預設為逾時
+    results = {
+        code: {dimension: {"completed": False, "score": 0, "analysis": "分析超時"} for dimension in WEIGHTS}
+        for code in stock_codes
+    }
+    for (code, dimension), result in completed.items():
+        results[code][dimension] = result
+
+    if len(completed) < len(tasks):
+        print(f"[multi_analysis] ⚠️ 批次分析超過時限，{len(tasks) - len(completed)} 項分析未完成")
+
+    summary = {}
+    for code in stock_codes:
+        summary[code] = _summarize(results[code])
+        print(f"[multi_analysis] {code} 總評分: {summary[code][0]:.1f}/100")
+    return summary
+
 
 def analyze_stock_value(stock_code):
     """
@@ -25,115 +272,14 @@ def analyze_stock_value(stock_code):
     """
     print(f"[multi_analysis] 分析 {stock_code} 股票價值...")
     
-    # 初始化各分析維度的權重
-    weights = {
-        'technical': 0.35,  # 技術面分析權重
-        'fundamental': 0.30,  # 基本面分析權重
-        'industry': 0.15,    # 產業趨勢權重
-        'market_sentiment': 0.20  # 市場情緒權重
-    }
-    
-    # 添加超時控制
-    result = {
-        "technical": {"completed": False, "score": 0, "analysis": "分析超時"},
-        "fundamental": {"completed": False, "score": 0, "analysis": "分析超時"},
-        "industry": {"completed": False, "score": 0, "analysis": "分析超時"},
-        "market_sentiment": {"completed": False, "score": 0, "analysis": "分析超時"}
-    }
-    
-    # 創建線程執行各維度分析
-    threads = []
-    
-    # 技術面分析線程
-    def run_technical():
-        try:
-            score, analysis = analyze_technical(stock_code)
-            result["technical"] = {"completed": True, "score": score, "analysis": analysis}
-        except Exception as e:
-            print(f"[multi_analysis] ⚠️ 技術分析失敗：{e}")
-            result["technical"] = {"completed": True, "score": 0, "analysis": f"技術分析失敗: {str(e)}"}
-    
-    # 基本面分析線程
-    def run_fundamental():
-        try:
-            score, analysis = analyze_fundamental(stock_code)
-            result["fundamental"] = {"completed": True, "score": score, "analysis": analysis}
-        except Exception as e:
-            print(f"[multi_analysis] ⚠️ 基本面分析失敗：{e}")
-            result["fundamental"] = {"completed": True, "score": 0, "analysis": f"基本面分析失敗: {str(e)}"}
-    
-    # 產業分析線程
-    def run_industry():
-        try:
-            score, analysis = analyze_industry(stock_code)
-            result["industry"] = {"completed": True, "score": score, "analysis": analysis}
-        except Exception as e:
-            print(f"[multi_analysis] ⚠️ 產業分析失敗：{e}")
-            result["industry"] = {"completed": True, "score": 0, "analysis": f"產業分析失敗: {str(e)}"}
-    
-    # 市場情緒分析線程
-    def run_sentiment():
-        try:
-            score, analysis = analyze_market_sentiment(stock_code)
-            result["market_sentiment"] = {"completed": True, "score": score, "analysis": analysis}
-        except Exception as e:
-            print(f"[multi_analysis] ⚠️ 市場情緒分析失敗：{e}")
-            result["market_sentiment"] = {"completed": True, "score": 0, "analysis": f"市場情緒分析失敗: {str(e)}"}
-    
-    # 創建並啟動所有線程
-    threads.append(threading.Thread(target=run_technical))
-    threads.append(threading.Thread(target=run_fundamental))
-    threads.append(threading.Thread(target=run_industry))
-    threads.append(threading.Thread(target=run_sentiment))
-    
-    for t in threads:
-        t.daemon = True
-        t.start()
-    
-    # 等待線程完成或超時
-    timeout = 10  # 每個分析最多等待 10 秒
-    for t in threads:
-        t.join(timeout)
-    
-    # 獲取各維度分析結果
-    technical_score = result["technical"]["score"]
-    technical_analysis = result["technical"]["analysis"]
-    
-    fundamental_score = result["fundamental"]["score"]
-    fundamental_analysis = result["fundamental"]["analysis"]
-    
-    industry_score = result["industry"]["score"]
-    industry_analysis = result["industry"]["analysis"]
-    
-    sentiment_score = result["market_sentiment"]["score"]
-    sentiment_analysis = result["market_sentiment"]["analysis"]
-    
-    # 計算綜合評分
-    total_score = (
-        technical_score * weights['technical'] +
-        fundamental_score * weights['fundamental'] +
-        industry_score * weights['industry'] +
-        sentiment_score * weights['market_sentiment']
-    )
-    
-    # 匯總分析結果
-    analysis = {
-        'technical': technical_analysis,
-        'fundamental': fundamental_analysis,
-        'industry': industry_analysis,
-        'market_sentiment': sentiment_analysis,
-    }
-    
-    print(f"[multi_analysis] {stock_code} 總評分: {total_score:.1f}/100")
-    
-    return total_score, analysis
+    # 四個維度同時開始執行，每個維度最多等待 STOCK_VALUE_DEADLINE 秒 (共用資料另外取得，不佔用此時限)
+    return analyze_stock_values([stock_code], deadline=STOCK_VALUE_DEADLINE)[stock_code]
 
 def analyze_technical(stock_code):
     """技術面分析，增加錯誤處理和空值檢查"""
-    # 使用 yfinance 取得股價資料
+    # 透過共用存放區取得股價資料
     try:
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="60d")
+        history = get_price_history(stock_code, period="60d")
         
         if history.empty or len(history) < 30:
             return 0, "歷史資料不足"
@@ -148,6 +294,17 @@ def analyze_technical(stock_code):
             
         volumes = history['Volume'].values if 'Volume' in history.columns else np.zeros(len(closes))
         
+        # 2. MACD - 先以未補零的收盤價計算完整序列，訊號線取自真實的 MACD 序列
+        try:
+            macd_series, signal_series, histogram_series = macd(np.nan_to_num(closes, nan=np.nanmean(closes)))
+            macd_line = float(macd_series[-1])
+            signal_line = float(signal_series[-1])
+            macd_histogram = float(histogram_series[-1])
+            prev_histogram = float(histogram_series[-2])
+        except Exception as e:
+            print(f"[multi_analysis] ⚠️ MACD 計算錯誤：{e}")
+            macd_line = signal_line = macd_histogram = prev_histogram = 0
+        
         # 計算技術指標前先檢查數據
         if len(closes) < 60:
             # 確保有足夠的資料長度
@@ -161,29 +318,6 @@ def analyze_technical(stock_code):
         ma_20 = np.mean(closes[-20:])
         ma_60 = np.mean(closes[-60:])
         
-        # 2. MACD - 使用安全的 calculate_ema 函數
-        try:
-            ema_12 = calculate_ema(closes, 12)
-            ema_26 = calculate_ema(closes, 26)
-            
-            # 確保計算結果是純數值而非數組
-            if isinstance(ema_12, np.ndarray):
-                ema_12 = float(ema_12[-1])
-            if isinstance(ema_26, np.ndarray):
-                ema_26 = float(ema_26[-1])
-            
-            macd_line = ema_12 - ema_26
-            
-            # 使用列表而非純量進行 EMA 計算
-            macd_values = np.zeros(9)
-            macd_values.fill(macd_line)
-            signal_line = calculate_ema(macd_values, 9)
-            
-            macd_histogram = macd_line - signal_line
-        except Exception as e:
-            print(f"[multi_analysis] ⚠️ MACD 計算錯誤：{e}")
-            ema_12 = ema_26 = macd_line = signal_line = macd_histogram = 0
-        
         # 3. RSI - 添加更多的安全檢查
         try:
             delta = np.diff(closes)
@@ -244,7 +378,6 @@ def analyze_technical(stock_code):
                 macd_score += 5
                 analysis_points.append("MACD位於零軸上方")
             if macd_histogram > 0 and len(closes) > 2:
-                prev_histogram = ema_12 - ema_26 - signal_line
                 if macd_histogram > prev_histogram:
                     macd_score += 5
                     analysis_points.append("MACD柱狀圖擴張中")
@@ -298,38 +431,8 @@ def analyze_technical(stock_code):
         print(f"[multi_analysis] ⚠️ 技術分析出錯：{e}")
         return 0, f"技術分析失敗: {str(e)}"
 
-def calculate_ema(prices, days):
-    """
-    計算指數移動平均線，增加更多安全檢查
-    """
-    try:
-        # 確保輸入是 numpy array
-        if not isinstance(prices, np.ndarray):
-            prices = np.array(prices, dtype=np.float64)
-        
-        # 檢查數據長度
-        if len(prices) < days:
-            return np.mean(prices)
-        
-        # 處理可能的 NaN 值
-        prices = np.nan_to_num(prices, nan=np.nanmean(prices))
-        
-        # 使用更穩健的 EMA 計算方法
-        alpha = 2.0 / (days + 1.0)
-        ema = np.zeros_like(prices)
-        ema[0] = prices[0]  # 初始化第一個值
-        
-        for i in range(1, len(prices)):
-            ema[i] = alpha * prices[i] + (1.0 - alpha) * ema[i-1]
-        
-        # 返回最後一個 EMA 值
-        return float(ema[-1])  # 明確轉換為 float
-    except Exception as e:
-        print(f"[multi_analysis] ⚠️ EMA 計算錯誤：{e}")
-        return 0.0  # 返回安全的默認值
-
-def analyze_fundamental(stock_code):
-    """基本面分析"""
+def analyze_fundamental(stock_code, eps_data=None):
+    """基本面分析 (eps_data 為批次分析共用的 EPS 表，None 表示自行取得)"""
     try:
         # 增加重試機制避免 Too Many Requests 錯誤
         max_retries = 3
@@ -338,12 +441,12 @@ def analyze_fundamental(stock_code):
         for attempt in range(max_retries):
             try:
                 # 使用現有模組獲取基本面資料
-                from modules.data.scraper import get_eps_data
-                eps_data = get_eps_data()
+                if eps_data is None:
+                    from modules.data.scraper import get_eps_data
+                    eps_data = get_eps_data()
                 
                 # 從 Yahoo Finance 獲取其他基本面數據
-                ticker = yf.Ticker(f"{stock_code}.TW")
-                info = ticker.info
+                info = get_ticker_info(stock_code)
                 
                 # 從自有資料獲取 EPS 和股息資料
                 stock_eps_data = eps_data.get(stock_code, {})
@@ -359,8 +462,9 @@ def analyze_fundamental(stock_code):
                 
             except Exception as e:
                 if "Too Many Requests" in str(e) and attempt < max_retries - 1:
-                    print(f"[multi_analysis] ⚠️ Yahoo Finance 速率限制，等待 {retry_delay} 秒後重試...")
-                    time.sleep(retry_delay)
+                    # 清空 Yahoo Finance 令牌桶，下一次請求會自動等待 (同時延後其他執行緒的請求)
+                    print(f"[multi_analysis] ⚠️ Yahoo Finance 速率限制，{retry_delay} 秒後重試...")
+                    penalize('yahoo_finance', retry_delay)
                     retry_delay *= 2  # 增加等待時間
                 else:
                     raise
@@ -442,14 +546,11 @@ def analyze_industry(stock_code):
         # 取得股票產業別
         # 優先使用現有模組
         try:
-            from modules.data.scraper import get_all_valid_twse_stocks
-            all_stocks = get_all_valid_twse_stocks()
-            stock_info = next((s for s in all_stocks if s['stock_id'] == stock_code), None)
-            industry = stock_info['industry'] if stock_info else None
+            from modules.data.stock_master import get_stock_industry
+            industry = get_stock_industry(stock_code)
         except:
             # 若無法獲取，使用 Yahoo Finance
-            ticker = yf.Ticker(f"{stock_code}.TW")
-            info = ticker.info
+            info = get_ticker_info(stock_code)
             industry = info.get('sector', None)
         
         if not industry:
@@ -497,24 +598,24 @@ def analyze_industry(stock_code):
         print(f"[multi_analysis] ⚠️ 產業分析出錯：{e}")
         return 50, f"產業分析失敗: {str(e)}"
 
-def analyze_market_sentiment(stock_code):
-    """市場情緒分析"""
+def _stock_strength(stock_code, twii_history=None):
+    """
+    逐檔計算個股相對大盤的強度與近 5 日成交量變化
+
+    返回:
+    - (相對強度, 成交量變化%)，股價資料不足時相對強度為 None
+    """
     try:
-        # 1. 獲取整體市場情緒
-        from modules.analysis.sentiment import get_market_sentiment_score
-        market_score = get_market_sentiment_score()
-        
         # 2. 獲取個股相對強度
-        ticker = yf.Ticker(f"{stock_code}.TW")
-        history = ticker.history(period="30d")
+        history = get_price_history(stock_code, period="30d")
         
         if history.empty or len(history) < 20:
-            return market_score * 0.8, f"市場整體情緒評分：{market_score}/10"
+            return None, 0
         
         # 計算個股與大盤的相對表現
         try:
-            twii = yf.Ticker("^TWII")  # 台灣加權指數
-            twii_history = twii.history(period="30d")
+            if twii_history is None:
+                twii_history = get_price_history("^TWII", period="30d")  # 台灣加權指數
             
             if not twii_history.empty and len(twii_history) >= 20:
                 # 計算近20天的表現
@@ -563,6 +664,37 @@ def analyze_market_sentiment(stock_code):
             except Exception as e:
                 print(f"[multi_analysis] ⚠️ 資金流向計算錯誤：{e}")
         
+        return relative_strength, volume_change
+    except Exception as e:
+        print(f"[multi_analysis] ⚠️ {stock_code} 相對強度計算失敗：{e}")
+        return 0, 0
+
+
+def analyze_market_sentiment(stock_code, market_score=None, twii_history=None, strength=None):
+    """
+    市場情緒分析 (market_score、twii_history 為批次分析共用的資料，None 表示自行取得；
+    strength 為 sentiment.get_market_strength_table 中該股票的一列，提供時不再逐檔計算相對強度與資金流向)
+    """
+    try:
+        # 1. 獲取整體市場情緒
+        if market_score is None:
+            from modules.analysis.sentiment import get_market_sentiment_score
+            market_score = get_market_sentiment_score()
+        
+        # 2-3. 個股相對強度與資金流向
+        if strength is not None:
+            # 由排名表取得 (與下方逐檔算法相同)
+            if pd.isna(strength.get("stock_change")):
+                return market_score * 0.8, f"市場整體情緒評分：{market_score}/10"
+            relative_strength = strength.get("relative_strength")
+            relative_strength = 0 if pd.isna(relative_strength) else relative_strength
+            volume_change = strength.get("volume_change")
+            volume_change = 0 if pd.isna(volume_change) else volume_change
+        else:
+            relative_strength, volume_change = _stock_strength(stock_code, twii_history)
+            if relative_strength is None:
+                return market_score * 0.8, f"市場整體情緒評分：{market_score}/10"
+        
         # 4. 計算情緒得分 (0-100)
         sentiment_score = min(100, max(0, market_score * 10))  # 市場情緒 (0-100)
         
@@ -12,6 +12,8 @@ import traceback
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
+from modules.data.rate_limiter import acquire
+from modules.tracing import traced, count as count_event
 
 # 確保日誌目錄存在
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'logs')
@@ -89,6 +91,7 @@ def send_notification(message, subject, html_body=None, retry=True, urgent=False
     
     return True
 
+@traced()
 def send_email(message, subject, html_body=None, retry=True):
     """
     發送電子郵件通知，增加重試機制
@@ -143,6 +146,7 @@ def send_email(message, subject, html_body=None, retry=True):
         for attempt in range(max_retries):
             try:
                 # 連接SMTP伺服器並發送
+                count_event("smtp.attempts")
                 if smtp_port == 465:
                     # SSL連接
                     with smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=30) as server:
@@ -239,6 +243,7 @@ def try_alternative_smtp(msg, smtp_user, smtp_password, email_to):
         log_notification_event(f"嘗試備用SMTP服務失敗: {e}", 'error')
         return False
 
+@traced()
 def send_line_notify(message, retry=True):
     """
     發送LINE Notify通知，增加重試機制
@@ -296,6 +301,8 @@ def send_line_notify(message, retry=True):
                     headers = {'Authorization': f'Bearer {token}'}
                     data = {'message': msg_part}
                     
+                    acquire('line')
+                    count_event("http.requests")
                     response = requests.post(url, headers=headers, data=data, timeout=30)
                     
                     if response.status_code == 200:
@@ -754,6 +761,7 @@ def send_weak_stock_alerts(stocks):
     subject = f"【極弱股警示】- {today}"
     send_notification(message, subject, html_body)
 
+@traced()
 def send_combined_recommendations(strategies_data, time_slot):
     """
     發送包含三種策略的股票推薦通知
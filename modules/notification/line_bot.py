@@ -8,6 +8,8 @@ import os
 import time
 import random
 import json
+from modules.data.rate_limiter import acquire, penalize
+from modules.data.endpoints import endpoint_url
 
 # 從環境變數獲取 LINE Bot 設定
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
@@ -90,8 +92,9 @@ def send_line_bot_message(message: str, max_retries=2):
     # 重試機制
     for attempt in range(max_retries + 1):
         try:
+            acquire('line')
             response = requests.post(
-                "https://api.line.me/v2/bot/message/push", 
+                endpoint_url('line', "/v2/bot/message/push"),
                 headers=headers, 
                 json=payload, 
                 timeout=30  # 增加超時時間
@@ -134,10 +137,10 @@ def send_line_bot_message(message: str, max_retries=2):
                     full_error = f"{error_msg} - 內容: {response_body}"
                     raise Exception(full_error)
                 
-                # 等待較長時間後重試
+                # 清空 LINE 令牌桶，下一次送出前會自動等待
                 wait_time = 5 * (attempt + 1)
                 print(f"[line_bot] ⏳ 等待 {wait_time} 秒後重試 ({attempt+1}/{max_retries})...")
-                time.sleep(wait_time)
+                penalize('line', wait_time)
                 continue
             
             # 其他錯誤
@@ -226,7 +229,7 @@ def check_line_service_status():
         }
         
         response = requests.get(
-            "https://api.line.me/v2/bot/info", 
+            endpoint_url('line', "/v2/bot/info"),
             headers=headers,
             timeout=10
         )
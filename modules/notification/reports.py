@@ -6,7 +6,7 @@ print("[reports] ✅ 已載入最新版")
 from datetime import datetime
 from modules.notification.line_bot import send_line_bot_message
 from modules.analysis.technical import analyze_technical_indicators
-from modules.data.fetcher import get_top_stocks
+from modules.data.fetcher import get_top_stocks, get_stock_name
 from modules.analysis.recommender import get_stock_recommendations, get_weak_valley_alerts
 
 def analyze_opening():
@@ -109,11 +109,8 @@ def analyze_dividend():
         for sid in top_stocks:
             if sid in dividend_data and dividend_data[sid] >= 4.0:  # 殖利率 >= 4% 視為高息股
                 try:
-                    # 獲取股票名稱和其他資料
-                    import yfinance as yf
-                    ticker = yf.Ticker(f"{sid}.TW")
-                    info = ticker.info
-                    name = info.get('shortName', sid)
+                    # 由股票基本資料表取得股票名稱
+                    name = get_stock_name(sid)
                     
                     # 獲取 EPS
                     eps = eps_data.get(sid, {}).get("eps", None)
@@ -0,0 +1,318 @@
+"""
+執行追蹤模組 - 以巢狀計時區段 (span) 與計數器記錄一次推播各階段的耗時、
+HTTP 請求數、傳輸位元組與快取命中，結束時寫出 JSON 執行剖析並列出最慢的區段
+"""
+print("[tracing] ✅ 已載入最新版")
+
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+# 剖析檔輸出目錄
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
+
+# 是否記錄區段與計數器 (關閉時區段仍計時，但不保存)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ('true', 'yes', '1', 'on')
+
+# 摘要列出的最慢區段數
+TRACE_TOP_N = int(os.getenv("TRACE_TOP_N", "10"))
+
+# 單次執行最多保存的區段數 (超過時只累計彙總，避免全市場掃描時剖析檔過大)
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "5000"))
+
+
+class Tracer:
+    """
+    執行追蹤器
+
+    - span：以 with 區塊或裝飾器計時，同一執行緒內自動記錄父區段形成巢狀結構
+    - count：累計計數器 (例如 http.requests、http.bytes、http_cache.hits)
+    - start_run / finish_run：一次推播的開始與結束，結束時寫出 logs/profile_<名稱>_<時間>.json
+    """
+
+    # 全局共用實例
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        """
+        獲取全局共用的追蹤器
+
+        返回:
+        - Tracer: 實例
+        """
+        with Tracer._instance_lock:
+            if Tracer._instance is None:
+                Tracer._instance = Tracer()
+            return Tracer._instance
+
+    def __init__(self, log_dir=LOG_DIR, enabled=TRACING_ENABLED):
+        """
+        初始化追蹤器
+
+        參數:
+        - log_dir: 剖析檔輸出目錄
+        - enabled: 是否記錄區段與計數器
+        """
+        self.log_dir = log_dir
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_id = 0
+        self.reset()
+
+    def reset(self, run_name=None):
+        """
+        清除已記錄的區段與計數器
+
+        參數:
+        - run_name: 新的執行名稱
+        """
+        with self._lock:
+            self.run_name = run_name
+            self.started_at = datetime.now()
+            self._run_start = time.perf_counter()
+            self.spans = []
+            self.totals = {}  # 區段名稱 -> {"count", "total", "max"}
+            self.counters = {}
+
+    def _stack(self):
+        """取得目前執行緒的區段堆疊"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, record):
+        """保存一個已結束的區段並累計彙總"""
+        with self._lock:
+            total = self.totals.setdefault(record["name"], {"count": 0, "total": 0.0, "max": 0.0})
+            total["count"] += 1
+            total["total"] += record["duration"]
+            total["max"] = max(total["max"], record["duration"])
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(record)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        計時一個區段
+
+        參數:
+        - name: 區段名稱 (建議 "模組.階段"，例如 "technical.history")
+        - attrs: 附加資訊 (例如股票數)
+
+        返回:
+        - 區段字典，離開 with 區塊後 "duration" 為耗時秒數
+        """
+        stack = self._stack()
+        with self._lock:
+            self._next_id += 1
+            span_id = self._next_id
+        record = {
+            "id": span_id,
+            "name": name,
+            "parent": stack[-1] if stack else None,
+            "depth": len(stack),
+            "thread": threading.current_thread().name,
+            "start": time.perf_counter() - self._run_start,
+            "duration": 0.0,
+        }
+        if attrs:
+            record["attrs"] = attrs
+
+        stack.append(span_id)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["duration"] = time.perf_counter() - started
+            stack.pop()
+            if self.enabled:
+                self._record(record)
+
+    def count(self, name, value=1):
+        """
+        累計計數器
+
+        參數:
+        - name: 計數器名稱
+        - value: 增加的數值
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def profile(self):
+        """
+        取得目前的執行剖析
+
+        返回:
+        - 字典 {"run", "started_at", "elapsed", "counters", "totals", "spans"}
+        """
+        with self._lock:
+            totals = {
+                name: {"count": t["count"], "total": round(t["total"], 4), "max": round(t["max"], 4)}
+                for name, t in sorted(self.totals.items(), key=lambda item: -item[1]["total"])
+            }
+            spans = [dict(record, start=round(record["start"], 4), duration=round(record["duration"], 4))
+                     for record in self.spans]
+            return {
+                "run": self.run_name,
+                "started_at": self.started_at.isoformat(),
+                "elapsed": round(time.perf_counter() - self._run_start, 4),
+                "counters": dict(self.counters),
+                "totals": totals,
+                "spans": spans,
+            }
+
+    def summary(self, top_n=TRACE_TOP_N):
+        """
+        輸出最慢的區段與計數器摘要
+
+        參數:
+        - top_n: 列出的區段數
+        """
+        profile = self.profile()
+        print(f"[tracing] ⏱️ {profile['run'] or '執行'}總耗時 {profile['elapsed']:.2f}s，最慢的 {top_n} 個區段：")
+        for record in sorted(profile["spans"], key=lambda r: -r["duration"])[:top_n]:
+            indent = "  " * record["depth"]
+            print(f"[tracing]   {record['duration']:8.3f}s {indent}{record['name']}")
+        if profile["counters"]:
+            counters = "、".join(f"{name}={value}" for name, value in sorted(profile["counters"].items()))
+            print(f"[tracing] 📊 {counters}")
+
+    def save(self):
+        """
+        將執行剖析寫入 logs/profile_<名稱>_<時間>.json
+
+        返回:
+        - 剖析檔路徑，寫入失敗時返回 None
+        """
+        profile = self.profile()
+        name = profile["run"] or "run"
+        path = os.path.join(self.log_dir, f"profile_{name}_{self.started_at:%Y%m%d_%H%M%S}.json")
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            tmp_file = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(profile, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, path)
+            return path
+        except Exception as e:
+            print(f"[tracing] ⚠️ 寫入執行剖析失敗: {e}")
+            return None
+
+
+def span(name, **attrs):
+    """
+    以全局追蹤器計時一個區段 (便捷函數)
+
+    參數:
+    - name: 區段名稱
+    - attrs: 附加資訊
+
+    返回:
+    - context manager，產生區段字典
+    """
+    return Tracer.get_instance().span(name, **attrs)
+
+
+def traced(name=None):
+    """
+    將函數整體計為一個區段的裝飾器
+
+    參數:
+    - name: 區段名稱，None 表示使用 "模組.函數名稱"
+
+    返回:
+    - 裝飾器
+    """
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Tracer.get_instance().span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """
+    累計全局計數器 (便捷函數)
+
+    參數:
+    - name: 計數器名稱
+    - value: 增加的數值
+    """
+    Tracer.get_instance().count(name, value)
+
+
+def start_run(run_name):
+    """
+    開始一次執行 (例如一次推播)，清除先前的區段與計數器
+
+    參數:
+    - run_name: 執行名稱 (用於剖析檔名)
+    """
+    Tracer.get_instance().reset(run_name)
+
+
+def finish_run(top_n=TRACE_TOP_N):
+    """
+    結束一次執行：輸出最慢區段摘要並寫出 JSON 剖析檔
+
+    參數:
+    - top_n: 摘要列出的區段數
+
+    返回:
+    - 剖析檔路徑，未啟用或寫入失敗時返回 None
+    """
+    tracer = Tracer.get_instance()
+    if not tracer.enabled:
+        return None
+    tracer.summary(top_n)
+    path = tracer.save()
+    if path:
+        print(f"[tracing] ✅ 已寫入執行剖析: {path}")
+    return path
+
+
+def install_session_tracing(session):
+    """
+    包裝 session.request，累計實際送出的 HTTP 請求數、回應位元組與錯誤數
+    (應安裝在 HTTP 快取之內，快取命中的請求不計入)
+
+    參數:
+    - session: requests.Session 物件
+
+    返回:
+    - 同一個 session
+    """
+    original_request = session.request
+    tracer = Tracer.get_instance()
+
+    def request_with_tracing(method, url, **kwargs):
+        tracer.count("http.requests")
+        try:
+            response = original_request(method, url, **kwargs)
+        except Exception:
+            tracer.count("http.errors")
+            raise
+        if not kwargs.get('stream'):
+            tracer.count("http.bytes", len(response.content or b''))
+        return response
+
+    session.request = request_with_tracing
+    return session
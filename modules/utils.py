@@ -13,6 +13,7 @@ import requests
 import shutil
 import sys
 import importlib
+from modules.cache_store import TwoTierCache
 
 # 設定緩存目錄位置
 CACHE_DIR = os.path.join(os.path.dirname(__file__), '../cache')
@@ -130,27 +131,20 @@ def check_network_connectivity(targets=None, timeout=5):
 
 def create_cache_file(key, data, expiry_hours=24):
     """
-    創建緩存文件
+    創建緩存文件 (經由兩層快取原子寫入，每個鍵各自的過期時間)
     
     參數:
     - key: 緩存鍵名
     - data: 要儲存的數據
-    - expiry_hours: 過期時間 (小時)
+    - expiry_hours: 過期時間 (小時)，None 表示不過期
     
     返回:
     - bool: 是否成功創建
     """
     try:
-        cache_file = os.path.join(CACHE_DIR, f"{key}.json")
-        
-        cache_data = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "expiry": (datetime.datetime.now() + datetime.timedelta(hours=expiry_hours)).isoformat(),
-            "data": data
-        }
-        
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        ttl = expiry_hours * 3600 if expiry_hours is not None else None
+        if not get_key_cache().set(key, data, ttl=ttl):
+            return False
             
         print(f"[utils] ✅ 已創建緩存文件: {key}.json")
         return True
@@ -161,39 +155,43 @@ def create_cache_file(key, data, expiry_hours=24):
 
 def get_cache_file(key, default=None):
     """
-    讀取緩存文件
+    讀取緩存文件 (記憶體 LRU 優先，檔案 mtime/大小未變動時不重新解析)
     
     參數:
     - key: 緩存鍵名
     - default: 當緩存不存在或已過期時返回的默認值
     
     返回:
-    - 緩存的數據，或者默認值
+    - 緩存的數據 (行程內共用，不可就地修改)，或者默認值
     """
     try:
-        cache_file = os.path.join(CACHE_DIR, f"{key}.json")
-        
-        if not os.path.exists(cache_file):
-            return default
-            
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
-            
-        # 檢查過期時間
-        if "expiry" in cache_data:
-            expiry_time = datetime.datetime.fromisoformat(cache_data["expiry"])
-            
-            if datetime.datetime.now() > expiry_time:
-                print(f"[utils] ⚠️ 緩存已過期: {key}.json")
-                return default
-                
-        print(f"[utils] ✅ 使用緩存: {key}.json")
-        return cache_data.get("data", default)
-        
+        return get_key_cache().get(key, default)
     except Exception as e:
         print(f"[utils] ❌ 讀取緩存文件失敗 ({key}): {e}")
         return default
 
+def get_key_cache():
+    """
+    取得 create_cache_file / get_cache_file 使用的兩層快取 (目錄跟隨 CACHE_DIR)
+    
+    返回:
+    - TwoTierCache: 實例
+    """
+    cache = TwoTierCache.get_instance()
+    if os.path.abspath(cache.cache_dir) != os.path.abspath(CACHE_DIR):
+        with TwoTierCache._instance_lock:
+            cache = TwoTierCache._instance = TwoTierCache(CACHE_DIR)
+    return cache
+
+def get_cache_stats():
+    """
+    取得 get_cache_file 的命中統計 (命中/磁碟命中/未命中/過期/淘汰次數)，供監控使用
+    
+    返回:
+    - dict: 統計數據
+    """
+    return get_key_cache().stats()
+
 def check_module_dependencies():
     """
     檢查所需模組是否已安裝
@@ -299,6 +297,11 @@ def check_system_health():
     else:
         print(f"[utils] ⚠️ 緩存目錄不存在: {CACHE_DIR}")
     
+    # 快取命中統計
+    cache_stats = get_cache_stats()
+    print(f"[utils] 快取命中率: {cache_stats['hit_rate']}% (記憶體 {cache_stats['hits']}、磁碟 {cache_stats['disk_hits']}、"
+          f"未命中 {cache_stats['misses']}、過期 {cache_stats['expired']}、淘汰 {cache_stats['evictions']})")
+    
     # 整體系統健康評估
     system_healthy = (
         module_check["all_installed"] and
@@ -316,6 +319,7 @@ def check_system_health():
         "modules": module_check,
         "network": network_check,
         "cache": cache_status,
+        "cache_stats": cache_stats,
         "timestamp": datetime.datetime.now().isoformat()
     }
 
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+技術指標一致性測試腳本
+以合成股價 (含個別股票缺漏K線) 比對向量化訊號表與原本逐檔計算的結果
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from modules.analysis.indicators import build_price_panel, compute_signal_table, score_signal_table
+
+
+def make_frames(stocks=40, bars=60, seed=7):
+    """產生合成股價，部分股票缺漏K線 (停牌、下載缺值) 或上市較晚"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2024-01-01", periods=bars)
+    frames = {}
+    for i in range(stocks):
+        close = 50 * np.exp(np.cumsum(rng.normal(0.002, 0.02, bars)))
+        df = pd.DataFrame({
+            "Open": close * (1 + rng.normal(0, 0.005, bars)),
+            "High": close * (1 + rng.uniform(0, 0.02, bars)),
+            "Low": close * (1 - rng.uniform(0, 0.02, bars)),
+            "Close": close,
+            "Volume": rng.integers(1000, 100000, bars).astype(float),
+        }, index=dates)
+        if i % 4 == 1:
+            # 5 個交易日前缺一根K線
+            df = df.drop(dates[-6])
+        elif i % 4 == 2:
+            # 多處缺漏，其中一天只缺最高價
+            df = df.drop(dates[[10, 25, -3]])
+            df.loc[dates[-10], "High"] = np.nan
+        elif i % 4 == 3:
+            # 較晚上市
+            df = df.iloc[rng.integers(5, 25):]
+        frames[f"{1100 + i}"] = df
+    return frames
+
+
+def legacy_signals(df):
+    """原本 generate_ta_signals 逐檔計算的指標 (未向量化版本)"""
+    df = df.dropna().copy()
+    df.reset_index(inplace=True)
+
+    macd = df["Close"].ewm(span=12).mean() - df["Close"].ewm(span=26).mean()
+    signal = macd.ewm(span=9).mean()
+    macd_signal = int(macd.iloc[-1] > signal.iloc[-1])
+
+    low_min = df["Low"].rolling(window=9).min()
+    high_max = df["High"].rolling(window=9).max()
+    denom = high_max - low_min
+    rsv = pd.Series(np.zeros(len(df)))
+    valid_denom = ~(denom == 0)
+    rsv[valid_denom] = (df["Close"][valid_denom] - low_min[valid_denom]) / denom[valid_denom] * 100
+    k = rsv.ewm(com=2).mean()
+    d = k.ewm(com=2).mean()
+
+    delta = df["Close"].diff()
+    avg_gain = delta.clip(lower=0).rolling(window=14).mean()
+    avg_loss = (-delta).clip(lower=0).rolling(window=14).mean()
+    rs = pd.Series(np.zeros(len(df)))
+    valid_loss = avg_loss > 0
+    rs[valid_loss] = avg_gain[valid_loss] / avg_loss[valid_loss]
+    rsi = 100 - (100 / (1 + rs))
+
+    ma5 = df["Close"].rolling(window=5).mean()
+    ma20 = df["Close"].rolling(window=20).mean()
+    upper = ma20 + 2 * df["Close"].rolling(window=20).std()
+
+    return {
+        "MACD": macd_signal,
+        "K": float(k.dropna().iloc[-1]),
+        "D": float(d.dropna().iloc[-1]),
+        "RSI": float(rsi.dropna().iloc[-1]),
+        "均線": int(ma5.iloc[-1] > ma20.iloc[-1]),
+        "布林通道": int(df["Close"].iloc[-1] > upper.iloc[-1]),
+    }
+
+
+def test_signal_table_matches_legacy():
+    """向量化訊號表與逐檔計算一致 (含缺漏K線的股票)"""
+    frames = make_frames()
+    table = compute_signal_table(build_price_panel(frames))
+
+    expected = {}
+    for stock_id, df in frames.items():
+        if len(df.dropna()) >= 30:
+            expected[stock_id] = legacy_signals(df)
+
+    assert sorted(table.index) == sorted(expected), "股票清單不一致"
+    for stock_id, legacy in expected.items():
+        row = table.loc[stock_id]
+        for column in ("MACD", "均線", "布林通道"):
+            assert int(row[column]) == legacy[column], f"{stock_id} {column}: {row[column]} != {legacy[column]}"
+        for column in ("K", "D", "RSI"):
+            assert abs(float(row[column]) - legacy[column]) < 1e-6, \
+                f"{stock_id} {column}: {row[column]} != {legacy[column]}"
+
+
+def test_gap_does_not_change_signals():
+    """其他股票多出的交易日 (寬表聯集) 不影響單一股票的結果"""
+    frames = make_frames()
+    alone = {stock_id: compute_signal_table(build_price_panel({stock_id: df}))
+             for stock_id, df in frames.items()}
+    together = compute_signal_table(build_price_panel(frames))
+
+    for stock_id, table in alone.items():
+        if table.empty:
+            continue
+        pd.testing.assert_series_equal(together.loc[stock_id], table.loc[stock_id], check_names=False)
+
+    # 缺漏K線的股票不應被誤判為走弱
+    scores = score_signal_table(together)
+    for stock_id, table in alone.items():
+        if not table.empty:
+            assert scores[stock_id]["label"] == score_signal_table(table)[stock_id]["label"]
+
+
+def run_all_tests():
+    """執行所有測試"""
+    print("=" * 50)
+    print(f"技術指標一致性測試開始 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
+
+    tests = [
+        ("逐檔計算一致性測試", test_signal_table_matches_legacy),
+        ("缺漏K線測試", test_gap_does_not_change_signals),
+    ]
+
+    all_success = True
+    for name, test_func in tests:
+        try:
+            test_func()
+            print(f"  {name}: ✅ 成功")
+        except AssertionError as e:
+            all_success = False
+            print(f"  {name}: ❌ 失敗 - {e}")
+
+    print("-" * 50)
+    print("所有測試都成功通過!" if all_success else "部分測試失敗，請檢查輸出日誌找出問題。")
+    print("=" * 50)
+    return all_success
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if run_all_tests() else 1)